@@ -4,3 +4,23 @@ from django.apps import AppConfig
 class AppControlConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app_control'
+
+    def ready(self):
+        from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+        from inventory_api.caching import invalidate_model_cache
+        from user_control.models import CustomUser
+        from .models import (track_user_search_fields, refresh_user_search_documents, add_tombstone,
+                             detach_nulled_references, Inventory, InventoryGroup, Shop, Invoice)
+
+        pre_save.connect(track_user_search_fields, sender=CustomUser)
+        post_save.connect(refresh_user_search_documents, sender=CustomUser)
+
+        for model in (Inventory, InventoryGroup, Shop, Invoice, CustomUser):
+            post_save.connect(invalidate_model_cache, sender=model)
+            post_delete.connect(invalidate_model_cache, sender=model)
+
+        # Deletions are kept as tombstones for /sync.
+        for model in (Inventory, InventoryGroup, Shop):
+            post_delete.connect(add_tombstone, sender=model)
+        for model in (InventoryGroup, Shop, CustomUser):
+            pre_delete.connect(detach_nulled_references, sender=model)
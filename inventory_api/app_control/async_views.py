@@ -0,0 +1,87 @@
+import asyncio
+import functools
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.http import JsonResponse
+from inventory_api.caching import async_cache_response
+from inventory_api.custom_methods import IsAuthenticatedCustom
+from inventory_api.db_routers import read_from_replica
+from user_control.models import CustomUser
+from .models import Inventory, InventoryGroup, Shop, Invoice
+from .views import (get_in_stock_count, get_group_count, get_shop_count, get_user_count, get_top_selling,
+                    get_sales_by_shop, get_purchase_summary)
+
+
+# Async versions of the dashboard endpoints, for deployments served through
+# asgi.py. They return the same data as their sync counterparts in views.py.
+
+
+async def run_query(function, *args):
+    # sync_to_async would run every query on the one thread shared by the
+    # request, so gathered queries would still queue up. Each call gets a
+    # worker thread, and so a database connection, of its own instead.
+    def run():
+        try:
+            return function(*args)
+        finally:
+            close_old_connections()
+
+    return await sync_to_async(run, thread_sensitive=False)()
+
+
+def async_api_view(view):
+    # Authenticates with the same JWT check as the DRF views and renders the
+    # returned data as JSON. Every async view is a read-only analytics one,
+    # so reads go to the replica when there is one.
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+
+        if not await IsAuthenticatedCustom().has_permission_async(request):
+            return JsonResponse({"detail": "Authentication credentials were not provided."}, status=403)
+
+        with read_from_replica():
+            data = await view(request, *args, **kwargs)
+        response = JsonResponse(data, safe=False, encoder=DjangoJSONEncoder)
+        if hasattr(request, "cache_hit"):
+            response["X-Cache"] = "HIT" if request.cache_hit else "MISS"
+        return response
+    return wrapper
+
+
+@async_api_view
+@async_cache_response(Inventory, InventoryGroup, Shop, CustomUser)
+async def summary_view(request):
+    total_inventory, total_group, total_shop, total_user = await asyncio.gather(
+        run_query(get_in_stock_count),
+        run_query(get_group_count),
+        run_query(get_shop_count),
+        run_query(get_user_count)
+    )
+
+    return {
+        "total_inventory": total_inventory,
+        "total_group": total_group,
+        "total_shop": total_shop,
+        "total_user": total_user
+    }
+
+
+@async_api_view
+@async_cache_response(Invoice, Inventory)
+async def top_selling_view(request):
+    return await run_query(get_top_selling, request.GET.dict())
+
+
+@async_api_view
+@async_cache_response(Invoice, Shop)
+async def sale_by_shop_view(request):
+    return await run_query(get_sales_by_shop, request.GET.dict())
+
+
+@async_api_view
+@async_cache_response(Invoice)
+async def purchase_summary_view(request):
+    return await run_query(get_purchase_summary, request.GET.dict())
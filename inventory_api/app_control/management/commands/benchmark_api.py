@@ -0,0 +1,865 @@
+import base64
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext, setup_databases, setup_test_environment, teardown_databases
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from inventory_api import caching
+from inventory_api.renderers import ORJSONRenderer
+from inventory_api.utils import (CustomPagination, KeysetPagination, decodeJWT, get_access_token, user_cache,
+                                 token_cache)
+from app_control.models import (DailySale, Inventory, InventoryGroup, Invoice, Shop, InvoiceItem, StockMovement,
+                                StockSnapshot, get_stock_as_of, reconcile_stock, take_stock_snapshots)
+from user_control.activity import ActivityWriter
+from user_control.models import CustomUser, UserActivities
+from app_control.serializers import InventorySerializer
+from app_control.views import InventoryCSVLoaderView, InventoryView, InvoiceView, ShopView
+from .generate_data import generate_dataset, scales
+
+
+def get_endpoints(end_date):
+    # (name, method, path, query or body) of every benchmarked request. The
+    # write endpoints build their body per iteration, from the dataset.
+    month_start = end_date.replace(day=1).isoformat()
+    shop_id = Shop.objects.order_by("id").values_list("id", flat=True).first()
+    group_ids = list(InventoryGroup.objects.order_by("id").values_list("id", flat=True)[:10])
+    item_ids = list(Inventory.objects.filter(remaining__gte=100).order_by("id").values_list("id", flat=True)[:50])
+    keyword = Inventory.objects.order_by("id").values_list("name", flat=True).first().split()[1].lower()
+
+    def csv_upload(iteration):
+        rows = "".join(
+            f"{group_ids[row % len(group_ids)]},Benchmark item {iteration}-{row},{row + 1},{row % 50 + 0.5}\n"
+            for row in range(100)
+        )
+        return {"data": io.BytesIO(rows.encode())}, "multipart"
+
+    def invoice(iteration):
+        return {"shop_id": shop_id, "invoice_item_data": [
+            {"item_id": item_ids[(iteration * 3 + line) % len(item_ids)], "quantity": 1} for line in range(3)
+        ]}, "json"
+
+    return [
+        ("inventory list", "get", "/app/inventory", {}),
+        ("inventory search", "get", "/app/inventory", {"keyword": keyword}),
+        ("inventory cursor page", "get", "/app/inventory", {"pagination": "cursor"}),
+        ("inventory list ids and stock", "get", "/app/inventory", {"fields": "id,code,name,remaining"}),
+        ("inventory list expand group", "get", "/app/inventory", {"expand": "group"}),
+        ("group list", "get", "/app/group", {}),
+        ("group list names", "get", "/app/group", {"fields": "id,name,belongs_to"}),
+        ("group tree", "get", "/app/group-tree", {}),
+        ("shop list", "get", "/app/shop", {}),
+        ("invoice list", "get", "/app/invoice", {}),
+        ("invoice search", "get", "/app/invoice", {"keyword": "store"}),
+        ("invoice list headers", "get", "/app/invoice", {"fields": "id,created_at,shop"}),
+        ("invoice list expand items", "get", "/app/invoice", {"expand": "shop,invoice_items"}),
+        ("activities list", "get", "/user/activities-log", {}),
+        ("stock movements", "get", "/app/stock-movement", {}),
+        ("stock movements compact", "get", "/app/stock-movement", {"fields": "id,item_id,kind,quantity,created_at"}),
+        ("stock levels", "get", "/app/stock-level", {}),
+        ("summary", "get", "/app/summary", {}),
+        ("top selling", "get", "/app/top-selling", {}),
+        ("top selling this month", "get", "/app/top-selling", {"start_date": month_start}),
+        ("sale by shop", "get", "/app/sale-by-shop", {}),
+        ("sale by shop monthly", "get", "/app/sale-by-shop", {"monthly": "true"}),
+        ("purchase summary", "get", "/app/purchase-summary", {}),
+        ("dashboard", "get", "/app/dashboard", {}),
+        ("csv import 100 rows", "post", "/app/inventory-csv", csv_upload),
+        ("invoice create", "post", "/app/invoice", invoice),
+    ]
+
+
+def summarize(samples):
+    percentiles = statistics.quantiles(samples, n=100) if len(samples) > 1 else samples * 99
+    return {
+        "p50": percentiles[49], "p90": percentiles[89], "p99": percentiles[98],
+        "mean": statistics.fmean(samples), "max": max(samples)
+    }
+
+
+def get_rss():
+    # Resident set size of this process in bytes. Outside Linux only the
+    # peak so far is available, which still bounds a single run from above.
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakMemory:
+    # Samples the resident set size while open and keeps the peak, to report
+    # how far memory grew above where it started.
+    interval = 0.005
+
+    def __enter__(self):
+        self.start = self.peak = get_rss()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.running = False
+        self.thread.join()
+        self.peak = max(self.peak, get_rss())
+
+    def sample(self):
+        while self.running:
+            self.peak = max(self.peak, get_rss())
+            time.sleep(self.interval)
+
+    @property
+    def growth_mb(self):
+        return (self.peak - self.start) / 2 ** 20
+
+
+# Benchmarks of a single feature, run with --suite NAME instead of the
+# endpoint benchmark. Each one generates the data it needs into the test
+# database and returns its results.
+suites = {}
+
+
+def suite(name):
+    def register(function):
+        suites[name] = function
+        return function
+    return register
+
+
+def prepare_dataset(options, **counts):
+    call_command("flush", interactive=False, verbosity=0)
+    cache.clear()
+    generate_dataset(seed=options["seed"], end_date=options["end_date"], **{**scales["small"], **counts})
+    return CustomUser.objects.filter(role="admin").order_by("id").first()
+
+
+def get_client(user, **kwargs):
+    client = APIClient(**kwargs)
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_access_token({'user_id': user.id}, 1)}")
+    return client
+
+
+@suite("invoice-concurrency")
+def benchmark_invoice_concurrency(command, options):
+    # Workers post invoices for the same few items at once, with stock for
+    # about half of what they ask for. Afterwards every unit must be either
+    # sold or still in stock, with no item oversold and the stock ledger
+    # agreeing with remaining. Run it on PostgreSQL: SQLite allows a single
+    # writer, so its workers mostly wait on each other.
+    user = prepare_dataset(options, invoices=0, activities=0)
+    shop_id = Shop.objects.order_by("id").values_list("id", flat=True).first()
+    item_ids = list(Inventory.objects.order_by("id").values_list("id", flat=True)[:5])
+    invoices_per_worker = options["iterations"]
+
+    results = {}
+    for workers in options["workers"] or [1, 2, 4, 8]:
+        stock = workers * invoices_per_worker * 6 // (2 * len(item_ids)) + 1
+        for item in Inventory.objects.filter(id__in=item_ids):
+            item.remaining = stock
+            item.save()
+        sold_before = {
+            item_id: sum(InvoiceItem.objects.filter(item_id=item_id).values_list("quantity", flat=True))
+            for item_id in item_ids
+        }
+        outcomes = {"created": 0, "out_of_stock": 0, "errors": 0}
+        latencies = []
+        lock = threading.Lock()
+
+        def work(number):
+            rng = random.Random(number)
+            client = get_client(user, raise_request_exception=False)
+            try:
+                for _ in range(invoices_per_worker):
+                    lines = [{"item_id": item_id, "quantity": rng.randint(1, 3)}
+                             for item_id in rng.sample(item_ids, 3)]
+                    started = time.perf_counter()
+                    response = client.post("/app/invoice", {"shop_id": shop_id, "invoice_item_data": lines},
+                                           format="json")
+                    elapsed = (time.perf_counter() - started) * 1000
+                    if response.status_code == 201:
+                        outcome = "created"
+                    elif response.status_code == 400 and b"Not enough items" in response.content:
+                        outcome = "out_of_stock"
+                    else:
+                        outcome = "errors"
+                    with lock:
+                        outcomes[outcome] += 1
+                        latencies.append(elapsed)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=work, args=(number,)) for number in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - started
+
+        remaining = dict(Inventory.objects.filter(id__in=item_ids).values_list("id", "remaining"))
+        sold = {
+            item_id: sum(InvoiceItem.objects.filter(item_id=item_id).values_list("quantity", flat=True))
+            - sold_before[item_id] for item_id in item_ids
+        }
+        results[workers] = {
+            **outcomes,
+            "invoices_per_second": outcomes["created"] / seconds,
+            "requests_per_second": len(latencies) / seconds,
+            "latency_ms": summarize(latencies),
+            "stock_per_item": stock,
+            "consistent": all(sold[item_id] + remaining[item_id] == stock for item_id in item_ids),
+            "oversold": any(remaining[item_id] < 0 for item_id in item_ids),
+            "ledger_mismatches": sum(1 for row in reconcile_stock() if row[0] in item_ids),
+        }
+        command.stderr.write(f"{workers} workers: {results[workers]['invoices_per_second']:.1f} invoices/s, "
+                             f"{outcomes['out_of_stock']} out of stock, {outcomes['errors']} errors")
+    return results
+
+
+@suite("csv-import")
+def benchmark_csv_import(command, options):
+    # Imports CSV files of each size through the loader's chunked pipeline,
+    # reading them from disk like an upload spooled to a temporary file, and
+    # reports rows/s and how far the resident memory grew. An in-memory
+    # SQLite test database grows inside the process with the imported rows;
+    # on PostgreSQL the growth is the pipeline's alone and stays flat.
+    user = prepare_dataset(options, items=0, invoices=0, activities=0)
+    group_ids = list(InventoryGroup.objects.order_by("id").values_list("id", flat=True))
+    view = InventoryCSVLoaderView()
+
+    results = {}
+    for size in options["sizes"] or [10000, 100000, 1000000]:
+        with tempfile.TemporaryFile() as file:
+            for offset in range(0, size, 10000):
+                file.write("".join(
+                    f"{group_ids[row % len(group_ids)]},Imported item {size}-{row},{row % 500 + 1},{row % 90 + 0.5}\n"
+                    for row in range(offset, min(size, offset + 10000))
+                ).encode())
+            file.seek(0)
+
+            created = 0
+            errors = 0
+            with PeakMemory() as memory:
+                started = time.perf_counter()
+                for chunk in view.get_chunks(file):
+                    chunk_created, chunk_errors = view.import_chunk(chunk, user)
+                    created += chunk_created
+                    errors += len(chunk_errors)
+                seconds = time.perf_counter() - started
+
+        results[size] = {
+            "created": created, "errors": errors, "seconds": seconds,
+            "rows_per_second": size / seconds, "peak_rss_growth_mb": memory.growth_mb,
+        }
+        command.stderr.write(f"{size} rows: {size / seconds:.0f} rows/s, RSS +{memory.growth_mb:.1f} MiB")
+    return results
+
+
+@suite("auth")
+def benchmark_auth(command, options):
+    # Cost of authenticating one request: a cold call verifies the token
+    # and loads the user, a warm one finds both in the caches.
+    user = prepare_dataset(options, items=0, invoices=0, activities=0)
+    bearer = f"Bearer {get_access_token({'user_id': user.id}, 1)}"
+    iterations = options["iterations"] * 50
+
+    results = {}
+    for mode in ("cold", "warm"):
+        latencies = []
+        for _ in range(iterations):
+            if mode == "cold":
+                user_cache.clear()
+                token_cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                decodeJWT(bearer)
+                latencies.append((time.perf_counter() - started) * 1000000)
+        results[mode] = {"us": summarize(latencies), "queries": len(captured)}
+        command.stderr.write(f"{mode}: p50 {results[mode]['us']['p50']:.1f} us, {len(captured)} queries")
+    return results
+
+
+def time_requests(client, path, params, iterations):
+    # Latency percentiles of repeated GETs, never served from the response
+    # cache; the first one is not timed.
+    latencies = []
+    for iteration in range(iterations + 1):
+        cache.clear()
+        started = time.perf_counter()
+        response = client.get(path, params)
+        if iteration:
+            latencies.append((time.perf_counter() - started) * 1000)
+    return {"status": response.status_code, **summarize(latencies)}
+
+
+@suite("activity-pages")
+def benchmark_activity_pages(command, options):
+    # Page 1 against page 5000 of the activity log, with page numbers
+    # (COUNT plus OFFSET) and with (created_at, id) cursors.
+    page_size = CustomPagination.page_size
+    results = {}
+    for size in options["sizes"] or [5000000]:
+        user = prepare_dataset(options, items=0, invoices=0, activities=size)
+        client = get_client(user)
+        page = min(5000, size // page_size)
+        last = UserActivities.objects.order_by("-created_at", "-id")[(page - 1) * page_size - 1]
+        cursor = KeysetPagination().encode_cursor(last)
+
+        requests = {
+            "page 1 by number": {"pagination": "page"},
+            f"page {page} by number": {"pagination": "page", "page": page},
+            "page 1 by cursor": {},
+            f"page {page} by cursor": {"cursor": cursor},
+            f"page {page} by cursor with count": {"cursor": cursor, "count": "true"},
+        }
+        results[size] = {}
+        for name, params in requests.items():
+            results[size][name] = time_requests(client, "/user/activities-log", params, options["iterations"])
+            command.stderr.write(f"{size} rows: {name} p50 {results[size][name]['p50']:.2f} ms")
+    return results
+
+
+def time_calls(function, iterations):
+    latencies = []
+    for iteration in range(iterations + 1):
+        started = time.perf_counter()
+        function()
+        if iteration:
+            latencies.append((time.perf_counter() - started) * 1000)
+    return summarize(latencies)
+
+
+@suite("analytics-rollups")
+def benchmark_analytics_rollups(command, options):
+    # The analytics endpoints, which read the daily rollups, next to the
+    # same answers aggregated from every invoice item. Sizes are invoice
+    # items; invoices have three on average.
+    results = {}
+    for size in options["sizes"] or [10000000]:
+        user = prepare_dataset(options, items=max(1000, size // 100), invoices=size // 3, activities=0)
+        client = get_client(user)
+        month_start = (options["end_date"] or timezone.localdate()).replace(day=1)
+        lines = InvoiceItem.objects.order_by()
+
+        raw = {
+            "top selling": lambda: list(lines.values("item_id").annotate(
+                total=Sum("quantity")).order_by("-total")[:10]),
+            "top selling this month": lambda: list(lines.filter(created_at__date__gte=month_start).values(
+                "item_id").annotate(total=Sum("quantity")).order_by("-total")[:10]),
+            "sale by shop monthly": lambda: list(lines.annotate(month=TruncMonth("created_at")).values(
+                "invoice__shop_id", "month").annotate(total=Sum("amount")).order_by("month", "-total")),
+            "purchase summary": lambda: lines.aggregate(amount=Sum("amount"), quantity=Sum("quantity")),
+        }
+        endpoints = {
+            "top selling": ("/app/top-selling", {}),
+            "top selling this month": ("/app/top-selling", {"start_date": month_start.isoformat()}),
+            "sale by shop monthly": ("/app/sale-by-shop", {"monthly": "true"}),
+            "purchase summary": ("/app/purchase-summary", {}),
+        }
+        results[size] = {"invoice_items": lines.count(), "daily_sales": DailySale.objects.count()}
+        for name, (path, params) in endpoints.items():
+            results[size][name] = {
+                "rollups": time_requests(client, path, params, options["iterations"]),
+                "raw_aggregation": time_calls(raw[name], options["iterations"]),
+            }
+            command.stderr.write(f"{size} lines: {name} p50 {results[size][name]['rollups']['p50']:.2f} ms, "
+                                 f"raw {results[size][name]['raw_aggregation']['p50']:.2f} ms")
+    return results
+
+
+@suite("response-cache")
+def benchmark_response_cache(command, options):
+    # Requests/s of the dashboard endpoints polled back to back with the
+    # response cache off, on, and on with an invoice written every ten
+    # requests, along with the hits and misses each mode recorded. Sizes
+    # are invoices.
+    paths = ("/app/summary", "/app/top-selling", "/app/sale-by-shop", "/app/purchase-summary", "/app/dashboard")
+    iterations = options["iterations"] * 10
+    modes = {
+        "off": ({"ENABLED": False}, None),
+        "on": ({"ENABLED": True}, None),
+        "on, write every 10 requests": ({"ENABLED": True}, 10),
+    }
+
+    results = {}
+    for size in options["sizes"] or [10000, 100000]:
+        user = prepare_dataset(options, invoices=size, activities=0)
+        client = get_client(user)
+        results[size] = {}
+        for path in paths:
+            results[size][path] = {}
+            for mode, (config, write_every) in modes.items():
+                cache.clear()
+                with mock.patch.dict(caching._config, config):
+                    stats = caching.get_cache_stats()
+                    latencies = []
+                    for iteration in range(iterations):
+                        if write_every and iteration % write_every == 0:
+                            caching.bump_cache_version(Invoice)
+                        started = time.perf_counter()
+                        client.get(path)
+                        latencies.append((time.perf_counter() - started) * 1000)
+                    after = caching.get_cache_stats()
+                results[size][path][mode] = {
+                    "requests_per_second": iterations / sum(latencies) * 1000,
+                    "latency_ms": summarize(latencies),
+                    "hits": after["hits"] - stats["hits"],
+                    "misses": after["misses"] - stats["misses"],
+                }
+                command.stderr.write(f"{size} invoices: {path} cache {mode} "
+                                     f"{results[size][path][mode]['requests_per_second']:.0f} requests/s")
+    return results
+
+
+@suite("photo-payload")
+def benchmark_photo_payload(command, options):
+    # Bytes and latency of an inventory list page with every photo inline,
+    # as before the photo storage, and with the photos stored and the list
+    # returning their URLs. The inline page is serialized straight from the
+    # queryset, skipping the request, so it flatters the old list slightly.
+    # Sizes are items, with photos of about 100 KB cycled from 20 images.
+    from PIL import Image
+
+    photos = []
+    for number in range(20):
+        output = io.BytesIO()
+        Image.frombytes("RGB", (180, 180), random.Random(number).randbytes(180 * 180 * 3)).save(output, format="PNG")
+        photos.append(f"data:image/png;base64,{base64.b64encode(output.getvalue()).decode()}")
+
+    results = {}
+    for size in options["sizes"] or [1000]:
+        user = prepare_dataset(options, items=0, invoices=0, activities=0)
+        client = get_client(user)
+        group = InventoryGroup.objects.order_by("id").first()
+        Inventory.objects.bulk_create([
+            Inventory(group=group, created_by=user, name=f"Photo item {number}", total=1, remaining=1, price=1,
+                      photo=photos[number % len(photos)])
+            for number in range(size)
+        ], batch_size=500)
+        page = Inventory.objects.select_related("group", "created_by").order_by("-created_at", "-id")
+
+        def render_inline():
+            return JSONRenderer().render(InventorySerializer(page[:CustomPagination.page_size], many=True).data)
+
+        results[size] = {"inline": {"bytes": len(render_inline()), **time_calls(render_inline, options["iterations"])}}
+
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch("app_control.photos.photo_storage", FileSystemStorage(location=directory)):
+            started = time.perf_counter()
+            for start in range(0, size, 500):
+                items = list(Inventory.objects.filter(photo__isnull=False).order_by("id")[:500])
+                for item in items:
+                    item.externalize_photo()
+                Inventory.objects.bulk_update(items, ["photo", "photo_hash"])
+            externalize_seconds = time.perf_counter() - started
+
+            results[size]["stored"] = {
+                "bytes": len(client.get("/app/inventory").content),
+                **time_requests(client, "/app/inventory", {}, options["iterations"]),
+            }
+        results[size]["externalize_seconds"] = externalize_seconds
+        for mode in ("inline", "stored"):
+            command.stderr.write(f"{size} items: {mode} photos {results[size][mode]['bytes']} bytes per page, "
+                                 f"p50 {results[size][mode]['p50']:.2f} ms")
+    return results
+
+
+@suite("bulk")
+def benchmark_bulk(command, options):
+    # Items/s through /app/inventory/bulk for each batch size: the same
+    # items are created, restocked and deleted, one batch per request.
+    user = prepare_dataset(options, items=0, invoices=0, activities=0)
+    client = get_client(user)
+    group_ids = list(InventoryGroup.objects.order_by("id").values_list("id", flat=True))
+
+    results = {}
+    for size in options["sizes"] or [1, 100, 10000]:
+        batches = max(1, min(options["iterations"] * 5, 10000 // size))
+        ids = []
+        seconds = {"create": 0, "update": 0, "delete": 0}
+        for batch in range(batches):
+            items = [
+                {"group_id": group_ids[number % len(group_ids)], "name": f"Bulk item {size}-{batch}-{number}",
+                 "total": 10, "price": 1.5}
+                for number in range(size)
+            ]
+            started = time.perf_counter()
+            response = client.post("/app/inventory/bulk", items, format="json")
+            seconds["create"] += time.perf_counter() - started
+            ids.append([result["id"] for result in response.data["results"] if result["status"] == "created"])
+
+        for operation, method, fields in (("update", "patch", {"remaining": 20}), ("delete", "delete", {})):
+            for batch_ids in ids:
+                started = time.perf_counter()
+                getattr(client, method)("/app/inventory/bulk", [{"id": item_id, **fields} for item_id in batch_ids],
+                                        format="json")
+                seconds[operation] += time.perf_counter() - started
+
+        items = batches * size
+        results[size] = {
+            "batches": batches,
+            "items": items,
+            "items_per_second": {operation: items / value for operation, value in seconds.items()},
+        }
+        command.stderr.write(f"batches of {size}: " + ", ".join(
+            f"{operation} {rate:.0f} items/s" for operation, rate in results[size]["items_per_second"].items()
+        ))
+    return results
+
+
+@suite("export")
+def benchmark_export(command, options):
+    # Rows/s and resident memory growth of the activity export in each
+    # output, consumed as it streams.
+    results = {}
+    for size in options["sizes"] or [1000000]:
+        user = prepare_dataset(options, items=0, invoices=0, activities=size)
+        client = get_client(user)
+        rows = UserActivities.objects.count()
+        results[size] = {}
+        for output, encoding in (("csv", ""), ("csv", "gzip"), ("ndjson", ""), ("ndjson", "gzip")):
+            name = f"{output} gzip" if encoding else output
+            started = time.perf_counter()
+            response = client.get("/user/activities-log/export", {"output": output}, HTTP_ACCEPT_ENCODING=encoding)
+            with PeakMemory() as memory:
+                size_bytes = sum(len(block) for block in response.streaming_content)
+            seconds = time.perf_counter() - started
+            results[size][name] = {
+                "rows": rows, "bytes": size_bytes, "seconds": seconds, "rows_per_second": rows / seconds,
+                "peak_rss_growth_mb": memory.growth_mb,
+            }
+            command.stderr.write(f"{size} activities: {name} {rows / seconds:.0f} rows/s, "
+                                 f"RSS +{memory.growth_mb:.1f} MiB")
+    return results
+
+
+@suite("stock-as-of")
+def benchmark_stock_as_of(command, options):
+    # Stock of one item and a stock level page as of the last day and as of
+    # the middle of the ledger, summing every movement and then again after
+    # weekly snapshots. Sizes are movements, spread over the 90 days of the
+    # dataset across one item per 10k movements.
+    results = {}
+    for size in options["sizes"] or [50000000]:
+        user = prepare_dataset(options, items=max(100, size // 10000), invoices=0, activities=0)
+        client = get_client(user)
+        item_ids = list(Inventory.objects.order_by("id").values_list("id", flat=True))
+        end = timezone.now()
+        start = end - timedelta(days=90)
+        step = (end - start) / size
+        for offset in range(0, size, 10000):
+            StockMovement.objects.bulk_create([
+                StockMovement(item_id=item_ids[number % len(item_ids)], created_by=user,
+                              created_at=start + step * number, quantity=-1 if number % 3 else 2,
+                              kind=StockMovement.SALE if number % 3 else StockMovement.RECEIPT)
+                for number in range(offset, min(size, offset + 10000))
+            ])
+
+        moments = {"last day": (end - timedelta(hours=12)).isoformat(),
+                   "middle": (start + (end - start) / 2).isoformat()}
+        item = Inventory.objects.filter(id=item_ids[len(item_ids) // 2])
+
+        def measure():
+            measured = {}
+            for name, moment in moments.items():
+                measured[name] = {
+                    "one item": time_calls(lambda: list(get_stock_as_of(moment, item).values_list(
+                        "id", "stock_as_of")), options["iterations"]),
+                    "stock level page": time_requests(client, "/app/stock-level", {"as_of": moment},
+                                                      options["iterations"]),
+                }
+            return measured
+
+        results[size] = {"movements": StockMovement.objects.count(), "items": len(item_ids),
+                         "ledger only": measure()}
+        started = time.perf_counter()
+        moment = start
+        while moment < end:
+            moment += timedelta(days=7)
+            take_stock_snapshots(min(moment, end))
+        results[size]["snapshot_seconds"] = time.perf_counter() - started
+        results[size]["snapshots"] = StockSnapshot.objects.count()
+        results[size]["with snapshots"] = measure()
+
+        for mode in ("ledger only", "with snapshots"):
+            for name in moments:
+                command.stderr.write(f"{size} movements, {mode}, as of {name}: one item p50 "
+                                     f"{results[size][mode][name]['one item']['p50']:.2f} ms, page p50 "
+                                     f"{results[size][mode][name]['stock level page']['p50']:.2f} ms")
+    return results
+
+
+@suite("search")
+def benchmark_search(command, options):
+    # ?keyword= latency on the inventory list for a common word, a rare
+    # code, two terms and a miss. On PostgreSQL the pg_trgm GIN index
+    # serves the matches; elsewhere every search scans.
+    results = {}
+    for size in options["sizes"] or [1000000]:
+        user = prepare_dataset(options, items=size, invoices=0, activities=0)
+        client = get_client(user)
+        item = Inventory.objects.select_related("group").order_by("-id").first()
+        keywords = {
+            "common word": item.name.split()[1].lower(),
+            "code": item.code,
+            "two terms": f"{item.name.split()[0]} {item.group.name.split()[1]}",
+            "no match": "zzqx",
+        }
+        results[size] = {}
+        for name, keyword in keywords.items():
+            results[size][name] = time_requests(client, "/app/inventory", {"keyword": keyword},
+                                                options["iterations"])
+            command.stderr.write(f"{size} items: {name} p50 {results[size][name]['p50']:.2f} ms")
+    return results
+
+
+@suite("activity-log")
+def benchmark_activity_log(command, options):
+    # Latency of the requests that log an activity, with the activity saved
+    # in the request and with it queued for the background writer.
+    if connection.vendor == "sqlite" and connection.is_in_memory_db():
+        raise CommandError("The background writer needs a database shared between connections, set "
+                           "DATABASES['default']['TEST']['NAME'] to a file for SQLite")
+    user = prepare_dataset(options, invoices=0, activities=0)
+    client = get_client(user)
+    group_ids = list(InventoryGroup.objects.order_by("id").values_list("id", flat=True)[:10])
+    shop_id = Shop.objects.order_by("id").values_list("id", flat=True).first()
+    item_ids = list(Inventory.objects.order_by("id").values_list("id", flat=True)[:50])
+    Inventory.objects.filter(id__in=item_ids).update(remaining=1000000)
+
+    requests = {
+        "inventory create": ("/app/inventory", lambda iteration: {
+            "group_id": group_ids[iteration % len(group_ids)], "name": f"Benchmark item {iteration}",
+            "total": 10, "price": 1.5
+        }),
+        "invoice create": ("/app/invoice", lambda iteration: {"shop_id": shop_id, "invoice_item_data": [
+            {"item_id": item_ids[(iteration * 3 + line) % len(item_ids)], "quantity": 1} for line in range(3)
+        ]}),
+    }
+
+    results = {}
+    for offset, (mode, asynchronous) in zip((0, options["iterations"] + 1),
+                                            (("synchronous", False), ("asynchronous", True))):
+        writer = ActivityWriter(asynchronous=asynchronous)
+        with mock.patch("user_control.activity._activity_writer", writer):
+            results[mode] = {}
+            for name, (path, body) in requests.items():
+                latencies = []
+                for iteration in range(options["iterations"] + 1):
+                    started = time.perf_counter()
+                    client.post(path, body(offset + iteration), format="json")
+                    if iteration:
+                        latencies.append((time.perf_counter() - started) * 1000)
+                results[mode][name] = summarize(latencies)
+                command.stderr.write(f"{mode}: {name} p50 {results[mode][name]['p50']:.2f} ms")
+            writer.shutdown()
+        results[mode]["writer"] = writer.stats()
+    return results
+
+
+@suite("serialization")
+def benchmark_serialization(command, options):
+    # Microseconds per row of the inventory, shop and invoice lists through
+    # their serializers and JSONRenderer, and through their projections and
+    # orjson. Sizes are rows rendered; both paths must give the same bytes.
+    sizes = options["sizes"] or [20, 1000]
+    prepare_dataset(options, items=max(sizes), shops=max(sizes), invoices=max(sizes), activities=0)
+    request = Request(APIRequestFactory().get("/"))
+
+    results = {}
+    for name, view_class in {"inventory": InventoryView, "shop": ShopView, "invoice": InvoiceView}.items():
+        view = view_class(action="list", request=request, format_kwarg=None, args=(), kwargs={})
+        queryset = view.get_queryset()
+        projection = view_class.projection_class.get()
+        results[name] = {}
+        for size in sizes:
+            def serialize():
+                return JSONRenderer().render(view_class.serializer_class(list(queryset[:size]), many=True).data)
+
+            def project():
+                return ORJSONRenderer().render(projection.render(list(projection.values(queryset)[:size])))
+
+            if serialize() != project():
+                raise CommandError(f"{name}: the projection renders different bytes than the serializer")
+            rows = min(size, queryset.count())
+            timings = {}
+            for path, function in (("serializer", serialize), ("projection", project)):
+                # Counted through a wrapper, as the serializer path can run
+                # more queries than the connection keeps in its log.
+                queries = []
+                with connection.execute_wrapper(lambda execute, *args: queries.append(1) or execute(*args)):
+                    function()
+                latencies = time_calls(function, options["iterations"])
+                timings[path] = {"us_per_row": latencies["p50"] * 1000 / rows, "queries": len(queries),
+                                 **latencies}
+            timings["speedup"] = timings["serializer"]["p50"] / timings["projection"]["p50"]
+            results[name][size] = timings
+            command.stderr.write(f"{name}, {rows} rows: serializer {timings['serializer']['us_per_row']:.1f} us/row, "
+                                 f"projection {timings['projection']['us_per_row']:.1f} us/row, "
+                                 f"{timings['speedup']:.1f}x")
+    return results
+
+
+@suite("conditional-get")
+def benchmark_conditional_get(command, options):
+    # Latency, queries and bytes of a full response against a 304 to its
+    # current ETag, on the endpoints with conditional GET. Sizes are items.
+    results = {}
+    with mock.patch.dict(caching._conditional_config, {"ENABLED": True}):
+        for size in options["sizes"] or [2000]:
+            user = prepare_dataset(options, items=size, invoices=0, activities=0)
+            client = get_client(user)
+            item_id = Inventory.objects.order_by("id").values_list("id", flat=True).first()
+            results[size] = {}
+            for path in ("/app/inventory", f"/app/inventory/{item_id}", "/app/group", "/app/shop"):
+                response = client.get(path)
+                etag = response["ETag"]
+                timings = {"bytes": len(response.content)}
+                for mode, headers, status in (("full", {}, 200), ("not modified", {"HTTP_IF_NONE_MATCH": etag}, 304)):
+                    with CaptureQueriesContext(connection) as captured:
+                        response = client.get(path, **headers)
+                    if response.status_code != status:
+                        raise CommandError(f"{path}: expected {status}, got {response.status_code}")
+                    timings[mode] = {"queries": len(captured),
+                                     **time_calls(lambda: client.get(path, **headers), options["iterations"])}
+                results[size][path] = timings
+                command.stderr.write(f"{size} items: {path} full p50 {timings['full']['p50']:.2f} ms, "
+                                     f"304 p50 {timings['not modified']['p50']:.2f} ms")
+    return results
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the API in process at each dataset scale and print JSON with latency percentiles, "
+        "query counts and response sizes per endpoint, to compare runs across commits. Every scale is "
+        "generated into a fresh test database (test_<NAME>), so the configured database is never touched. "
+        "Responses are not served from the response cache unless --warm-cache is given. --suite runs one "
+        "of the feature benchmarks instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scales", nargs="+", choices=scales.keys(), default=list(scales.keys()))
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--end-date", type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+                            help="Last day of the generated invoices (YYYY-MM-DD), defaults to today")
+        parser.add_argument("--iterations", type=int, default=20, help="Timed requests per endpoint")
+        parser.add_argument("--only", nargs="+", help="Benchmark only the endpoints with these names")
+        parser.add_argument("--warm-cache", action="store_true", help="Keep the response cache between requests")
+        parser.add_argument("--output", help="Write the results to this file instead of stdout")
+        parser.add_argument("--suite", choices=suites.keys(), help="Run this feature benchmark instead")
+        parser.add_argument("--workers", nargs="+", type=int, help="Concurrent workers, for the suites using them")
+        parser.add_argument("--sizes", nargs="+", type=int, help="Data sizes, for the suites using them")
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            results = {
+                "commit": self.get_commit(),
+                "vendor": connection.vendor,
+                "seed": options["seed"],
+                "end_date": (options["end_date"] or timezone.localdate()).isoformat(),
+                "iterations": options["iterations"],
+            }
+            if options["suite"]:
+                results["suite"] = options["suite"]
+                results["results"] = suites[options["suite"]](self, options)
+            else:
+                results["scales"] = {
+                    scale: self.run_scale(scale, options) for scale in options["scales"]
+                }
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output + "\n")
+            self.stderr.write(f"Results written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+    def run_scale(self, scale, options):
+        call_command("flush", interactive=False, verbosity=0)
+        cache.clear()
+
+        started = time.perf_counter()
+        end_date = options["end_date"] or timezone.localdate()
+        dataset = generate_dataset(seed=options["seed"], end_date=end_date, **scales[scale])
+        dataset["seconds"] = time.perf_counter() - started
+        self.stderr.write(f"{scale}: generated in {dataset['seconds']:.1f}s")
+
+        user = CustomUser.objects.filter(role="admin").order_by("id").first()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_access_token({'user_id': user.id}, 1)}")
+
+        endpoints = {}
+        for name, method, path, data in get_endpoints(end_date):
+            if options["only"] and name not in options["only"]:
+                continue
+            endpoints[name] = self.run_endpoint(client, method, path, data, options)
+            self.stderr.write(f"{scale}: {name} p50 {endpoints[name]['p50']:.1f} ms, "
+                              f"{endpoints[name]['queries']} queries")
+        return {"dataset": dataset, "endpoints": endpoints}
+
+    def run_endpoint(self, client, method, path, data, options):
+        latencies = []
+        queries = []
+        sizes = []
+        statuses = set()
+
+        # The first request warms up imports and connections and is not timed.
+        for iteration in range(options["iterations"] + 1):
+            if not options["warm_cache"]:
+                cache.clear()
+            kwargs = {"data": data}
+            if callable(data):
+                kwargs["data"], kwargs["format"] = data(iteration)
+
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = getattr(client, method)(path, **kwargs)
+                elapsed = (time.perf_counter() - started) * 1000
+            if iteration:
+                latencies.append(elapsed)
+                queries.append(len(captured))
+                sizes.append(len(response.content))
+                statuses.add(response.status_code)
+
+        return {
+            "method": method.upper(),
+            "path": path,
+            "status": sorted(statuses),
+            **summarize(latencies),
+            "queries": max(queries),
+            "queries_min": min(queries),
+            "bytes": max(sizes),
+        }
+
+    def get_commit(self):
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,63 @@
+import json
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure how long opening a database connection takes compared to running a query on a "
+        "connection that is already open, i.e. what CONN_MAX_AGE saves on every request"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+        parser.add_argument("--iterations", type=int, default=200)
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        iterations = options["iterations"]
+
+        def query():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+
+        fresh = []
+        for _ in range(iterations):
+            connection.close()
+            started = time.perf_counter()
+            connection.ensure_connection()
+            query()
+            fresh.append((time.perf_counter() - started) * 1000)
+
+        reused = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            query()
+            reused.append((time.perf_counter() - started) * 1000)
+
+        results = {
+            "database": options["database"],
+            "vendor": connection.vendor,
+            "iterations": iterations,
+            "new_connection": self.summarize(fresh),
+            "persistent_connection": self.summarize(reused),
+        }
+        results["setup_overhead_ms"] = results["new_connection"]["p50"] - results["persistent_connection"]["p50"]
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'':24} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8}")
+        for name in ("new_connection", "persistent_connection"):
+            stats = results[name]
+            self.stdout.write(f"{name:24} {stats['p50']:8.3f} {stats['p99']:8.3f} {stats['mean']:8.3f}")
+        self.stdout.write(f"Connection setup adds {results['setup_overhead_ms']:.3f} ms per request without CONN_MAX_AGE")
+
+    def summarize(self, samples):
+        percentiles = statistics.quantiles(samples, n=100) if len(samples) > 1 else samples * 99
+        return {"p50": percentiles[49], "p99": percentiles[98], "mean": statistics.fmean(samples)}
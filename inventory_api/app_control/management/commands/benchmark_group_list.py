@@ -0,0 +1,72 @@
+import json
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, setup_databases, setup_test_environment, teardown_databases
+from app_control.models import InventoryGroup
+from app_control.serializers import InventoryGroupSerializer
+from app_control.views import InventoryGroupView
+from .benchmark_api import summarize
+from .generate_data import generate_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the latency and peak memory of a group list page read with the stored item counters "
+        "against the former prefetch of every item of the page plus a COUNT per group. The items are "
+        "generated into a fresh test database (test_<NAME>), so the configured database is never touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=100000, help="Items spread over the groups")
+        parser.add_argument("--groups", type=int, default=20, help="Groups, one page holds 20")
+        parser.add_argument("--iterations", type=int, default=10, help="Timed runs per path")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            generate_dataset(seed=options["seed"], depth=1, users=5, groups=options["groups"], items=options["items"],
+                             shops=1, invoices=0, activities=0, stdout=self.stderr)
+            page_size = InventoryGroupView.pagination_class.page_size
+
+            def prefetched():
+                groups = InventoryGroup.objects.select_related("belongs_to", "created_by").prefetch_related(
+                    "inventories"
+                ).annotate(total_items=Count("inventories")).order_by("-created_at", "-id")[:page_size]
+                return InventoryGroupSerializer(groups, many=True).data
+
+            def counters():
+                groups = InventoryGroupView.queryset.order_by("-created_at", "-id")[:page_size]
+                return InventoryGroupSerializer(groups, many=True).data
+
+            results = {
+                "items": options["items"],
+                "groups": options["groups"],
+                "prefetch_inventories": self.measure(prefetched, options["iterations"]),
+                "group_counters": self.measure(counters, options["iterations"]),
+            }
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def measure(self, function, iterations):
+        latencies = []
+        for _ in range(max(1, iterations)):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                function()
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        # Memory is traced in a run of its own, tracing slows everything down.
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {**summarize(latencies), "queries": len(captured), "peak_mib": peak / 2 ** 20}
@@ -0,0 +1,82 @@
+import re
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from app_control.models import (Inventory, InventoryGroup, Shop, Invoice, InvoiceItem, DailySale, StockMovement,
+                                Tombstone, get_stock_as_of)
+from app_control.views import get_position_query
+from inventory_api.utils import scalar_query
+from user_control.models import UserActivities
+
+
+def get_hot_queries():
+    # The main query behind each hot endpoint, with representative filters.
+    now = timezone.now()
+    week_ago = now - timedelta(days=7)
+    return {
+        "inventory list": Inventory.objects.order_by("-created_at", "-id")[:21],
+        "summary in-stock count": scalar_query(Inventory.objects.filter(remaining__gt=0), "COUNT"),
+        "invoice list": Invoice.objects.order_by("-created_at", "-id")[:21],
+        "invoices of a shop": Invoice.objects.filter(shop_id=1).order_by("-created_at")[:21],
+        "invoice items by date": InvoiceItem.objects.filter(created_at__range=(week_ago, now)),
+        "top selling": DailySale.objects.filter(day__gte=week_ago.date()).values("item_id").order_by(),
+        "sales by shop": DailySale.objects.filter(day__gte=week_ago.date(), shop_id=1).values("amount"),
+        "activities list": UserActivities.objects.order_by("-created_at", "-id")[:21],
+        "activities of a user": UserActivities.objects.filter(user_id=1).order_by("-created_at")[:21],
+        "stock movements of an item": StockMovement.objects.filter(item_id=1, created_at__lte=now),
+        "stock as of": get_stock_as_of(now, Inventory.objects.filter(id=1)),
+        "inventory sync": Inventory.objects.filter(
+            get_position_query("updated_at", (week_ago, 1), None)
+        ).order_by("updated_at", "id")[:500],
+        "group sync": InventoryGroup.objects.filter(
+            get_position_query("updated_at", (week_ago, 1), None)
+        ).order_by("updated_at", "id")[:500],
+        "shop sync": Shop.objects.filter(get_position_query("updated_at", None, week_ago)).order_by("updated_at", "id")[:500],
+        "sync deletions": Tombstone.objects.filter(
+            get_position_query("deleted_at", (week_ago, 1), None), model__in=("app_control.inventory",)
+        ).order_by("deleted_at", "id")[:500],
+    }
+
+
+# PostgreSQL reports "Seq Scan on <table>"; SQLite reports "SCAN <table>"
+# unless it goes through an index ("SCAN <table> USING ... INDEX").
+full_scan_re = re.compile(r"Seq Scan on (\S+)|\bSCAN (\S+)(?!\S)(?! USING)")
+
+
+def find_full_scans(plan):
+    return [postgres or sqlite for postgres, sqlite in full_scan_re.findall(plan)]
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN the main query of each hot endpoint and fail if any of them needs a full table scan. "
+        "On PostgreSQL sequential scans are disabled for the check, so a table size does not matter: "
+        "a Seq Scan in the plan means no index can serve the query."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verbose-plans", action="store_true", help="Print every plan, not only the failing ones")
+
+    def handle(self, *args, **options):
+        failures = []
+        for name, queryset in get_hot_queries().items():
+            plan = self.explain(queryset)
+            scans = find_full_scans(plan)
+            if scans:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"{name}: full scan of {', '.join(scans)}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{name}: ok"))
+            if scans or options["verbose_plans"]:
+                self.stdout.write(plan + "\n")
+
+        if failures:
+            raise CommandError(f"{len(failures)} queries need a full table scan: {', '.join(failures)}")
+
+    def explain(self, queryset):
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+            return queryset.explain()
@@ -0,0 +1,216 @@
+import random
+import time
+from datetime import datetime, time as dt_time, timedelta
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from inventory_api.caching import bump_cache_version
+from app_control.models import (Inventory, InventoryGroup, Shop, Invoice, InvoiceItem, StockMovement, DailySale,
+                                bulk_create_inventories, bulk_create_groups, bulk_create_shops, rebuild_daily_sales,
+                                rebuild_group_counters)
+from user_control.models import CustomUser, UserActivities
+
+
+scales = {
+    "small": {"users": 10, "groups": 50, "items": 1000, "shops": 10, "invoices": 2000, "activities": 5000},
+    "medium": {"users": 50, "groups": 300, "items": 20000, "shops": 50, "invoices": 50000, "activities": 100000},
+    "large": {"users": 200, "groups": 1000, "items": 200000, "shops": 200, "invoices": 500000, "activities": 1000000},
+}
+
+adjectives = ("Steel", "Cotton", "Plastic", "Wooden", "Glass", "Copper", "Leather", "Rubber", "Paper", "Ceramic",
+              "Large", "Small", "Blue", "Red", "Green", "Black", "White", "Heavy", "Light", "Premium")
+nouns = ("Bolt", "Shirt", "Bottle", "Chair", "Cable", "Lamp", "Notebook", "Bag", "Cup", "Hammer", "Towel",
+         "Battery", "Charger", "Pen", "Plate", "Basket", "Glove", "Brush", "Box", "Rope")
+first_names = ("Abebe", "Sara", "John", "Hana", "Yonas", "Maria", "Dawit", "Lina", "Samuel", "Meron")
+last_names = ("Kebede", "Smith", "Tesfaye", "Garcia", "Alemu", "Brown", "Haile", "Lee", "Bekele", "Wilson")
+
+batch_size = 1000
+
+
+def backdated_bulk_create(model, objects):
+    # auto_now_add overwrites created_at on insert, so the generated dates
+    # are written back with a second, batched UPDATE.
+    dates = [obj.created_at for obj in objects]
+    objects = model.objects.bulk_create(objects)
+    for obj, date in zip(objects, dates):
+        obj.created_at = date
+    model.objects.bulk_update(objects, ["created_at"])
+    return objects
+
+
+def generate_dataset(seed=1, end_date=None, days=90, depth=4, stdout=None, **counts):
+    # Creates users, nested group trees, inventory, shops, invoices and
+    # activities with bulk inserts. The same seed and end date always give
+    # the same dataset: names, relations, quantities and dates.
+    rng = random.Random(seed)
+    end = timezone.make_aware(datetime.combine(end_date or timezone.localdate(), dt_time.max))
+    start = end - timedelta(days=days)
+    domain = f"seed{seed}.example.com"
+
+    if CustomUser.objects.filter(email__endswith=f"@{domain}").exists():
+        raise CommandError(f"Data for seed {seed} already exists, use another seed or flush the database first")
+
+    def log(message):
+        if stdout is not None:
+            stdout.write(message)
+
+    def random_moment():
+        return start + timedelta(seconds=rng.uniform(0, days * 86400))
+
+    with transaction.atomic():
+        started = time.perf_counter()
+        password = make_password("password")
+        users = CustomUser.objects.bulk_create([
+            CustomUser(
+                email=f"user{number}@{domain}", password=password,
+                fullname=f"{rng.choice(first_names)} {rng.choice(last_names)}",
+                role="admin" if number == 0 else rng.choice(("admin", "creator", "sales"))
+            ) for number in range(counts["users"])
+        ])
+        log(f"{len(users)} users in {time.perf_counter() - started:.1f}s")
+
+        # Roots first, then each level hangs off random groups of the level
+        # above it, so the trees are depth levels deep.
+        started = time.perf_counter()
+        roots = max(1, counts["groups"] // 10)
+        level_sizes = [roots] + [(counts["groups"] - roots) // max(1, depth - 1)] * (depth - 1)
+        level_sizes[-1] += counts["groups"] - sum(level_sizes)
+        groups = []
+        parents = [None]
+        for size in level_sizes:
+            level_groups = bulk_create_groups([
+                InventoryGroup(
+                    name=f"{rng.choice(adjectives)} {rng.choice(nouns)}s {seed}-{len(groups) + number}",
+                    belongs_to=rng.choice(parents), created_by=rng.choice(users)
+                ) for number in range(size)
+            ])
+            groups.extend(level_groups)
+            parents = level_groups or parents
+        log(f"{len(groups)} groups in {time.perf_counter() - started:.1f}s")
+
+        # Items are in stock from the start of the period, with their receipts
+        # moved back with them so the ledger matches the invoices below.
+        started = time.perf_counter()
+        items = []
+        for offset in range(0, counts["items"], batch_size):
+            created = bulk_create_inventories([
+                Inventory(
+                    name=f"{rng.choice(adjectives)} {rng.choice(nouns)} {offset + number}",
+                    total=rng.randint(50, 1000), price=round(rng.uniform(1, 500), 2),
+                    group=rng.choice(groups), created_by=rng.choice(users)
+                ) for number in range(min(batch_size, counts["items"] - offset))
+            ])
+            ids = [item.id for item in created]
+            Inventory.objects.filter(id__in=ids).update(created_at=start)
+            StockMovement.objects.filter(item_id__in=ids, kind=StockMovement.RECEIPT).update(created_at=start)
+            items.extend(created)
+        log(f"{len(items)} inventory items in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        shops = bulk_create_shops([
+            Shop(name=f"{rng.choice(last_names)} Store {seed}-{number}", created_by=rng.choice(users))
+            for number in range(counts["shops"])
+        ])
+        log(f"{len(shops)} shops in {time.perf_counter() - started:.1f}s")
+
+        # A few items sell most: picking rng.random() ** 2 of the list skews
+        # sales towards its start, like real top sellers.
+        started = time.perf_counter()
+        remaining = {item.id: item.total for item in items}
+        invoice_count = 0
+        line_count = 0
+        for offset in range(0, counts["invoices"], batch_size):
+            invoices = []
+            for _ in range(min(batch_size, counts["invoices"] - offset)):
+                invoice = Invoice(shop=rng.choice(shops), created_by=rng.choice(users), created_at=random_moment())
+                invoice.search_document = invoice.get_search_document()
+                invoices.append(invoice)
+            invoices = backdated_bulk_create(Invoice, invoices)
+
+            lines = []
+            for invoice in invoices:
+                for _ in range(rng.randint(1, 5)):
+                    item = items[int(len(items) * rng.random() ** 2)]
+                    quantity = rng.randint(1, 5)
+                    if remaining[item.id] < quantity:
+                        continue
+                    remaining[item.id] -= quantity
+                    lines.append(InvoiceItem(
+                        invoice=invoice, item=item, item_name=item.name, item_code=item.code,
+                        quantity=quantity, amount=item.price * quantity, created_at=invoice.created_at
+                    ))
+            lines = backdated_bulk_create(InvoiceItem, lines)
+            StockMovement.objects.bulk_create([
+                StockMovement(item_id=line.item_id, kind=StockMovement.SALE, quantity=-line.quantity,
+                              invoice=line.invoice, created_by=line.invoice.created_by, created_at=line.created_at)
+                for line in lines
+            ])
+            invoice_count += len(invoices)
+            line_count += len(lines)
+
+        for item in items:
+            item.remaining = remaining[item.id]
+        Inventory.objects.bulk_update(items, ["remaining"], batch_size=batch_size)
+        rebuild_daily_sales()
+        rebuild_group_counters()
+        log(f"{invoice_count} invoices with {line_count} items in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        actions = ("Logged in", "Updated Inventory", "Created New Invoice", "Viewed dashboard", "Exported invoices")
+        activity_count = 0
+        for offset in range(0, counts["activities"], batch_size):
+            activities = []
+            for _ in range(min(batch_size, counts["activities"] - offset)):
+                user = rng.choice(users)
+                activities.append(UserActivities(
+                    user=user, email=user.email, fullname=user.fullname,
+                    action=rng.choice(actions), created_at=random_moment()
+                ))
+            activity_count += len(UserActivities.objects.bulk_create(activities))
+        log(f"{activity_count} activities in {time.perf_counter() - started:.1f}s")
+
+        bump_cache_version(CustomUser, InventoryGroup, Inventory, Shop, Invoice, DailySale)
+
+    return {
+        "users": len(users),
+        "groups": len(groups),
+        "items": len(items),
+        "shops": len(shops),
+        "invoices": invoice_count,
+        "invoice_items": line_count,
+        "activities": activity_count,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a reproducible synthetic dataset: users, nested inventory groups, inventory, shops, "
+        "invoices with items and activity logs. The same --seed and --end-date always give the same data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", choices=scales.keys(), default="small")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--end-date", type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+                            help="Last day of invoices and activities (YYYY-MM-DD), defaults to today")
+        parser.add_argument("--days", type=int, default=90, help="Days of invoices and activities")
+        parser.add_argument("--depth", type=int, default=4, help="Levels of the inventory group trees")
+        for name in scales["small"]:
+            parser.add_argument(f"--{name}", type=int, help=f"Number of {name}, overrides the scale")
+
+    def handle(self, *args, **options):
+        counts = {
+            name: default if options[name] is None else options[name]
+            for name, default in scales[options["scale"]].items()
+        }
+        if counts["users"] < 1 or counts["groups"] < 1 or counts["items"] < 1 or counts["shops"] < 1:
+            raise CommandError("At least one user, group, item and shop is needed")
+
+        dataset = generate_dataset(
+            seed=options["seed"], end_date=options["end_date"], days=options["days"], depth=options["depth"],
+            stdout=self.stdout, **counts
+        )
+        self.stdout.write(self.style.SUCCESS(
+            "Generated " + ", ".join(f"{count} {name}" for name, count in dataset.items())
+        ))
@@ -0,0 +1,94 @@
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from inventory_api.utils import get_access_token
+from user_control.models import CustomUser
+
+
+sync_paths = ("/app/summary", "/app/top-selling", "/app/sale-by-shop", "/app/purchase-summary")
+async_paths = ("/app/async/summary", "/app/async/top-selling", "/app/async/sale-by-shop",
+               "/app/async/purchase-summary")
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the dashboard endpoints of a running server and report latency percentiles. "
+        "Run it once against the WSGI app (e.g. gunicorn inventory_api.wsgi) and once against the "
+        "ASGI app (e.g. uvicorn inventory_api.asgi:application) to compare them; start the server "
+        "with RESPONSE_CACHE_ENABLED=False to measure the queries rather than the cache."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--email", help="User to issue the access token for, defaults to the first active user")
+        parser.add_argument("--paths", nargs="+", help="Paths to request, defaults to the sync and async dashboard")
+        parser.add_argument("--mode", choices=("sync", "async", "both"), default="both")
+        parser.add_argument("--requests", type=int, default=1000, help="Requests per path")
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--query", default="", help="Query string added to every request")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.filter(is_active=True)
+        user = users.filter(email=options["email"]).first() if options["email"] else users.order_by("id").first()
+        if user is None:
+            raise Exception("No active user to issue the access token for")
+        token = get_access_token({"user_id": user.id}, 1)
+
+        paths = options["paths"] or {
+            "sync": sync_paths, "async": async_paths, "both": sync_paths + async_paths
+        }[options["mode"]]
+
+        results = []
+        for path in paths:
+            url = f"{options['base_url'].rstrip('/')}{path}"
+            if options["query"]:
+                url = f"{url}?{options['query'].lstrip('?')}"
+            results.append(self.run(path, url, token, options["requests"], options["concurrency"]))
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'path':32} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7}")
+        for result in results:
+            self.stdout.write(
+                f"{result['path']:32} {result['throughput']:8.1f} {result['p50']:8.1f} {result['p90']:8.1f} "
+                f"{result['p99']:8.1f} {result['max']:8.1f} {result['errors']:7d}"
+            )
+
+    def run(self, path, url, token, count, concurrency):
+        def request(_):
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(urllib.request.Request(url, headers={
+                    "Authorization": f"Bearer {token}"
+                }), timeout=30) as response:
+                    response.read()
+                    ok = response.status == 200
+            except (urllib.error.URLError, OSError):
+                ok = False
+            return (time.perf_counter() - started) * 1000, ok
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(request, range(count)))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for latency, _ in samples)
+        percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        return {
+            "path": path,
+            "requests": count,
+            "concurrency": concurrency,
+            "throughput": count / elapsed,
+            "p50": percentiles[49],
+            "p90": percentiles[89],
+            "p99": percentiles[98],
+            "max": latencies[-1],
+            "errors": sum(1 for _, ok in samples if not ok)
+        }
@@ -0,0 +1,17 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from app_control.models import prune_tombstones
+
+
+class Command(BaseCommand):
+    help = "Delete the tombstones older than SYNC['TOMBSTONE_DAYS'], e.g. daily from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=getattr(settings, "SYNC", {}).get("TOMBSTONE_DAYS", 30),
+                            help="Keep the tombstones of this many days")
+
+    def handle(self, *args, **options):
+        count = prune_tombstones(timezone.now() - timedelta(days=options["days"]))
+        self.stdout.write(self.style.SUCCESS(f"Deleted {count} tombstones older than {options['days']} days"))
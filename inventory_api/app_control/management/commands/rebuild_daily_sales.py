@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from app_control.models import DailySale, rebuild_daily_sales
+
+
+class Command(BaseCommand):
+    help = "Rebuild the DailySale rollups from the full InvoiceItem history"
+
+    def handle(self, *args, **options):
+        rebuild_daily_sales()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {DailySale.objects.count()} daily sale rows"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from app_control.models import reconcile_group_counters, rebuild_group_counters
+
+
+class Command(BaseCommand):
+    help = "Compare the item counters of every inventory group with its items and optionally rebuild them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="Recount the counters of the groups that differ")
+
+    def handle(self, *args, **options):
+        count = 0
+        for group_id, stored, actual in reconcile_group_counters():
+            count += 1
+            self.stdout.write(
+                f"Inventory group {group_id}: items {stored[0]}, in stock {stored[1]}, stock value {stored[2]:.2f}; "
+                f"counted {actual[0]}, {actual[1]}, {actual[2]:.2f}"
+            )
+
+        if not count:
+            self.stdout.write(self.style.SUCCESS("Inventory group counters match their items"))
+        elif options["fix"]:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt the counters of {rebuild_group_counters()} groups"))
+        else:
+            self.stdout.write(self.style.WARNING(f"{count} groups differ from their items, run with --fix to rebuild"))
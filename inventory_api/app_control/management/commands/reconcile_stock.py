@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from app_control.models import reconcile_stock, rebuild_remaining
+
+
+class Command(BaseCommand):
+    help = "Compare Inventory.remaining with the stock ledger and optionally rebuild it"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="Rewrite remaining from the ledger where they differ")
+
+    def handle(self, *args, **options):
+        count = 0
+        for item_id, remaining, ledger in reconcile_stock():
+            count += 1
+            self.stdout.write(f"Inventory {item_id}: remaining {remaining}, ledger {ledger}")
+
+        if not count:
+            self.stdout.write(self.style.SUCCESS("Inventory remaining matches the stock ledger"))
+        elif options["fix"]:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt remaining of {rebuild_remaining()} items from the ledger"))
+        else:
+            self.stdout.write(self.style.WARNING(f"{count} items differ from the stock ledger, run with --fix to rebuild"))
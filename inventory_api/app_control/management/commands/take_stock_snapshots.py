@@ -0,0 +1,17 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from app_control.models import take_stock_snapshots
+
+
+class Command(BaseCommand):
+    help = "Snapshot the stock of every item that moved since its last snapshot"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lag", type=int, default=5,
+                            help="Minutes the snapshot lags behind now, to skip transactions still in flight")
+
+    def handle(self, *args, **options):
+        taken_at = timezone.now() - timedelta(minutes=options["lag"])
+        count = take_stock_snapshots(taken_at)
+        self.stdout.write(self.style.SUCCESS(f"Took {count} stock snapshots as of {taken_at.isoformat()}"))
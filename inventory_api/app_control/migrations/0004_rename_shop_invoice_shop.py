@@ -0,0 +1,18 @@
+# Generated by Django 4.1.4 on 2026-10-18 09:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_control', '0003_invoice_invoiceitem'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='invoice',
+            old_name='Shop',
+            new_name='shop',
+        ),
+    ]
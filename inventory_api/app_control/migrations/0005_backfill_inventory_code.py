@@ -0,0 +1,24 @@
+# Generated by Django 4.1.4 on 2026-10-18 09:40
+
+from django.db import migrations
+
+
+def backfill_inventory_code(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Inventory = apps.get_model('app_control', 'Inventory')
+    items = []
+    for item in Inventory.objects.using(db_alias).filter(code__isnull=True).only('id').iterator():
+        item.code = f"INV{item.id:06d}"
+        items.append(item)
+    Inventory.objects.using(db_alias).bulk_update(items, ['code'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_control', '0004_rename_shop_invoice_shop'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_inventory_code, migrations.RunPython.noop),
+    ]
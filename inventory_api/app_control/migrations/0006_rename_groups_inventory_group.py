@@ -0,0 +1,18 @@
+# Generated by Django 4.1.4 on 2026-10-18 10:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_control', '0005_backfill_inventory_code'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='inventory',
+            old_name='groups',
+            new_name='group',
+        ),
+    ]
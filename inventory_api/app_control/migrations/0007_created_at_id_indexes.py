@@ -0,0 +1,29 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_control', '0006_rename_groups_inventory_group'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['-created_at', '-id'], name='inventory_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventorygroup',
+            index=models.Index(fields=['-created_at', '-id'], name='inventory_group_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['-created_at', '-id'], name='invoice_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shop',
+            index=models.Index(fields=['-created_at', '-id'], name='shop_created_idx'),
+        ),
+    ]
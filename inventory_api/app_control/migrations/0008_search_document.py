@@ -0,0 +1,59 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:38
+
+from django.db import migrations, models
+
+
+def build_search_document(*values):
+    return " ".join(str(value) for value in values if value).lower()
+
+
+def user_values(user):
+    return (user.fullname, user.email) if user else ()
+
+
+def populate_search_document(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Inventory = apps.get_model('app_control', 'Inventory')
+    Shop = apps.get_model('app_control', 'Shop')
+    Invoice = apps.get_model('app_control', 'Invoice')
+
+    documents = (
+        (Inventory.objects.using(db_alias).select_related('group', 'created_by'),
+         lambda obj: (obj.code, obj.name, obj.group and obj.group.name, *user_values(obj.created_by))),
+        (Shop.objects.using(db_alias).select_related('created_by'),
+         lambda obj: (obj.name, *user_values(obj.created_by))),
+        (Invoice.objects.using(db_alias).select_related('shop', 'created_by'),
+         lambda obj: (obj.shop and obj.shop.name, *user_values(obj.created_by))),
+    )
+    for queryset, get_values in documents:
+        objects = []
+        for obj in queryset.iterator(chunk_size=1000):
+            obj.search_document = build_search_document(*get_values(obj))
+            objects.append(obj)
+        queryset.model.objects.using(db_alias).bulk_update(objects, ['search_document'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_control', '0007_created_at_id_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventory',
+            name='search_document',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='search_document',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='search_document',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(populate_search_document, migrations.RunPython.noop),
+    ]
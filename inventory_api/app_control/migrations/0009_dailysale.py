@@ -0,0 +1,61 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_daily_sales(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    InvoiceItem = apps.get_model('app_control', 'InvoiceItem')
+    DailySale = apps.get_model('app_control', 'DailySale')
+
+    daily_sales = InvoiceItem.objects.using(db_alias).annotate(
+        day=TruncDate('created_at')
+    ).values('item_id', 'invoice__shop_id', 'day').annotate(
+        total_quantity=Sum('quantity'), total_amount=Sum('amount')
+    ).order_by()
+
+    DailySale.objects.using(db_alias).bulk_create([
+        DailySale(
+            item_id=daily_sale['item_id'],
+            shop_id=daily_sale['invoice__shop_id'],
+            day=daily_sale['day'],
+            quantity=daily_sale['total_quantity'],
+            amount=daily_sale['total_amount']
+        ) for daily_sale in daily_sales
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_control', '0008_search_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySale',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('amount', models.FloatField(default=0)),
+                ('item', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='daily_sales', to='app_control.inventory')),
+                ('shop', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='daily_sales', to='app_control.shop')),
+            ],
+            options={
+                'ordering': ('-day',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dailysale',
+            index=models.Index(fields=['day', 'shop'], name='daily_sale_day_shop_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailysale',
+            unique_together={('item', 'shop', 'day')},
+        ),
+        migrations.RunPython(populate_daily_sales, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.1.4 on 2026-10-18 14:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_group_path(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    InventoryGroup = apps.get_model('app_control', 'InventoryGroup')
+
+    parents = dict(InventoryGroup.objects.using(db_alias).values_list('id', 'belongs_to_id'))
+    paths = {}
+
+    def get_path(group_id):
+        if group_id not in paths:
+            ancestors = []
+            parent_id = parents[group_id]
+            while parent_id is not None and parent_id not in ancestors:
+                ancestors.insert(0, parent_id)
+                parent_id = parents.get(parent_id)
+            paths[group_id] = '/' + ''.join(f'{ancestor}/' for ancestor in ancestors)
+        return paths[group_id]
+
+    groups = list(InventoryGroup.objects.using(db_alias).only('id', 'path'))
+    for group in groups:
+        group.path = get_path(group.id)
+    InventoryGroup.objects.using(db_alias).bulk_update(groups, ['path'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app_control', '0009_dailysale'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='inventorygroup',
+            old_name='created_by',
+            new_name='updated_at',
+        ),
+        migrations.AddField(
+            model_name='inventorygroup',
+            name='created_by',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='inventory_group', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='inventorygroup',
+            name='path',
+            field=models.CharField(db_index=True, default='/', max_length=255),
+        ),
+        migrations.RunPython(populate_group_path, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:43
+
+from django.db import migrations, models
+
+
+def externalize_photos(apps, schema_editor):
+    from app_control.photos import decode_photo, store_photo
+
+    db_alias = schema_editor.connection.alias
+    Inventory = apps.get_model('app_control', 'Inventory')
+    ids = list(Inventory.objects.using(db_alias).filter(photo__isnull=False).exclude(photo='').values_list('id', flat=True))
+
+    for start in range(0, len(ids), 100):
+        inventories = list(Inventory.objects.using(db_alias).filter(id__in=ids[start:start + 100]).only('id', 'photo', 'photo_hash'))
+        for inventory in inventories:
+            content = decode_photo(inventory.photo)
+            if content is not None:
+                inventory.photo_hash = store_photo(content)
+                inventory.photo = None
+        Inventory.objects.using(db_alias).bulk_update(inventories, ['photo', 'photo_hash'])
+
+
+def inline_photos(apps, schema_editor):
+    # Puts stored photos back inline as data URLs. The files stay in the
+    # storage, where other rows may share them.
+    import base64
+    from app_control.photos import guess_content_type, open_photo
+
+    db_alias = schema_editor.connection.alias
+    Inventory = apps.get_model('app_control', 'Inventory')
+    ids = list(Inventory.objects.using(db_alias).filter(photo_hash__isnull=False).exclude(photo_hash='').values_list('id', flat=True))
+
+    for start in range(0, len(ids), 100):
+        inventories = list(Inventory.objects.using(db_alias).filter(id__in=ids[start:start + 100]).only('id', 'photo', 'photo_hash'))
+        for inventory in inventories:
+            photo = open_photo(inventory.photo_hash)
+            if photo is None:
+                continue
+            with photo:
+                content = photo.read()
+            inventory.photo = f'data:{guess_content_type(content[:16])};base64,{base64.b64encode(content).decode()}'
+            inventory.photo_hash = None
+        Inventory.objects.using(db_alias).bulk_update(inventories, ['photo', 'photo_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_control', '0010_inventorygroup_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventory',
+            name='photo_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(externalize_photos, inline_photos),
+    ]
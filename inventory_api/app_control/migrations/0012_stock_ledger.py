@@ -0,0 +1,88 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models import Sum
+
+
+def populate_stock_movements(apps, schema_editor):
+    # Opens the ledger with a receipt of each item's total and a sale per
+    # invoice item, then adjusts whatever is left over so the ledger agrees
+    # with the current remaining.
+    db_alias = schema_editor.connection.alias
+    Inventory = apps.get_model('app_control', 'Inventory')
+    InvoiceItem = apps.get_model('app_control', 'InvoiceItem')
+    StockMovement = apps.get_model('app_control', 'StockMovement')
+    now = django.utils.timezone.now()
+
+    StockMovement.objects.using(db_alias).bulk_create((
+        StockMovement(item_id=item_id, kind='receipt', quantity=total, created_by_id=created_by_id, created_at=created_at)
+        for item_id, total, created_by_id, created_at in Inventory.objects.using(db_alias).filter(total__gt=0).values_list(
+            'id', 'total', 'created_by_id', 'created_at'
+        ).iterator()
+    ), batch_size=1000)
+
+    StockMovement.objects.using(db_alias).bulk_create((
+        StockMovement(item_id=item_id, kind='sale', quantity=-quantity, invoice_id=invoice_id,
+                      created_by_id=created_by_id, created_at=created_at)
+        for item_id, quantity, invoice_id, created_by_id, created_at in InvoiceItem.objects.using(db_alias).filter(
+            item__isnull=False
+        ).values_list('item_id', 'quantity', 'invoice_id', 'invoice__created_by_id', 'created_at').iterator()
+    ), batch_size=1000)
+
+    ledger = dict(StockMovement.objects.using(db_alias).values('item_id').annotate(total=Sum('quantity')).values_list('item_id', 'total'))
+    StockMovement.objects.using(db_alias).bulk_create((
+        StockMovement(item_id=item_id, kind='adjustment', quantity=(remaining or 0) - ledger.get(item_id, 0), created_at=now)
+        for item_id, remaining in Inventory.objects.using(db_alias).values_list('id', 'remaining').iterator()
+        if (remaining or 0) != ledger.get(item_id, 0)
+    ), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app_control', '0011_inventory_photo_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'receipt'), ('sale', 'sale'), ('adjustment', 'adjustment'), ('return', 'return')], max_length=20)),
+                ('quantity', models.IntegerField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to=settings.AUTH_USER_MODEL)),
+                ('invoice', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='app_control.invoice')),
+                ('item', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='app_control.inventory')),
+            ],
+            options={
+                'ordering': ('-created_at',),
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('remaining', models.IntegerField()),
+                ('taken_at', models.DateTimeField()),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='app_control.inventory')),
+            ],
+            options={
+                'ordering': ('-taken_at',),
+                'unique_together': {('item', 'taken_at')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['item', 'created_at'], name='stock_movement_item_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['-created_at', '-id'], name='stock_movement_created_idx'),
+        ),
+        migrations.RunPython(populate_stock_movements, migrations.RunPython.noop),
+    ]
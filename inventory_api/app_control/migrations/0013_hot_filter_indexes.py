@@ -0,0 +1,29 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_control', '0012_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dailysale',
+            index=models.Index(fields=['day', 'item'], name='daily_sale_day_item_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(condition=models.Q(('remaining__gt', 0)), fields=['id'], name='inventory_in_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['shop', '-created_at'], name='invoice_shop_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoiceitem',
+            index=models.Index(fields=['created_at'], name='invoice_item_created_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.1.4 on 2026-10-18 19:22
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def count_group_items(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    InventoryGroup = apps.get_model('app_control', 'InventoryGroup')
+    Inventory = apps.get_model('app_control', 'Inventory')
+
+    items = Inventory.objects.using(db_alias).filter(group=OuterRef('pk')).order_by().values('group')
+    InventoryGroup.objects.using(db_alias).update(
+        item_count=Coalesce(Subquery(items.annotate(value=Count('id')).values('value')), 0),
+        in_stock_count=Coalesce(Subquery(
+            items.filter(remaining__gt=0).annotate(value=Count('id')).values('value')
+        ), 0),
+        stock_value=Coalesce(Subquery(
+            items.annotate(value=Sum(F('remaining') * F('price'), output_field=models.FloatField())).values('value')
+        ), Value(0.0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_control', '0013_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventorygroup',
+            name='in_stock_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='inventorygroup',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='inventorygroup',
+            name='stock_value',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(count_group_items, migrations.RunPython.noop),
+    ]
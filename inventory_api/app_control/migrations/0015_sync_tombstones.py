@@ -0,0 +1,42 @@
+# Generated by Django 4.1.4 on 2026-10-18 19:33
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_control', '0014_group_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ('deleted_at',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['updated_at', 'id'], name='inventory_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventorygroup',
+            index=models.Index(fields=['updated_at', 'id'], name='inventory_group_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shop',
+            index=models.Index(fields=['updated_at', 'id'], name='shop_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['deleted_at', 'id'], name='tombstone_deleted_idx'),
+        ),
+    ]
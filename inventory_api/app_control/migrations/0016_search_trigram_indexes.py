@@ -0,0 +1,40 @@
+# Generated by Django 4.1.4 on 2026-10-18 20:04
+
+import app_control.models
+from django.contrib.postgres import operations
+from django.db import migrations
+
+
+class TrigramExtension(operations.TrigramExtension):
+    # Django 4.1 looks the extension up on every backend when unapplying.
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_control', '0015_sync_tombstones'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        # Left by an earlier 0008 that created these indexes with raw SQL.
+        migrations.RunSQL(
+            [f'DROP INDEX IF EXISTS app_control_{table}_search_trgm_idx' for table in ('inventory', 'shop', 'invoice')],
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=app_control.models.PostgresGinIndex(fields=['search_document'], name='inventory_search_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=app_control.models.PostgresGinIndex(fields=['search_document'], name='invoice_search_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='shop',
+            index=app_control.models.PostgresGinIndex(fields=['search_document'], name='shop_search_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
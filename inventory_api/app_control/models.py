@@ -1,6 +1,282 @@
-from django.db import models
+from django.db import models, transaction, connection
+from django.db.models import (Case, When, Count, Exists, F, OuterRef, Q, Subquery, Sum, Value,
+                              prefetch_related_objects)
+from django.db.models.functions import Coalesce, TruncDate, Concat, Substr, Length, Lower
+from django.db.models.lookups import GreaterThan
+from django.contrib.postgres.indexes import GinIndex
+from django.utils import timezone
+from datetime import datetime, timezone as dt_timezone
 from user_control.models import CustomUser
 from user_control.views import add_user_activity
+from rest_framework.exceptions import ValidationError
+from inventory_api.caching import bump_cache_version
+from .photos import decode_photo, store_photo
+
+
+def get_inventory_code(inventory_id):
+    return f"INV{inventory_id:06d}"
+
+
+def reserve_inventory_ids(count):
+    # Ids are drawn from the primary key sequence before the insert so the
+    # code can be written in the same INSERT. Backends without sequences
+    # return None and the code is set after the insert instead.
+    if connection.vendor != "postgresql":
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+            [Inventory._meta.db_table, count]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def load_related(objects, field_name, model):
+    # Attaches related rows referenced only by id with a single query, so the
+    # search documents of a batch can be built without one query per row.
+    attname = f"{field_name}_id"
+    missing_ids = {
+        int(getattr(obj, attname)) for obj in objects
+        if getattr(obj, attname) is not None and not obj._meta.get_field(field_name).is_cached(obj)
+    }
+    related = model.objects.in_bulk(missing_ids) if missing_ids else {}
+    for obj in objects:
+        if getattr(obj, attname) is not None and int(getattr(obj, attname)) in related:
+            setattr(obj, field_name, related[int(getattr(obj, attname))])
+
+
+def bulk_create_inventories(inventories):
+    # Same defaults as Inventory.save, applied to a whole batch: one INSERT
+    # for the rows and, without id reservation, one UPDATE for the codes.
+    load_related(inventories, "group", InventoryGroup)
+    load_related(inventories, "created_by", CustomUser)
+    reserved_ids = reserve_inventory_ids(len(inventories))
+    for index, inventory in enumerate(inventories):
+        inventory.remaining = inventory.total
+        inventory.externalize_photo()
+        if reserved_ids:
+            inventory.id = reserved_ids[index]
+            inventory.code = get_inventory_code(inventory.id)
+        inventory.search_document = inventory.get_search_document()
+
+    with transaction.atomic():
+        inventories = Inventory.objects.bulk_create(inventories)
+
+        if not reserved_ids:
+            for inventory in inventories:
+                inventory.code = get_inventory_code(inventory.id)
+                inventory.search_document = inventory.get_search_document()
+            Inventory.objects.bulk_update(inventories, ["code", "search_document"])
+
+        StockMovement.objects.bulk_create([
+            StockMovement(item=inventory, kind=StockMovement.RECEIPT, quantity=inventory.total,
+                          created_by=inventory.created_by)
+            for inventory in inventories if inventory.total
+        ], batch_size=1000)
+
+        update_group_counters(
+            change for inventory in inventories
+            for change in get_counter_changes(None, inventory.get_counter_state())
+        )
+        for inventory in inventories:
+            inventory.old_counter_state = inventory.get_counter_state()
+
+    bump_cache_version(Inventory)
+    return inventories
+
+
+def bulk_create_groups(groups):
+    load_related(groups, "belongs_to", InventoryGroup)
+    for group in groups:
+        group.path = "/" if group.belongs_to is None else group.belongs_to.descendants_path
+
+    groups = InventoryGroup.objects.bulk_create(groups)
+    bump_cache_version(InventoryGroup)
+    return groups
+
+
+def detach_deleted_groups(deleted_ids):
+    # Sub groups of deleted groups lose their parent (belongs_to is set to
+    # null), so their paths restart after the last deleted ancestor.
+    deleted_ids = {str(group_id) for group_id in deleted_ids}
+    if not deleted_ids:
+        return
+
+    query = Q()
+    for group_id in deleted_ids:
+        query |= Q(path__contains=f"/{group_id}/")
+
+    groups = list(InventoryGroup.objects.filter(query).only("id", "path"))
+    for group in groups:
+        ancestors = group.path.strip("/").split("/")
+        last_deleted = max(index for index, ancestor in enumerate(ancestors) if ancestor in deleted_ids)
+        group.path = "/" + "".join(f"{ancestor}/" for ancestor in ancestors[last_deleted + 1:])
+    InventoryGroup.objects.bulk_update(groups, ["path"], batch_size=1000)
+
+
+def get_counter_changes(before, after):
+    # What an item adds to the counters of its group, as (group id, items,
+    # in stock items, stock value) rows, when it goes from the before to the
+    # after (group id, remaining, price) state. None is an item that does not
+    # exist (yet, or any more).
+    for state, sign in ((before, -1), (after, 1)):
+        if state is not None and state[0] is not None:
+            group_id, remaining, price = state
+            remaining = remaining or 0
+            yield group_id, sign, sign * int(remaining > 0), sign * remaining * (price or 0)
+
+
+def get_stock_counter_changes(item, quantity):
+    # The counter changes of adding quantity (negative for sales) to the
+    # remaining of an item.
+    group_id, remaining, price = item.get_counter_state()
+    return get_counter_changes((group_id, remaining, price), (group_id, (remaining or 0) + quantity, price))
+
+
+def update_group_counters(changes):
+    # Applies counter changes, summed up per group, as increments in a single
+    # UPDATE, so concurrent writers add up instead of overwriting each other.
+    # Run it in the transaction of the inventory write it accounts for.
+    totals = {}
+    for group_id, items, in_stock, stock_value in changes:
+        total = totals.setdefault(int(group_id), [0, 0, 0])
+        total[0] += items
+        total[1] += in_stock
+        total[2] += stock_value
+    totals = {group_id: total for group_id, total in totals.items() if any(total)}
+    if not totals:
+        return
+
+    def increments(index, output_field):
+        return Case(
+            *[When(id=group_id, then=Value(total[index])) for group_id, total in totals.items()],
+            default=Value(0), output_field=output_field
+        )
+
+    InventoryGroup.objects.filter(id__in=totals.keys()).update(
+        item_count=F("item_count") + increments(0, models.IntegerField()),
+        in_stock_count=F("in_stock_count") + increments(1, models.IntegerField()),
+        stock_value=F("stock_value") + increments(2, models.FloatField()),
+        updated_at=timezone.now(),
+    )
+
+
+def get_group_counters(queryset=None):
+    # The counters of every group recounted from its items.
+    queryset = InventoryGroup.objects.all() if queryset is None else queryset
+    items = Inventory.objects.filter(group=OuterRef("pk")).order_by().values("group")
+    return queryset.annotate(
+        actual_item_count=Coalesce(Subquery(items.annotate(value=Count("id")).values("value")), 0),
+        actual_in_stock_count=Coalesce(Subquery(
+            items.filter(remaining__gt=0).annotate(value=Count("id")).values("value")
+        ), 0),
+        actual_stock_value=Coalesce(Subquery(
+            items.annotate(value=Sum(F("remaining") * F("price"), output_field=models.FloatField())).values("value")
+        ), Value(0.0)),
+    )
+
+
+def reconcile_group_counters(queryset=None, tolerance=0.005):
+    # Yields (group id, stored counters, recounted counters) for every group
+    # whose counters disagree with its items. Stock values are floats summed
+    # in a different order, so they may differ by up to tolerance.
+    groups = get_group_counters(queryset).values_list(
+        "id", "item_count", "in_stock_count", "stock_value",
+        "actual_item_count", "actual_in_stock_count", "actual_stock_value"
+    ).order_by("id")
+    for group_id, *counters in groups.iterator():
+        stored, actual = tuple(counters[:3]), tuple(counters[3:])
+        if stored[:2] != actual[:2] or abs(stored[2] - actual[2]) > tolerance:
+            yield group_id, stored, actual
+
+
+def rebuild_group_counters(queryset=None, batch_size=1000):
+    # Rewrites the counters of the groups that drifted. Groups are locked in
+    # id order and recounted under the lock.
+    group_ids = [group_id for group_id, _, _ in reconcile_group_counters(queryset)]
+    fixed = 0
+    for start in range(0, len(group_ids), batch_size):
+        with transaction.atomic():
+            locked = list(InventoryGroup.objects.select_for_update().filter(
+                id__in=group_ids[start:start + batch_size]
+            ).order_by("id").values_list("id", flat=True))
+            groups = list(get_group_counters(InventoryGroup.objects.filter(id__in=locked)).only("id"))
+            for group in groups:
+                group.item_count = group.actual_item_count
+                group.in_stock_count = group.actual_in_stock_count
+                group.stock_value = group.actual_stock_value
+                group.updated_at = timezone.now()
+            InventoryGroup.objects.bulk_update(groups, ["item_count", "in_stock_count", "stock_value", "updated_at"])
+            fixed += len(groups)
+    if fixed:
+        bump_cache_version(InventoryGroup)
+    return fixed
+
+
+def bulk_create_shops(shops):
+    load_related(shops, "created_by", CustomUser)
+    for shop in shops:
+        shop.search_document = shop.get_search_document()
+
+    shops = Shop.objects.bulk_create(shops)
+    bump_cache_version(Shop)
+    return shops
+
+
+class PostgresGinIndex(GinIndex):
+    # GIN indexes and the pg_trgm operator classes only exist on PostgreSQL;
+    # other backends (SQLite in tests) skip the index and searches scan.
+    def create_sql(self, model, schema_editor, *args, **kwargs):
+        if schema_editor.connection.vendor != "postgresql":
+            return "-- GIN indexes need PostgreSQL"
+        return super().create_sql(model, schema_editor, *args, **kwargs)
+
+    def remove_sql(self, model, schema_editor, *args, **kwargs):
+        if schema_editor.connection.vendor != "postgresql":
+            return "-- GIN indexes need PostgreSQL"
+        return super().remove_sql(model, schema_editor, *args, **kwargs)
+
+
+def build_search_document(*values):
+    return " ".join(str(value) for value in values if value).lower()
+
+
+def get_search_document(obj):
+    # Built from the model's search_fields, e.g. "group__name".
+    values = []
+    for path in obj.search_fields:
+        value = obj
+        for name in path.split("__"):
+            value = value and getattr(value, name)
+        values.append(value)
+    return build_search_document(*values)
+
+
+def get_search_document_expression(model):
+    # The same document as get_search_document, computed by the database,
+    # so rows can be rewritten with one UPDATE without being loaded.
+    parts = []
+    for path in model.search_fields:
+        name, _, related_name = path.partition("__")
+        if related_name:
+            relation = model._meta.get_field(name)
+            value = Subquery(relation.related_model.objects.filter(
+                pk=OuterRef(relation.attname)
+            ).values(related_name)[:1])
+        else:
+            value = F(name)
+        parts.append(Case(
+            When(GreaterThan(Length(value), 0), then=Concat(Value(" "), value)),
+            default=Value(""), output_field=models.TextField()
+        ))
+    return Lower(Substr(Concat(*parts, output_field=models.TextField()), 2))
+
+
+def refresh_search_documents(queryset):
+    # Rebuilds the stored search documents of every row in the queryset, for
+    # when a related name (group, shop or user) they were built from changes.
+    return queryset.update(search_document=get_search_document_expression(queryset.model))
 
 
 class InventoryGroup(models.Model):
@@ -8,30 +284,74 @@ class InventoryGroup(models.Model):
                 related_name="inventory_group", null=True, on_delete=models.SET_NULL)
     name = models.CharField(max_length=100, unique=True)
     belongs_to = models.ForeignKey("self", related_name="group_relations", null=True, on_delete=models.SET_NULL)
+    path = models.CharField(max_length=255, default="/", db_index=True)
+    # Counters of the items directly in the group, kept up to date by every
+    # inventory write (see update_group_counters) so listing groups never
+    # reads their items.
+    item_count = models.PositiveIntegerField(default=0)
+    in_stock_count = models.PositiveIntegerField(default=0)
+    stock_value = models.FloatField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
-    created_by = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ("-created_at", )
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="inventory_group_created_idx"),
+            models.Index(fields=["updated_at", "id"], name="inventory_group_updated_idx"),
+        ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.old_name = self.name
+        # Read through __dict__ so deferred fields are not loaded here.
+        self.old_name = self.__dict__.get("name")
+        self.old_path = self.__dict__.get("path")
+
+    @property
+    def descendants_path(self):
+        return f"{self.path}{self.id}/"
 
     def save(self, *args, **kwargs):
+        is_new = self.pk is None
         action = f"Created Inventory Group: {self.name}"
-        if self.pk is not None:
+        if not is_new:
             action = f"Updated Inventory Group from '{self.old_name}' to '{self.name}'"
-        super().save(*args, **kwargs)
+
+        # path holds the ids of every ancestor, e.g. "/1/5/" for a group under
+        # group 5 under group 1, so a subtree is a single prefix match.
+        self.path = "/" if self.belongs_to is None else self.belongs_to.descendants_path
+        if not is_new and f"/{self.pk}/" in self.path:
+            raise ValidationError(
+                {"belongs_to_id": ["An inventory group cannot belong to itself or to one of its sub groups"]}
+            )
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if not is_new and self.old_path != self.path:
+                self.move_descendants(f"{self.old_path}{self.id}/", self.descendants_path)
+            if self.old_name is not None and self.old_name != self.name:
+                refresh_search_documents(self.inventories.all())
+        self.old_name = self.name
+        self.old_path = self.path
 
         add_user_activity(self.created_by, action=action)
 
     def delete(self, *args, **kwargs):
         created_by = self.created_by
         action = f"Deleted Inventory Group: {self.name}"
-        super().delete(*args, **kwargs)
+        with transaction.atomic():
+            # Direct sub groups become roots once belongs_to is set to null.
+            self.move_descendants(self.descendants_path, "/")
+            super().delete(*args, **kwargs)
         add_user_activity(created_by, action=action)
 
+    def move_descendants(self, old_prefix, new_prefix):
+        if old_prefix == new_prefix:
+            return
+        InventoryGroup.objects.filter(path__startswith=old_prefix).update(
+            path=Concat(Value(new_prefix), Substr("path", len(old_prefix) + 1))
+        )
+
     def __str__(self):
         return self.name
 
@@ -39,31 +359,65 @@ class Inventory(models.Model):
     created_by = models.ForeignKey(CustomUser, null=True, related_name="inventory_items",on_delete=models.SET_NULL)
     code = models.CharField(max_length=100, unique=True, null=True)
     photo = models.TextField(blank=True, null=True)
-    groups = models.ForeignKey(InventoryGroup, related_name="inventories", null=True, on_delete=models.SET_NULL)
+    photo_hash = models.CharField(max_length=64, blank=True, null=True)
+    group = models.ForeignKey(InventoryGroup, related_name="inventories", null=True, on_delete=models.SET_NULL)
     total = models.PositiveIntegerField()
     remaining = models.PositiveIntegerField(null=True)
     name = models.CharField(max_length=256)
     price = models.FloatField(default=0)
+    search_document = models.TextField(blank=True, default="")
+    search_fields = ("code", "name", "group__name", "created_by__fullname", "created_by__email")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ("-created_at", )
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="inventory_created_idx"),
+            models.Index(fields=["updated_at", "id"], name="inventory_updated_idx"),
+            # Only in-stock rows, so counting them is a scan of this index.
+            models.Index(fields=["id"], condition=Q(remaining__gt=0), name="inventory_in_stock_idx"),
+            PostgresGinIndex(fields=["search_document"], opclasses=["gin_trgm_ops"],
+                             name="inventory_search_trgm_idx"),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.old_remaining = self.__dict__.get("remaining")
+        self.old_counter_state = (
+            self.__dict__.get("group_id"), self.__dict__.get("remaining"), self.__dict__.get("price")
+        )
     
     def save(self, *args, **kwargs):
         is_new = self.pk is None
 
         if is_new:
             self.remaining = self.total
-        
-        super().save(*args, **kwargs)
-
-        if is_new:
-            id_length = len(str(self.id))
-            code_length = 6 - id_length
-            zeros = "".join(["0" for i in range(code_length)])
-            self.code = f"INV{zeros}{self.id}"
-            self.save()
+            reserved_ids = reserve_inventory_ids(1)
+            if reserved_ids:
+                self.id = reserved_ids[0]
+                self.code = get_inventory_code(self.id)
+                kwargs["force_insert"] = True
+
+        if "photo" not in self.get_deferred_fields():
+            self.externalize_photo()
+        self.search_document = self.get_search_document()
+
+        with transaction.atomic():
+            if not is_new:
+                self.lock_stored_state(kwargs)
+            super().save(*args, **kwargs)
+
+            if is_new and self.code is None:
+                self.code = get_inventory_code(self.id)
+                self.search_document = self.get_search_document()
+                Inventory.objects.filter(id=self.id).update(code=self.code, search_document=self.search_document)
+
+            update_group_counters(get_counter_changes(
+                None if is_new else self.old_counter_state, self.get_counter_state()
+            ))
+            self.old_counter_state = self.get_counter_state()
+            self.record_stock_change(StockMovement.RECEIPT if is_new else StockMovement.ADJUSTMENT, self.created_by)
         
         action = f"Created Inventory: {self.name} with code {self.code}"
         if not is_new:
@@ -74,30 +428,102 @@ class Inventory(models.Model):
     def delete(self, *args, **kwargs):
         created_by = self.created_by
         action = f"Deleted Inventory: {self.name} with code {self.code}"
-        super().delete(*args, **kwargs)
+        with transaction.atomic():
+            super().delete(*args, **kwargs)
+            update_group_counters(get_counter_changes(self.old_counter_state, None))
         add_user_activity(created_by, action=action)
 
+    def lock_stored_state(self, kwargs):
+        # The row may have been sold from since it was read, so remaining is
+        # left out of the write when it was not changed and otherwise applied
+        # as the change made to it on top of the locked row.
+        stored = Inventory.objects.select_for_update().filter(id=self.id).values_list(
+            "group_id", "remaining", "price"
+        ).first()
+        if stored is None:
+            return
+        update_fields = kwargs.get("update_fields")
+        deferred = self.get_deferred_fields()
+        changed = (
+            "remaining" not in deferred and self.remaining != self.old_remaining
+            and (update_fields is None or "remaining" in update_fields)
+        )
+
+        if changed:
+            remaining = (stored[1] or 0) + (self.remaining or 0) - (self.old_remaining or 0)
+            if remaining < 0:
+                raise ValidationError({"remaining": [f"Not enough items in stock for {self.name}"]})
+            self.remaining = remaining
+        else:
+            if update_fields is None:
+                update_fields = [
+                    field.attname for field in self._meta.concrete_fields
+                    if not field.primary_key and field.attname not in deferred
+                ]
+            kwargs["update_fields"] = [field for field in update_fields if field != "remaining"]
+            if "remaining" not in deferred:
+                self.remaining = stored[1]
+
+        self.old_remaining = stored[1]
+        self.old_counter_state = stored
+
+    def get_counter_state(self):
+        # What the item counts for in the counters of its group.
+        return self.group_id, self.remaining, self.price
+
+    def record_stock_change(self, kind, created_by=None):
+        # Every change to remaining goes into the stock ledger as a movement
+        # of the difference.
+        quantity = (self.remaining or 0) - (self.old_remaining or 0)
+        self.old_remaining = self.remaining
+        if quantity:
+            return StockMovement.objects.create(item=self, kind=kind, quantity=quantity, created_by=created_by)
+
+    def externalize_photo(self):
+        # Inline base64 photos are moved to the photo storage and replaced by
+        # the hash of their content.
+        content = decode_photo(self.photo)
+        if content is not None:
+            self.photo_hash = store_photo(content)
+            self.photo = None
+
+    def get_search_document(self):
+        return get_search_document(self)
+
     def __str__(self):
         return f"{self.name} - {self.code}"
 
 class Shop(models.Model):
     created_by = models.ForeignKey(CustomUser, null=True, related_name="shops",on_delete=models.SET_NULL)
     name = models.CharField(max_length=100, unique=True)
+    search_document = models.TextField(blank=True, default="")
+    search_fields = ("name", "created_by__fullname", "created_by__email")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ("-created_at", )
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="shop_created_idx"),
+            models.Index(fields=["updated_at", "id"], name="shop_updated_idx"),
+            PostgresGinIndex(fields=["search_document"], opclasses=["gin_trgm_ops"],
+                             name="shop_search_trgm_idx"),
+        ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.old_name = self.name
+        self.old_name = self.__dict__.get("name")
 
     def save(self, *args, **kwargs):
         action = f"Created New Shop: {self.name}"
         if self.pk is not None:
             action = f"Updated Shop from '{self.old_name}' to '{self.name}'"
-        super().save(*args, **kwargs)
+        self.search_document = self.get_search_document()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self.old_name is not None and self.old_name != self.name:
+                refresh_search_documents(self.sale_shop.all())
+        self.old_name = self.name
 
         add_user_activity(self.created_by, action=action)
 
@@ -107,29 +533,44 @@ class Shop(models.Model):
         super().delete(*args, **kwargs)
         add_user_activity(created_by, action=action)
 
+    def get_search_document(self):
+        return get_search_document(self)
+
     def __str__(self):
         return self.name
 
 
 class Invoice(models.Model):
     created_by = models.ForeignKey(CustomUser, null=True, related_name="invoices",on_delete=models.SET_NULL)
-    Shop = models.ForeignKey(Shop, related_name="sale_shop", null=True, on_delete=models.SET_NULL)
+    shop = models.ForeignKey(Shop, related_name="sale_shop", null=True, on_delete=models.SET_NULL)
+    search_document = models.TextField(blank=True, default="")
+    search_fields = ("shop__name", "created_by__fullname", "created_by__email")
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ("-created_at", )
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="invoice_created_idx"),
+            models.Index(fields=["shop", "-created_at"], name="invoice_shop_created_idx"),
+            PostgresGinIndex(fields=["search_document"], opclasses=["gin_trgm_ops"],
+                             name="invoice_search_trgm_idx"),
+        ]
 
     def save(self, *args, **kwargs):
-        action = f"Created New Invoice: {self.name}"
+        self.search_document = self.get_search_document()
         super().save(*args, **kwargs)
+        action = f"Created New Invoice: {self.id}"
         add_user_activity(self.created_by, action=action)
     
     def delete(self, *args, **kwargs):
         created_by = self.created_by
-        action = f"Deleted Invoice: {self.name}"
+        action = f"Deleted Invoice: {self.id}"
         super().delete(*args, **kwargs)
         add_user_activity(created_by, action=action)
 
+    def get_search_document(self):
+        return get_search_document(self)
+
 class InvoiceItem(models.Model):
     invoice = models.ForeignKey(Invoice, related_name="invoice_items",null=True, on_delete=models.SET_NULL)
     item = models.ForeignKey(Inventory, related_name="inventory_invoices", null=True, on_delete=models.SET_NULL)
@@ -141,21 +582,419 @@ class InvoiceItem(models.Model):
 
     class Meta:
         ordering = ("-created_at", )
+        indexes = [
+            models.Index(fields=["created_at"], name="invoice_item_created_idx"),
+        ]
     
-    def save(self, *args, **kwargs ):
-        if self.item.remaining < self.quantity:
-            raise Exception(f"Not enough items in stock")
+    def save(self, *args, **kwargs):
+        # A line moves stock, the ledger, the group counters and the daily
+        # rollups together, so lines are only written by post_invoice_items.
+        raise ValidationError("Invoice items are posted with post_invoice_items")
 
-        self.item_name = self.item.name
-        self.item_code = self.item.code
+    def __str__(self):
+        return f"{self.item_code} - {self.quantity}"
 
-        self.amount = self.item.price * self.quantity
-        self.item.remaining = self.item.remaining - self.quantity
-        self.item.save()
 
-        super().save(*args, **kwargs)
+class StockMovement(models.Model):
+    RECEIPT = "receipt"
+    SALE = "sale"
+    ADJUSTMENT = "adjustment"
+    RETURN = "return"
+    KIND_CHOICES = (
+        (RECEIPT, RECEIPT),
+        (SALE, SALE),
+        (ADJUSTMENT, ADJUSTMENT),
+        (RETURN, RETURN),
+    )
+
+    # Append only: quantity is signed (sales are negative), so the stock of an
+    # item at any moment is the sum of its movements up to that moment.
+    item = models.ForeignKey(Inventory, related_name="stock_movements", null=True, on_delete=models.SET_NULL)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.IntegerField()
+    invoice = models.ForeignKey(Invoice, related_name="stock_movements", null=True, on_delete=models.SET_NULL)
+    created_by = models.ForeignKey(CustomUser, related_name="stock_movements", null=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ("-created_at", )
+        indexes = [
+            models.Index(fields=["item", "created_at"], name="stock_movement_item_idx"),
+            models.Index(fields=["-created_at", "-id"], name="stock_movement_created_idx"),
+        ]
 
     def __str__(self):
-        return f"{self.item_code} - {self.quantity}"
+        return f"{self.item_id} - {self.kind} - {self.quantity}"
+
+
+class StockSnapshot(models.Model):
+    # The stock of an item as of taken_at, so point in time queries only sum
+    # the movements after the latest snapshot instead of the whole ledger.
+    item = models.ForeignKey(Inventory, related_name="stock_snapshots", on_delete=models.CASCADE)
+    remaining = models.IntegerField()
+    taken_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ("-taken_at", )
+        unique_together = ("item", "taken_at")
+
+    def __str__(self):
+        return f"{self.item_id} - {self.taken_at} - {self.remaining}"
+
+
+def record_stock_movement(item_id, kind, quantity, created_by=None, invoice=None):
+    # Receipts, returns and manual adjustments posted outside of invoices.
+    # Receipts also count towards the total the item was stocked with.
+    if kind == StockMovement.SALE:
+        raise ValidationError({"kind": ["Sales are recorded by posting an invoice"]})
+    if kind in (StockMovement.RECEIPT, StockMovement.RETURN) and quantity <= 0:
+        raise ValidationError({"quantity": [f"A {kind} must have a positive quantity"]})
+
+    with transaction.atomic():
+        item = Inventory.objects.select_for_update().filter(id=item_id).first()
+        if item is None:
+            raise ValidationError({"item_id": [f"Inventory item with id {item_id} not found"]})
+        if (item.remaining or 0) + quantity < 0:
+            raise ValidationError({"quantity": [f"Not enough items in stock for {item.name}"]})
+
+        changes = {"remaining": Coalesce(F("remaining"), 0) + quantity, "updated_at": timezone.now()}
+        if kind == StockMovement.RECEIPT:
+            changes["total"] = F("total") + quantity
+        Inventory.objects.filter(id=item.id).update(**changes)
+        update_group_counters(get_stock_counter_changes(item, quantity))
+
+        movement = StockMovement.objects.create(
+            item=item, kind=kind, quantity=quantity, created_by=created_by, invoice=invoice
+        )
+        bump_cache_version(Inventory)
+    return movement
+
+
+ledger_start = datetime.min.replace(tzinfo=dt_timezone.utc)
+
+
+def get_stock_as_of(moment=None, queryset=None):
+    # Annotates every item created by the moment with stock_as_of: its latest
+    # snapshot taken by then plus the movements between the two.
+    moment = moment or timezone.now()
+    queryset = Inventory.objects.all() if queryset is None else queryset
+    snapshots = StockSnapshot.objects.filter(item=OuterRef("pk"), taken_at__lte=moment).order_by("-taken_at")
+
+    return queryset.filter(created_at__lte=moment).annotate(
+        snapshot_taken_at=Subquery(snapshots.values("taken_at")[:1]),
+        snapshot_remaining=Subquery(snapshots.values("remaining")[:1]),
+    ).annotate(
+        stock_as_of=Coalesce("snapshot_remaining", 0) + Coalesce(Subquery(
+            get_movements_since_snapshot(moment).values("item").annotate(total=Sum("quantity")).values("total")
+        ), 0)
+    )
+
+
+def get_movements_since_snapshot(moment):
+    return StockMovement.objects.filter(
+        item=OuterRef("pk"), created_at__gt=Coalesce(OuterRef("snapshot_taken_at"), Value(ledger_start)),
+        created_at__lte=moment
+    ).order_by()
+
+
+def take_stock_snapshots(taken_at, batch_size=1000):
+    # Compacts the ledger up to taken_at into one snapshot per item that has
+    # moved since its previous snapshot. taken_at should lag behind now so no
+    # transaction still in flight can add a movement before it.
+    items = get_stock_as_of(taken_at).filter(
+        Exists(get_movements_since_snapshot(taken_at))
+    ).values_list("id", "stock_as_of").order_by()
+
+    count = 0
+    snapshots = []
+    for item_id, remaining in items.iterator(chunk_size=batch_size):
+        snapshots.append(StockSnapshot(item_id=item_id, remaining=remaining, taken_at=taken_at))
+        if len(snapshots) >= batch_size:
+            count += len(StockSnapshot.objects.bulk_create(snapshots))
+            snapshots = []
+    if snapshots:
+        count += len(StockSnapshot.objects.bulk_create(snapshots))
+    return count
+
+
+def reconcile_stock(queryset=None):
+    # Yields (item id, remaining, stock according to the ledger) for every
+    # item whose remaining disagrees with its ledger.
+    items = get_stock_as_of(queryset=queryset).filter(
+        ~Q(remaining=F("stock_as_of")) | Q(remaining__isnull=True)
+    ).values_list("id", "remaining", "stock_as_of").order_by("id")
+    return items.iterator()
+
+
+def rebuild_remaining(queryset=None, batch_size=1000):
+    # Rewrites remaining from the ledger for the items that drifted. Rows are
+    # locked in id order, like invoice posting does, and checked again under
+    # the lock.
+    item_ids = [item_id for item_id, _, _ in reconcile_stock(queryset)]
+    fixed = 0
+    for start in range(0, len(item_ids), batch_size):
+        with transaction.atomic():
+            locked = Inventory.objects.select_for_update().filter(
+                id__in=item_ids[start:start + batch_size]
+            ).order_by("id").only("id", "group", "remaining", "price")
+            locked = {item.id: item for item in locked}
+            stock = {item_id: ledger for item_id, _, ledger in reconcile_stock(Inventory.objects.filter(id__in=list(locked)))}
+            if not stock:
+                continue
+            Inventory.objects.filter(id__in=stock.keys()).update(
+                remaining=Case(
+                    *[When(id=item_id, then=Value(ledger)) for item_id, ledger in stock.items()],
+                    output_field=models.PositiveIntegerField()
+                ),
+                updated_at=timezone.now()
+            )
+            update_group_counters(
+                change for item_id, ledger in stock.items()
+                for change in get_stock_counter_changes(locked[item_id], ledger - (locked[item_id].remaining or 0))
+            )
+            fixed += len(stock)
+    if fixed:
+        bump_cache_version(Inventory)
+    return fixed
+
+
+def is_group_loaded(group):
+    # Whether the group and its ancestors already carry their parents and
+    # users, as load_group_ancestors leaves them.
+    while group is not None:
+        if not InventoryGroup.created_by.is_cached(group):
+            return False
+        user = group.created_by
+        if user is not None and "groups" not in getattr(user, "_prefetched_objects_cache", {}):
+            return False
+        if group.belongs_to_id is None:
+            return True
+        if not InventoryGroup.belongs_to.is_cached(group):
+            return False
+        group = group.belongs_to
+    return True
+
+
+def load_group_ancestors(groups):
+    # Resolves belongs_to and created_by for every group and all of its
+    # ancestors with a fixed number of queries, so serializing the nested
+    # parents does not query once per level.
+    groups = [group for group in groups if group is not None]
+    pending = [group for group in groups if not is_group_loaded(group)]
+    if not pending:
+        return groups
+    ancestor_ids = {
+        int(group_id) for group in pending for group_id in group.path.strip("/").split("/") if group_id
+    }
+    missing_ids = ancestor_ids | {
+        group.id for group in pending if not InventoryGroup.created_by.is_cached(group)
+    }
+    loaded = InventoryGroup.objects.select_related("created_by").in_bulk(missing_ids) if missing_ids else {}
+
+    for group in pending:
+        if group.id in loaded and loaded[group.id] is not group:
+            group.created_by = loaded[group.id].created_by
+        loaded.setdefault(group.id, group)
+
+    for group in [*pending, *loaded.values()]:
+        if group.belongs_to_id is not None and group.belongs_to_id in loaded:
+            group.belongs_to = loaded[group.belongs_to_id]
+
+    prefetch_related_objects(
+        [group.created_by for group in loaded.values() if group.created_by is not None],
+        "groups", "user_permissions"
+    )
+    return groups
+
+
+class DailySale(models.Model):
+    item = models.ForeignKey(Inventory, related_name="daily_sales", null=True, on_delete=models.SET_NULL)
+    shop = models.ForeignKey(Shop, related_name="daily_sales", null=True, on_delete=models.SET_NULL)
+    day = models.DateField()
+    quantity = models.PositiveIntegerField(default=0)
+    amount = models.FloatField(default=0)
+
+    class Meta:
+        ordering = ("-day", )
+        unique_together = ("item", "shop", "day")
+        indexes = [
+            models.Index(fields=["day", "shop"], name="daily_sale_day_shop_idx"),
+            models.Index(fields=["day", "item"], name="daily_sale_day_item_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.day} - {self.item_id} - {self.quantity}"
+
+
+def post_invoice_items(invoice, invoice_item_data):
+    # Lines for the same item are merged so every item is checked and
+    # decremented once. Rows are locked in id order to avoid deadlocks
+    # between concurrent checkouts touching the same items.
+    quantities = {}
+    for data in invoice_item_data:
+        item_id = int(data["item_id"])
+        quantities[item_id] = quantities.get(item_id, 0) + int(data["quantity"])
+
+    with transaction.atomic():
+        items = {
+            item.id: item for item in Inventory.objects.select_for_update().filter(
+                id__in=quantities.keys()
+            ).order_by("id")
+        }
+
+        for item_id, quantity in quantities.items():
+            item = items.get(item_id)
+            if item is None:
+                raise ValidationError({"invoice_item_data": [f"Inventory item with id {item_id} not found"]})
+            if item.remaining is None or item.remaining < quantity:
+                raise ValidationError({"invoice_item_data": [f"Not enough items in stock for {item.name}"]})
+
+        Inventory.objects.filter(id__in=items.keys()).update(
+            remaining=Case(
+                *[When(id=item_id, then=F("remaining") - quantity) for item_id, quantity in quantities.items()],
+                default=F("remaining"),
+                output_field=models.PositiveIntegerField()
+            ),
+            updated_at=timezone.now()
+        )
+        update_group_counters(
+            change for item_id, quantity in quantities.items()
+            for change in get_stock_counter_changes(items[item_id], -quantity)
+        )
+
+        invoice_items = []
+        for data in invoice_item_data:
+            item = items[int(data["item_id"])]
+            quantity = int(data["quantity"])
+            invoice_items.append(InvoiceItem(
+                invoice=invoice,
+                item=item,
+                item_name=item.name,
+                item_code=item.code,
+                quantity=quantity,
+                amount=item.price * quantity
+            ))
+
+        invoice_items = InvoiceItem.objects.bulk_create(invoice_items)
+        StockMovement.objects.bulk_create([
+            StockMovement(item_id=invoice_item.item_id, kind=StockMovement.SALE, quantity=-invoice_item.quantity,
+                          invoice=invoice, created_by=invoice.created_by, created_at=invoice_item.created_at)
+            for invoice_item in invoice_items
+        ])
+        add_daily_sales(invoice, invoice_items)
+        bump_cache_version(Inventory, Invoice)
+
+        return invoice_items
+
+
+def add_daily_sales(invoice, invoice_items):
+    # Must run in the transaction that locked the invoiced items, which keeps
+    # concurrent invoices from racing on the same (item, shop, day) rows.
+    day = timezone.localtime(invoice.created_at).date()
+    totals = {}
+    for invoice_item in invoice_items:
+        quantity, amount = totals.get(invoice_item.item_id, (0, 0))
+        totals[invoice_item.item_id] = (quantity + invoice_item.quantity, amount + invoice_item.amount)
+
+    existing = DailySale.objects.filter(shop_id=invoice.shop_id, day=day, item_id__in=totals.keys())
+    existing = {daily_sale.item_id: daily_sale for daily_sale in existing}
+
+    for item_id, daily_sale in existing.items():
+        quantity, amount = totals.pop(item_id)
+        daily_sale.quantity = F("quantity") + quantity
+        daily_sale.amount = F("amount") + amount
+    if existing:
+        DailySale.objects.bulk_update(existing.values(), ["quantity", "amount"])
+
+    DailySale.objects.bulk_create([
+        DailySale(item_id=item_id, shop_id=invoice.shop_id, day=day, quantity=quantity, amount=amount)
+        for item_id, (quantity, amount) in totals.items()
+    ])
+
+
+def rebuild_daily_sales():
+    # Lines are bucketed by the time of their invoice in the current time
+    # zone, as add_daily_sales does; a line can be stamped after midnight
+    # when its invoice was posted just before.
+    tzinfo = timezone.get_current_timezone()
+    daily_sales = InvoiceItem.objects.annotate(
+        day=Coalesce(TruncDate("invoice__created_at", tzinfo=tzinfo), TruncDate("created_at", tzinfo=tzinfo))
+    ).values("item_id", "invoice__shop_id", "day").annotate(
+        total_quantity=Sum("quantity"), total_amount=Sum("amount")
+    ).order_by()
+
+    with transaction.atomic():
+        DailySale.objects.all().delete()
+        DailySale.objects.bulk_create((
+            DailySale(
+                item_id=daily_sale["item_id"],
+                shop_id=daily_sale["invoice__shop_id"],
+                day=daily_sale["day"],
+                quantity=daily_sale["total_quantity"],
+                amount=daily_sale["total_amount"]
+            ) for daily_sale in daily_sales.iterator()
+        ), batch_size=1000)
+        bump_cache_version(Invoice)
+
+
+class Tombstone(models.Model):
+    # Left behind by every deleted inventory item, group and shop, so sync
+    # clients learn about the deletion. Kept for SYNC["TOMBSTONE_DAYS"].
+    model = models.CharField(max_length=100)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ("deleted_at", )
+        indexes = [
+            models.Index(fields=["deleted_at", "id"], name="tombstone_deleted_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id} - {self.deleted_at}"
+
+
+def add_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(model=sender._meta.label_lower, object_id=instance.pk)
+
+
+def detach_nulled_references(sender, instance, **kwargs):
+    # Rows pointing at a deleted row would be set to null without being
+    # saved, so they are nulled here, in the same transaction: updated_at is
+    # moved for sync clients to fetch them again, and search documents built
+    # from the deleted row are rebuilt without it.
+    now = timezone.now()
+    for model in (Inventory, InventoryGroup, Shop, Invoice):
+        for field in model._meta.concrete_fields:
+            if not (field.is_relation and field.related_model is sender
+                    and field.remote_field.on_delete is models.SET_NULL):
+                continue
+            rows = model.objects.filter(**{field.name: instance})
+            searched = any(path.startswith(f"{field.name}__") for path in getattr(model, "search_fields", ()))
+            ids = list(rows.values_list("id", flat=True)) if searched else None
+            changes = {field.name: None}
+            if any(model_field.name == "updated_at" for model_field in model._meta.concrete_fields):
+                changes["updated_at"] = now
+            rows.update(**changes)
+            if ids:
+                refresh_search_documents(model.objects.filter(id__in=ids))
+
+
+def prune_tombstones(before):
+    return Tombstone.objects.filter(deleted_at__lt=before).delete()[0]
+
+
+def track_user_search_fields(sender, instance, **kwargs):
+    instance.search_fields_changed = False
+    if instance.pk is not None:
+        old_values = sender.objects.filter(pk=instance.pk).values_list("fullname", "email").first()
+        instance.search_fields_changed = old_values is not None and old_values != (instance.fullname, instance.email)
+
+
+def refresh_user_search_documents(sender, instance, **kwargs):
+    if getattr(instance, "search_fields_changed", False):
+        with transaction.atomic():
+            refresh_search_documents(instance.inventory_items.all())
+            refresh_search_documents(instance.shops.all())
+            refresh_search_documents(instance.invoices.all())
 
-    
\ No newline at end of file
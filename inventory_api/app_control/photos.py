@@ -0,0 +1,121 @@
+import base64
+import binascii
+import hashlib
+import io
+import re
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import get_storage_class
+from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
+
+
+photo_storage = SimpleLazyObject(lambda: get_storage_class(settings.PHOTO_STORAGE["BACKEND"])(
+    **settings.PHOTO_STORAGE.get("OPTIONS", {})
+))
+
+data_url_re = re.compile(r"^data:[\w/+.-]+;base64,", re.IGNORECASE)
+
+content_types = (
+    (re.compile(rb"\x89PNG\r\n\x1a\n"), "image/png"),
+    (re.compile(rb"\xff\xd8\xff"), "image/jpeg"),
+    (re.compile(rb"GIF8[79]a"), "image/gif"),
+    (re.compile(rb"RIFF.{4}WEBP", re.DOTALL), "image/webp"),
+)
+
+
+def decode_photo(value):
+    # Photos arrive as data URLs or bare base64 strings of an image; anything
+    # else, like an external URL or a word that happens to be valid base64,
+    # is left where it is.
+    if not value:
+        return None
+
+    value = data_url_re.sub("", value.strip(), count=1)
+    try:
+        content = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return content if is_image(content) else None
+
+
+def is_image(content):
+    # The signature picks the format; Pillow, when installed, also checks
+    # that the rest of the file is an image of that format.
+    content_type = guess_content_type(content[:16])
+    if content_type == "application/octet-stream":
+        return False
+    try:
+        from PIL import Image
+    except ImportError:
+        return True
+
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            image.verify()
+            return Image.MIME.get(image.format) == content_type
+    except Exception:
+        return False
+
+
+def get_photo_name(photo_hash, thumbnail=False):
+    name = f"{photo_hash[:2]}/{photo_hash[2:4]}/{photo_hash}"
+    return f"{name}.thumbnail" if thumbnail else name
+
+
+def store_photo(content):
+    # Files are named after the SHA-256 of their content, so uploading the
+    # same image twice stores it once.
+    photo_hash = hashlib.sha256(content).hexdigest()
+    name = get_photo_name(photo_hash)
+
+    if not photo_storage.exists(name):
+        photo_storage.save(name, ContentFile(content))
+        thumbnail = make_thumbnail(content)
+        if thumbnail is not None:
+            photo_storage.save(get_photo_name(photo_hash, thumbnail=True), ContentFile(thumbnail))
+
+    return photo_hash
+
+
+def make_thumbnail(content):
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+
+    try:
+        image = Image.open(io.BytesIO(content))
+        image.thumbnail(settings.PHOTO_STORAGE.get("THUMBNAIL_SIZE", (256, 256)))
+    except Exception:
+        return None
+
+    output = io.BytesIO()
+    if image.mode in ("RGBA", "LA", "P"):
+        image.save(output, format="PNG")
+    else:
+        image.convert("RGB").save(output, format="JPEG", quality=85)
+    return output.getvalue()
+
+
+def open_photo(photo_hash, thumbnail=False):
+    # Falls back to the original when no thumbnail could be generated.
+    if thumbnail and photo_storage.exists(get_photo_name(photo_hash, thumbnail=True)):
+        return photo_storage.open(get_photo_name(photo_hash, thumbnail=True))
+    if photo_storage.exists(get_photo_name(photo_hash)):
+        return photo_storage.open(get_photo_name(photo_hash))
+    return None
+
+
+def guess_content_type(head):
+    for signature, content_type in content_types:
+        if signature.match(head):
+            return content_type
+    return "application/octet-stream"
+
+
+def get_photo_url(photo_hash, thumbnail=False):
+    if not photo_hash:
+        return None
+    url = reverse("photo", args=[photo_hash])
+    return f"{url}?thumbnail=true" if thumbnail else url
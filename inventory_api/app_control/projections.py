@@ -0,0 +1,59 @@
+from inventory_api.projections import Projection
+from user_control.projections import UserProjection
+from .models import Invoice
+from .photos import get_photo_url
+from .serializers import (InventoryGroupSerializer, InventorySerializer, ShopSerializer, InvoiceSerializer,
+                          InvoiceItemSerializer)
+
+
+class InventoryGroupProjection(Projection):
+    serializer_class = InventoryGroupSerializer
+    nested = {"user": UserProjection, "belongs_to": "self"}
+    extra_columns = ("path",)
+
+    def fetch(self, ids):
+        # Ancestors are read along with the groups, from their paths, so the
+        # nested belongs_to chain does not cost a query per level.
+        rows = list(super().fetch(ids))
+        ancestor_ids = {
+            int(group_id) for row in rows for group_id in row["path"].strip("/").split("/") if group_id
+        } - set(ids)
+        if ancestor_ids:
+            rows.extend(super().fetch(ancestor_ids))
+        return rows
+
+
+class InventoryProjection(Projection):
+    serializer_class = InventorySerializer
+    nested = {"group": InventoryGroupProjection}
+    method_columns = {"photo": ("photo_hash",), "photo_thumbnail": ("photo_hash",)}
+
+    # Lists defer the photo column, so only stored photos have one.
+    def get_photo(self, row):
+        return get_photo_url(row["photo_hash"])
+
+    def get_photo_thumbnail(self, row):
+        return get_photo_url(row["photo_hash"], thumbnail=True)
+
+
+class ShopProjection(Projection):
+    serializer_class = ShopSerializer
+    nested = {"created_by": UserProjection}
+
+
+class InvoiceItemProjection(Projection):
+    serializer_class = InvoiceItemSerializer
+    method_columns = {"invoice": ("invoice_id",), "item": ("item_id", "item__name", "item__code")}
+    ordering = ("-created_at", "id")
+
+    # invoice and item are rendered with str() of the related instance.
+    def get_invoice(self, row):
+        return None if row["invoice_id"] is None else str(Invoice(id=row["invoice_id"]))
+
+    def get_item(self, row):
+        return None if row["item_id"] is None else f"{row['item__name']} - {row['item__code']}"
+
+
+class InvoiceProjection(Projection):
+    serializer_class = InvoiceSerializer
+    nested = {"created_by": UserProjection, "shop": ShopProjection, "invoice_items": InvoiceItemProjection}
@@ -1,19 +1,42 @@
-from .models import Inventory, InventoryGroup, Shop, Invoice, InvoiceItem
+from .models import (Inventory, InventoryGroup, Shop, Invoice, InvoiceItem, StockMovement, post_invoice_items,
+                     load_group_ancestors)
 from rest_framework import serializers
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from user_control.serializers import CustomUserSerializer
+from .photos import get_photo_url
+
+class InventoryGroupListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        groups = list(data.all() if hasattr(data, "all") else data)
+        # A fieldset may render the parent and the user as ids only.
+        if isinstance(self.child.fields.get("belongs_to"), serializers.SerializerMethodField):
+            load_group_ancestors(groups)
+        return super().to_representation(groups)
+
 
 class InventoryGroupSerializer(serializers.ModelSerializer):
-    user = CustomUserSerializer(read_only=True)
-    created_by = serializers.CharField(write_only=True)
+    user = CustomUserSerializer(read_only=True, source="created_by")
+    created_by_id = serializers.CharField(write_only=True, required=False)
     belongs_to = serializers.SerializerMethodField(read_only=True)
-    belongs_to_id = serializers.CharField(write_only=True)
-    total_items = serializers.CharField(read_only=True, required=False)
+    belongs_to_id = serializers.CharField(write_only=True, required=False, allow_null=True)
+    total_items = serializers.CharField(read_only=True, source="item_count")
 
 
 
     class Meta:
         model = InventoryGroup
-        fields = '__all__'
+        exclude = ("path", "item_count")
+        read_only_fields = ("in_stock_count", "stock_value")
+        list_serializer_class = InventoryGroupListSerializer
+
+    def to_representation(self, instance):
+        # A group serialized on its own, like a retrieve, loads its chain
+        # here; within a list the list serializer has loaded it already.
+        if self.parent is None and isinstance(self.fields.get("belongs_to"), serializers.SerializerMethodField):
+            load_group_ancestors([instance])
+        return super().to_representation(instance)
 
     def get_belongs_to(self, obj):
         if obj.belongs_to is not None:
@@ -21,15 +44,60 @@ class InventoryGroupSerializer(serializers.ModelSerializer):
         return None
 
 
+class PhotoField(serializers.CharField):
+    # Takes an inline base64 photo on write and returns the photo URL on read.
+    # A photo column deferred by a list query is never loaded here.
+
+    def get_attribute(self, instance):
+        return instance
+
+    def to_representation(self, instance):
+        if instance.photo_hash:
+            return get_photo_url(instance.photo_hash)
+        return instance.__dict__.get("photo")
+
+
+class InventoryListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        inventories = list(data.all() if hasattr(data, "all") else data)
+        group = self.child.fields.get("group")
+        if isinstance(group, serializers.BaseSerializer) and isinstance(
+            group.fields.get("belongs_to"), serializers.SerializerMethodField
+        ):
+            load_group_ancestors([inventory.group for inventory in inventories])
+        return super().to_representation(inventories)
+
+
 class InventorySerializer(serializers.ModelSerializer):
-    created_by = serializers.CharField(write_only=True)
     created_by_id = serializers.CharField(write_only=True, required=False)
     group = InventoryGroupSerializer(read_only=True)
     group_id = serializers.CharField(write_only=True)
+    photo = PhotoField(required=False, allow_blank=True, allow_null=True)
+    photo_thumbnail = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Inventory
-        fields = '__all__'
+        exclude = ("search_document", "photo_hash")
+        list_serializer_class = InventoryListSerializer
+
+    def to_representation(self, instance):
+        group = self.fields.get("group")
+        if self.parent is None and isinstance(group, serializers.BaseSerializer) and isinstance(
+            group.fields.get("belongs_to"), serializers.SerializerMethodField
+        ):
+            load_group_ancestors([instance.group])
+        return super().to_representation(instance)
+
+    def get_photo_thumbnail(self, obj):
+        return get_photo_url(obj.photo_hash, thumbnail=True)
+
+class InventoryCSVRowSerializer(serializers.Serializer):
+    group_id = serializers.IntegerField()
+    name = serializers.CharField(max_length=256)
+    total = serializers.IntegerField(min_value=0)
+    price = serializers.FloatField(required=False)
+    photo = serializers.CharField(required=False, allow_blank=True)
 
 class InventoryWithSumSerializer(InventorySerializer):
     sum_of_item = serializers.IntegerField()
@@ -43,7 +111,7 @@ class ShopSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Shop
-        fields = '__all__'
+        exclude = ("search_document",)
 
 class ShopWithAmountSerializer(ShopSerializer):
     amount_total = serializers.FloatField()
@@ -60,9 +128,9 @@ class InvoiceItemSerializer(serializers.ModelSerializer):
         fields = '__all__'
     
 
-class InvoiceItemDataSerializer(serializers.ModelSerializer):
-        item_id = serializers.CharField()
-        quantity = serializers.IntegerField()
+class InvoiceItemDataSerializer(serializers.Serializer):
+        item_id = serializers.IntegerField()
+        quantity = serializers.IntegerField(min_value=1)
 
 class InvoiceSerializer(serializers.ModelSerializer):
     created_by = CustomUserSerializer(read_only=True)
@@ -74,22 +142,41 @@ class InvoiceSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Invoice
-        fields = '__all__'
+        exclude = ("search_document",)
 
     def create(self, validated_data):
-        invoice_item_data = validated_data.pop('invoice_item_data')
+        invoice_item_data = validated_data.pop('invoice_item_data', None)
 
         if not invoice_item_data:
-            raise Exception("You Need to add at least one item to the invoice")
+            raise serializers.ValidationError(
+                {"invoice_item_data": ["You Need to add at least one item to the invoice"]})
+
+        with transaction.atomic():
+            invoice = super().create(validated_data)
+            post_invoice_items(invoice, invoice_item_data)
+
+        # The response lists the new lines with their items, in one query
+        # however many lines there are.
+        prefetch_related_objects([invoice], Prefetch(
+            "invoice_items", queryset=InvoiceItem.objects.select_related("item")
+        ))
+        return invoice
 
-        invoice = super().create(validated_data)
+class StockMovementSerializer(serializers.ModelSerializer):
+    created_by = CustomUserSerializer(read_only=True)
+    item = serializers.CharField(read_only=True)
+    item_id = serializers.IntegerField()
+    invoice_id = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = StockMovement
+        exclude = ("invoice",)
+        read_only_fields = ("created_at",)
 
-        invoice_item_serializer = InvoiceItemSerializer(data=[{"invoice_id": invoice.id, **item} for item in invoice_item_data], many=True)
 
-        if invoice_item_serializer.is_valid():
-            invoice_item_serializer.save()
-        else:
-            invoice.delete()
-            raise Exception(invoice_item_serializer.errors)
+class StockLevelSerializer(serializers.ModelSerializer):
+    stock_as_of = serializers.IntegerField(read_only=True)
 
-        return invoice
\ No newline at end of file
+    class Meta:
+        model = Inventory
+        fields = ("id", "code", "name", "remaining", "stock_as_of")
@@ -1,3 +1,1459 @@
-from django.test import TestCase
+import base64
+import importlib
+import inspect
+import io
+import json
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock, skipIf
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.conf import settings
+from django.db import connection, connections, router
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.test import AsyncClient, TestCase, TransactionTestCase, tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import BaseSerializer
+from rest_framework.test import APIClient
+from inventory_api import caching, instrumentation
+from inventory_api.db_routers import REPLICA_ALIAS, read_from_replica
+from inventory_api.utils import get_access_token, user_cache, token_cache
+from user_control.activity import ActivityWriter
+from user_control.models import CustomUser, UserActivities
+from .management.commands.generate_data import generate_dataset
+from .models import (DailySale, Inventory, InventoryGroup, Invoice, InvoiceItem, Shop, StockMovement,
+                     post_invoice_items, rebuild_daily_sales, rebuild_remaining, reconcile_group_counters,
+                     reconcile_stock, record_stock_movement, refresh_search_documents)
+from .photos import decode_photo
+from .views import InventoryCSVLoaderView, InventoryView, InvoiceView, ShopView
 
-# Create your tests here.
+
+class APITestCase(TestCase):
+    # A small generated dataset and a client signed in as its first admin.
+    # Activities are written as soon as they are added, so tests can count
+    # them after captureOnCommitCallbacks.
+    client_class = APIClient
+    dataset = {"users": 3, "groups": 10, "items": 50, "shops": 3, "invoices": 20, "activities": 20}
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_dataset(seed=1, **cls.dataset)
+        cls.user = CustomUser.objects.filter(role="admin").order_by("id").first()
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        token_cache.clear()
+        writer = mock.patch("user_control.activity._activity_writer", ActivityWriter(asynchronous=False))
+        writer.start()
+        self.addCleanup(writer.stop)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_access_token({'user_id': self.user.id}, 1)}")
+
+
+class InvoiceTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.shop = Shop.objects.order_by("id").first()
+        self.items = list(Inventory.objects.filter(remaining__gte=10).order_by("id")[:3])
+
+    def post_invoice(self, lines):
+        return self.client.post("/app/invoice", {"shop_id": self.shop.id, "invoice_item_data": [
+            {"item_id": item.id, "quantity": quantity} for item, quantity in lines
+        ]}, format="json")
+
+    def get_remaining(self):
+        return list(Inventory.objects.filter(id__in=[item.id for item in self.items])
+                    .order_by("id").values_list("remaining", flat=True))
+
+    def test_posting_decrements_stock_and_records_sales(self):
+        before = self.get_remaining()
+        response = self.post_invoice([(self.items[0], 2), (self.items[1], 1), (self.items[0], 3)])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_remaining(), [before[0] - 5, before[1] - 1, before[2]])
+        invoice = Invoice.objects.latest("id")
+        self.assertEqual(InvoiceItem.objects.filter(invoice=invoice).count(), 3)
+        self.assertEqual(StockMovement.objects.filter(invoice=invoice, kind=StockMovement.SALE).count(), 3)
+
+    def test_queries_do_not_grow_with_lines(self):
+        # The first invoice also creates today's sale rows of the items.
+        self.post_invoice([(item, 1) for item in self.items])
+        with CaptureQueriesContext(connection) as one_line:
+            self.post_invoice([(self.items[0], 1)])
+        with CaptureQueriesContext(connection) as three_lines:
+            self.post_invoice([(item, 1) for item in self.items])
+        self.assertEqual(len(one_line), len(three_lines))
+
+    def test_rejects_quantities_below_one(self):
+        before = self.get_remaining()
+        invoices = Invoice.objects.count()
+        for quantity in (0, -5):
+            response = self.post_invoice([(self.items[0], 1), (self.items[1], quantity)])
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.get_remaining(), before)
+        self.assertEqual(Invoice.objects.count(), invoices)
+
+    def test_rejects_missing_items_and_empty_invoices(self):
+        invoices = Invoice.objects.count()
+        missing = Inventory.objects.order_by("-id").values_list("id", flat=True).first() + 1
+        response = self.client.post("/app/invoice", {"shop_id": self.shop.id, "invoice_item_data": [
+            {"item_id": missing, "quantity": 1}
+        ]}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"invoice_item_data": [f"Inventory item with id {missing} not found"]})
+
+        response = self.client.post("/app/invoice", {"shop_id": self.shop.id, "invoice_item_data": []},
+                                    format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Invoice.objects.count(), invoices)
+
+    def test_invoice_items_are_not_saved_directly(self):
+        invoice = Invoice.objects.create(shop=self.shop, created_by=self.user)
+        before = self.get_remaining()
+        with self.assertRaisesMessage(ValidationError, "Invoice items are posted with post_invoice_items"):
+            InvoiceItem(invoice=invoice, item=self.items[0], quantity=1, amount=1).save()
+        self.assertEqual(self.get_remaining(), before)
+        self.assertFalse(InvoiceItem.objects.filter(invoice=invoice).exists())
+
+    def test_rejects_non_numeric_item_ids(self):
+        response = self.client.post("/app/invoice", {"shop_id": self.shop.id, "invoice_item_data": [
+            {"item_id": "abc", "quantity": 1}
+        ]}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_out_of_stock_rolls_back_the_invoice(self):
+        before = self.get_remaining()
+        invoices = Invoice.objects.count()
+        response = self.post_invoice([(self.items[0], 1), (self.items[1], before[1] + 1)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(),
+                         {"invoice_item_data": [f"Not enough items in stock for {self.items[1].name}"]})
+        self.assertEqual(self.get_remaining(), before)
+        self.assertEqual(Invoice.objects.count(), invoices)
+
+
+class StockLedgerTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.shop = Shop.objects.order_by("id").first()
+        self.item_id = Inventory.objects.filter(remaining__gte=10).order_by("id").values_list("id", flat=True)[0]
+
+    def sell(self, quantity):
+        response = self.client.post("/app/invoice", {"shop_id": self.shop.id, "invoice_item_data": [
+            {"item_id": self.item_id, "quantity": quantity}
+        ]}, format="json")
+        self.assertEqual(response.status_code, 201)
+
+    def assert_reconciled(self):
+        self.assertEqual(list(reconcile_stock()), [])
+        self.assertEqual(list(reconcile_group_counters()), [])
+
+    def test_saving_a_stale_item_keeps_sales_made_since(self):
+        item = Inventory.objects.get(id=self.item_id)
+        remaining = item.remaining
+        self.sell(2)
+
+        item.price += 1
+        item.save()
+        self.assertEqual(Inventory.objects.get(id=self.item_id).remaining, remaining - 2)
+        self.assertEqual(item.remaining, remaining - 2)
+        self.assert_reconciled()
+
+        item = Inventory.objects.get(id=self.item_id)
+        self.sell(1)
+        item.remaining += 5
+        item.save()
+        self.assertEqual(Inventory.objects.get(id=self.item_id).remaining, remaining - 3 + 5)
+        self.assertEqual(StockMovement.objects.filter(item_id=self.item_id).latest("id").quantity, 5)
+        self.assert_reconciled()
+
+    def test_movements_reject_bad_input(self):
+        item = Inventory.objects.get(id=self.item_id)
+        for data in ({"item_id": item.id, "kind": StockMovement.SALE, "quantity": 1},
+                     {"item_id": item.id, "kind": StockMovement.RECEIPT, "quantity": 0},
+                     {"item_id": item.id, "kind": StockMovement.ADJUSTMENT, "quantity": -item.remaining - 1}):
+            with self.subTest(data=data):
+                response = self.client.post("/app/stock-movement", data, format="json")
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(Inventory.objects.get(id=item.id).remaining, item.remaining)
+
+    def test_rejects_bad_as_of(self):
+        response = self.client.get("/app/stock-level", {"as_of": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"as_of": ["as_of must be a date or a datetime"]})
+        self.assertEqual(self.client.get("/app/stock-level", {"as_of": "2020-01-01"}).status_code, 200)
+
+
+class InventoryCreateTests(APITestCase):
+
+    def get_inserts(self, captured, table):
+        return [query for query in captured if query["sql"].startswith(f'INSERT INTO "{table}"')]
+
+    def test_create_is_one_insert_and_one_activity(self):
+        group = InventoryGroup.objects.order_by("id").first()
+        activities = UserActivities.objects.count()
+
+        with CaptureQueriesContext(connection) as captured, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/app/inventory", {
+                "group_id": group.id, "name": "Test Lamp", "total": 10, "price": 2.5
+            }, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.get_inserts(captured, "app_control_inventory")), 1)
+        self.assertEqual(len(self.get_inserts(captured, "user_control_useractivities")), 1)
+        self.assertEqual(UserActivities.objects.count(), activities + 1)
+        self.assertEqual(UserActivities.objects.latest("id").action,
+                         f"Created Inventory: Test Lamp with code {response.data['code']}")
+
+        item = Inventory.objects.get(id=response.data["id"])
+        self.assertEqual(item.code, f"INV{item.id:06d}")
+        self.assertEqual(item.remaining, 10)
+
+    def test_csv_import_is_one_insert_per_chunk(self):
+        group_ids = list(InventoryGroup.objects.order_by("id").values_list("id", flat=True)[:3])
+        rows = "".join(f"{group_ids[row % 3]},Imported {row},{row + 1},{row + 0.5}\n" for row in range(25))
+        activities = UserActivities.objects.count()
+
+        with mock.patch.object(InventoryCSVLoaderView, "chunk_size", 10), \
+                CaptureQueriesContext(connection) as captured, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/app/inventory-csv", {"data": io.BytesIO(rows.encode())},
+                                        format="multipart")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["created"], 25)
+        self.assertEqual(len(self.get_inserts(captured, "app_control_inventory")), 3)
+        self.assertEqual(UserActivities.objects.count(), activities + 1)
+        codes = Inventory.objects.filter(name__startswith="Imported ").values_list("id", "code")
+        self.assertEqual(len(codes), 25)
+        for item_id, code in codes:
+            self.assertEqual(code, f"INV{item_id:06d}")
+
+
+class FilterTests(APITestCase):
+    list_paths = ("/app/inventory", "/app/group", "/app/shop", "/app/invoice", "/app/stock-movement",
+                  "/app/stock-level")
+
+    def test_allowed_filters(self):
+        group_id = Inventory.objects.order_by("id").values_list("group_id", flat=True).first()
+        response = self.client.get("/app/inventory", {"group_id": group_id, "fields": "id"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({item["id"] for item in response.data["results"]},
+                         set(Inventory.objects.filter(group_id=group_id).values_list("id", flat=True)))
+
+        ids = list(Inventory.objects.order_by("id").values_list("id", flat=True)[:3])
+        response = self.client.get("/app/inventory", {"id__in": ",".join(map(str, ids))})
+        self.assertEqual(sorted(item["id"] for item in response.data["results"]), ids)
+
+        response = self.client.get("/app/inventory", {"remaining__lte": 100, "name__icontains": "a"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], Inventory.objects.filter(
+            remaining__lte=100, name__icontains="a"
+        ).count())
+
+    def test_rejects_lookups_outside_the_whitelist(self):
+        for path in self.list_paths:
+            for param in ("created_by__password__startswith", "colour", "name__regex", "id__in__x", "__"):
+                response = self.client.get(path, {param: "pbkdf2"})
+                self.assertEqual(response.status_code, 400, f"{path}?{param}")
+                self.assertIn(param, response.data)
+
+    def test_rejects_values_of_the_wrong_type(self):
+        for params in ({"id": "abc"}, {"created_at__gte": "yesterday"}, {"remaining__lt": "many"}):
+            response = self.client.get("/app/inventory", params)
+            self.assertEqual(response.status_code, 400, params)
+
+
+class PaginationTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Seven items share every created_at, so ties straddle the pages.
+        start = timezone.now() - timedelta(days=1)
+        for index, item in enumerate(Inventory.objects.order_by("id")):
+            Inventory.objects.filter(id=item.id).update(created_at=start + timedelta(seconds=index // 7))
+
+    def test_cursor_pages_have_no_duplicates_or_gaps(self):
+        ids = []
+        url = "/app/inventory?pagination=cursor&fields=id"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [item["id"] for item in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(ids, list(Inventory.objects.order_by("-created_at", "-id").values_list("id", flat=True)))
+
+    def test_rejects_invalid_cursors(self):
+        for cursor in ("abc", "bm90IGEgY3Vyc29y"):
+            response = self.client.get("/app/inventory", {"cursor": cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertEqual(response.json(), {"cursor": ["Invalid cursor"]})
+
+    def test_created_at_filters_on_the_exact_moment(self):
+        item = Inventory.objects.order_by("id").first()
+        response = self.client.get("/app/inventory", {"created_at": item.created_at.isoformat(), "fields": "id"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(result["id"] for result in response.data["results"]),
+                         list(Inventory.objects.filter(created_at=item.created_at).order_by("id")
+                              .values_list("id", flat=True)))
+
+
+class SearchTests(APITestCase):
+
+    def get_updates(self, captured, table):
+        return [query for query in captured if query["sql"].startswith(f'UPDATE "{table}"')]
+
+    def assert_documents_current(self, queryset):
+        for obj in queryset.select_related(*{path.rpartition("__")[0] for path in queryset.model.search_fields} - {""}):
+            self.assertEqual(obj.search_document, obj.get_search_document())
+
+    def test_keyword_matches_code_name_group_and_user(self):
+        item = Inventory.objects.select_related("group", "created_by").order_by("id").first()
+        for keyword in (item.code, item.name, item.group.name, item.created_by.email):
+            response = self.client.get("/app/inventory", {"keyword": keyword, "fields": "id"})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(item.id, [result["id"] for result in response.data["results"]], keyword)
+
+    def test_database_documents_match_python_documents(self):
+        # Rows without a group or creator leave their parts out.
+        Inventory.objects.filter(id__in=Inventory.objects.order_by("id").values("id")[:5]).update(group=None)
+        Invoice.objects.filter(id__in=Invoice.objects.order_by("id").values("id")[:5]).update(created_by=None)
+        for model in (Inventory, Shop, Invoice):
+            refresh_search_documents(model.objects.all())
+            self.assert_documents_current(model.objects.all())
+
+    def test_group_rename_is_one_update(self):
+        group = InventoryGroup.objects.annotate(items=Count("inventories")).filter(items__gt=1).first()
+        group.name = "Renamed Group"
+        with CaptureQueriesContext(connection) as captured:
+            group.save()
+
+        self.assertEqual(len(self.get_updates(captured, "app_control_inventory")), 1)
+        self.assert_documents_current(group.inventories.all())
+        self.assertTrue(all("renamed group" in document for document in
+                            group.inventories.values_list("search_document", flat=True)))
+
+    def test_shop_and_user_renames_refresh_their_documents(self):
+        shop = Shop.objects.annotate(invoices=Count("sale_shop")).filter(invoices__gt=1).first()
+        shop.name = "Renamed Shop"
+        shop.save()
+        self.assert_documents_current(shop.sale_shop.all())
+
+        self.user.fullname = "Renamed User"
+        with CaptureQueriesContext(connection) as captured:
+            self.user.save()
+        for table in ("app_control_inventory", "app_control_shop", "app_control_invoice"):
+            self.assertEqual(len(self.get_updates(captured, table)), 1, table)
+        for queryset in (self.user.inventory_items.all(), self.user.shops.all(), self.user.invoices.all()):
+            self.assert_documents_current(queryset)
+        self.assertTrue(self.user.invoices.filter(search_document__contains="renamed user").exists())
+
+    def test_bulk_renames_refresh_dependent_documents(self):
+        group = InventoryGroup.objects.annotate(items=Count("inventories")).filter(items__gt=1).first()
+        shop = Shop.objects.annotate(invoices=Count("sale_shop")).filter(invoices__gt=1).first()
+        searches = (("/app/inventory", "Bulk Renamed Group"), ("/app/invoice", "Bulk Renamed Shop"))
+        # Searched once before, so a stale cached answer would show.
+        for path, keyword in searches:
+            self.assertEqual(self.client.get(path, {"keyword": keyword}).data["count"], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for path, data in (("/app/group/bulk", {"id": group.id, "name": "Bulk Renamed Group"}),
+                               ("/app/shop/bulk", {"id": shop.id, "name": "Bulk Renamed Shop"})):
+                response = self.client.patch(path, [data], format="json")
+                self.assertEqual(response.data["results"][0]["status"], "updated", path)
+
+        for (path, keyword), expected in zip(searches, (group.inventories.all(), shop.sale_shop.all())):
+            response = self.client.get(path, {"keyword": keyword, "fields": "id"})
+            self.assertEqual(sorted(result["id"] for result in response.data["results"]),
+                             sorted(expected.values_list("id", flat=True)), path)
+            self.assert_documents_current(expected)
+
+    def test_deletes_drop_the_name_from_dependent_documents(self):
+        groups = list(InventoryGroup.objects.annotate(items=Count("inventories")).filter(items__gt=0)[:2])
+        shops = list(Shop.objects.annotate(invoices=Count("sale_shop")).filter(invoices__gt=0)[:2])
+        user = CustomUser.objects.filter(inventory_items__isnull=False).exclude(id=self.user.id).first()
+        items = list(Inventory.objects.filter(Q(group__in=groups) | Q(created_by=user)).values_list("id", flat=True))
+        invoices = list(Invoice.objects.filter(shop__in=shops).values_list("id", flat=True))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            groups[0].delete()
+            shops[0].delete()
+            for path, obj in (("/app/group/bulk", groups[1]), ("/app/shop/bulk", shops[1])):
+                response = self.client.delete(path, [{"id": obj.id}], format="json")
+                self.assertEqual(response.data["results"][0]["status"], "deleted", path)
+        # After the activities of the deletes above were written for it.
+        user.delete()
+
+        names = [group.name for group in groups] + [user.email]
+        for model, ids, names in ((Inventory, items, names), (Invoice, invoices, [shop.name for shop in shops])):
+            queryset = model.objects.filter(id__in=ids)
+            self.assert_documents_current(queryset)
+            for name in names:
+                self.assertFalse(queryset.filter(search_document__contains=name.lower()).exists(), name)
+
+
+class DailySaleTests(APITestCase):
+    # Every analytics answer read from the rollups must equal the same
+    # aggregation over the raw invoice items, including invoices posted
+    # after the rollups were rebuilt.
+
+    def setUp(self):
+        super().setUp()
+        shops = list(Shop.objects.order_by("id")[:2])
+        items = list(Inventory.objects.filter(remaining__gte=10).order_by("id")[:4])
+        for number in range(6):
+            response = self.client.post("/app/invoice", {"shop_id": shops[number % 2].id, "invoice_item_data": [
+                {"item_id": item.id, "quantity": number % 3 + 1} for item in items[number % 2:number % 2 + 3]
+            ]}, format="json")
+            self.assertEqual(response.status_code, 201)
+
+    def get_raw_lines(self, start_date=None):
+        lines = InvoiceItem.objects.all()
+        if start_date:
+            lines = lines.filter(created_at__date__gte=start_date)
+        return lines
+
+    def test_top_selling_matches_invoice_items(self):
+        start_date = (timezone.localdate() - timedelta(days=30)).isoformat()
+        for params, lines in (({}, self.get_raw_lines()), ({"start_date": start_date}, self.get_raw_lines(start_date))):
+            raw = dict(lines.values("item_id").annotate(total=Sum("quantity")).values_list("item_id", "total"))
+            response = self.client.get("/app/top-selling", params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data), min(10, len(raw)))
+            for item in response.data:
+                self.assertEqual(item["sum_of_item"], raw[item["id"]])
+            self.assertEqual(response.data[0]["sum_of_item"], max(raw.values()))
+
+    def test_sales_by_shop_match_invoice_items(self):
+        raw = dict(self.get_raw_lines().values("invoice__shop_id").annotate(total=Sum("amount"))
+                   .values_list("invoice__shop_id", "total"))
+        response = self.client.get("/app/sale-by-shop")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({shop["id"] for shop in response.data}, set(raw))
+        for shop in response.data:
+            self.assertAlmostEqual(shop["amount_total"], raw[shop["id"]], places=4)
+
+        raw = {
+            (row["invoice__shop_id"], row["month"].date().isoformat()): row["total"]
+            for row in self.get_raw_lines().annotate(month=TruncMonth("created_at"))
+            .values("invoice__shop_id", "month").annotate(total=Sum("amount"))
+        }
+        response = self.client.get("/app/sale-by-shop", {"monthly": "true"})
+        self.assertEqual(len(response.data), len(raw))
+        for shop in response.data:
+            self.assertAlmostEqual(shop["amount_total"], raw[shop["id"], shop["month"][:10]], places=4)
+
+    def test_purchase_summary_matches_invoice_items(self):
+        raw = self.get_raw_lines().aggregate(amount=Sum("amount"), quantity=Sum("quantity"))
+        response = self.client.get("/app/purchase-summary")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], raw["quantity"])
+        self.assertAlmostEqual(response.data["price"], raw["amount"], places=4)
+
+    def get_rollups(self):
+        return {
+            (sale.item_id, sale.shop_id, sale.day): (sale.quantity, round(sale.amount, 4))
+            for sale in DailySale.objects.all()
+        }
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        incremental = self.get_rollups()
+        rebuild_daily_sales()
+        self.assertEqual(incremental, self.get_rollups())
+
+    def test_rollups_agree_across_midnight(self):
+        # The invoice is posted a moment before local midnight and its lines
+        # are stamped after it.
+        with timezone.override("America/New_York"):
+            rebuild_daily_sales()
+            midnight = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+            invoice = Invoice.objects.create(shop=Shop.objects.order_by("id").first(), created_by=self.user)
+            Invoice.objects.filter(id=invoice.id).update(created_at=midnight - timedelta(milliseconds=1))
+            invoice.refresh_from_db()
+            item = Inventory.objects.filter(remaining__gte=10).order_by("id").first()
+            post_invoice_items(invoice, [{"item_id": item.id, "quantity": 1}])
+
+            incremental = self.get_rollups()
+            self.assertIn((item.id, invoice.shop_id, midnight.date() - timedelta(days=1)), incremental)
+            rebuild_daily_sales()
+            self.assertEqual(incremental, self.get_rollups())
+
+
+class GroupAncestorTests(APITestCase):
+    depths = (2, 4, 10)
+
+    def make_chain(self, depth):
+        # Nested groups depth deep with an item in the deepest one.
+        group = None
+        for level in range(depth):
+            group = InventoryGroup.objects.create(name=f"Depth {depth} level {level}", belongs_to=group,
+                                                  created_by=self.user)
+        item = Inventory.objects.create(group=group, name=f"Depth {depth} item", total=5, remaining=5, price=1,
+                                        created_by=self.user)
+        return group, item
+
+    def count_queries(self, path, params=None):
+        self.client.get(path, params)
+        cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(captured)
+
+    def get_depth(self, group):
+        depth = 0
+        while group is not None:
+            depth += 1
+            group = group["belongs_to"]
+        return depth
+
+    def assert_same_queries_at_every_depth(self, request):
+        # request(group, item) returns the response and the deepest group in it.
+        counts = {}
+        for depth in self.depths:
+            group, item = self.make_chain(depth)
+            (response, counts[depth]), rendered = request(group, item)
+            self.assertEqual(self.get_depth(rendered(response.data)), depth)
+        self.assertEqual(len(set(counts.values())), 1, counts)
+
+    def test_inventory_retrieve(self):
+        self.assert_same_queries_at_every_depth(lambda group, item: (
+            self.count_queries(f"/app/inventory/{item.id}"), lambda data: data["group"]
+        ))
+
+    def test_group_retrieve(self):
+        self.assert_same_queries_at_every_depth(lambda group, item: (
+            self.count_queries(f"/app/group/{group.id}"), lambda data: data
+        ))
+
+    def test_inventory_list(self):
+        self.assert_same_queries_at_every_depth(lambda group, item: (
+            self.count_queries("/app/inventory", {"group_id": group.id}),
+            lambda data: data["results"][0]["group"]
+        ))
+
+    def test_group_list(self):
+        self.assert_same_queries_at_every_depth(lambda group, item: (
+            self.count_queries("/app/group", {"id": group.id}), lambda data: data["results"][0]
+        ))
+
+    def test_rejects_moving_a_group_below_itself(self):
+        group, _ = self.make_chain(3)
+        top = group.belongs_to.belongs_to
+        for parent in (top, group):
+            response = self.client.patch(f"/app/group/{top.id}", {"belongs_to_id": parent.id}, format="json")
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("belongs_to_id", response.json())
+        top.refresh_from_db()
+        self.assertIsNone(top.belongs_to_id)
+
+    def test_tree_subtree_counts_match_the_items(self):
+        # Two chains under one root, one of them later moved below the
+        # other, checked against counts walked up belongs_to by hand.
+        root = InventoryGroup.objects.create(name="Tree root", created_by=self.user)
+        chains = [self.make_chain(depth) for depth in (3, 4)]
+        for group, _ in chains:
+            while group.belongs_to is not None:
+                group = group.belongs_to
+            group.belongs_to = root
+            group.save()
+        Inventory.objects.create(group=root, name="Tree root item", total=1, remaining=1, created_by=self.user)
+
+        def walk(nodes):
+            for node in nodes:
+                yield node
+                yield from walk(node["children"])
+
+        for moved in (False, True):
+            if moved:
+                top = InventoryGroup.objects.get(belongs_to=root, name="Depth 3 level 0")
+                top.belongs_to = chains[1][0]
+                top.save()
+            cache.clear()
+            response = self.client.get("/app/group-tree")
+            self.assertEqual(response.status_code, 200)
+            nodes = {node["id"]: node for node in walk(response.data)}
+            self.assertEqual(len(nodes), InventoryGroup.objects.count())
+
+            parents = dict(InventoryGroup.objects.values_list("id", "belongs_to_id"))
+            counts = dict(Inventory.objects.filter(group__isnull=False).values("group_id")
+                          .annotate(count=Count("id")).values_list("group_id", "count"))
+            subtree_counts = dict.fromkeys(parents, 0)
+            for group_id, count in counts.items():
+                while group_id is not None:
+                    subtree_counts[group_id] += count
+                    group_id = parents[group_id]
+
+            for group_id, node in nodes.items():
+                self.assertEqual(node["item_count"], counts.get(group_id, 0), node["name"])
+                self.assertEqual(node["subtree_item_count"], subtree_counts[group_id], node["name"])
+            self.assertEqual(nodes[root.id]["subtree_item_count"], 3)
+            self.assertEqual(nodes[chains[1][0].id]["subtree_item_count"], 2 if moved else 1)
+
+
+def make_image(format="PNG", size=(300, 200)):
+    from PIL import Image
+    output = io.BytesIO()
+    Image.new("RGB", size, "teal").save(output, format=format)
+    return output.getvalue()
+
+
+class PhotoTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        storage = mock.patch("app_control.photos.photo_storage", FileSystemStorage(location=directory.name))
+        storage.start()
+        self.addCleanup(storage.stop)
+        self.image = make_image()
+        self.encoded = base64.b64encode(self.image).decode()
+
+    def create_item(self, photo):
+        group = InventoryGroup.objects.order_by("id").first()
+        response = self.client.post("/app/inventory", {
+            "group_id": group.id, "name": f"Photo item {Inventory.objects.count()}", "total": 1, "price": 1,
+            "photo": photo
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        return Inventory.objects.get(id=response.data["id"]), response
+
+    def test_only_images_decode(self):
+        for format in ("PNG", "JPEG", "GIF", "WEBP"):
+            content = make_image(format)
+            encoded = base64.b64encode(content).decode()
+            self.assertEqual(decode_photo(encoded), content, format)
+            self.assertEqual(decode_photo(f"data:image/{format.lower()};base64,{encoded}"), content, format)
+        truncated_png = base64.b64encode(self.image[:64]).decode()
+        for value in ("test", "none", "abcd1234", "https://example.com/lamp.png", truncated_png, "", None):
+            self.assertIsNone(decode_photo(value), value)
+
+    def test_image_is_stored_and_served(self):
+        item, response = self.create_item(f"data:image/png;base64,{self.encoded}")
+        self.assertIsNone(item.photo)
+        self.assertEqual(response.data["photo"], f"/app/photo/{item.photo_hash}")
+
+        self.client.credentials()
+        response = self.client.get(f"/app/photo/{item.photo_hash}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(b"".join(response.streaming_content), self.image)
+
+        response = self.client.get(f"/app/photo/{item.photo_hash}", HTTP_RANGE="bytes=0-7")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, self.image[:8])
+        response = self.client.get(f"/app/photo/{item.photo_hash}", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+        # RGB images get JPEG thumbnails.
+        response = self.client.get(f"/app/photo/{item.photo_hash}", {"thumbnail": "true"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+
+    def test_text_stays_inline(self):
+        for value in ("test", "none", "abcd1234"):
+            item, response = self.create_item(value)
+            self.assertEqual((item.photo, item.photo_hash), (value, None))
+            self.assertEqual(response.data["photo"], value)
+
+    def test_migration_round_trip(self):
+        migration = importlib.import_module("app_control.migrations.0011_inventory_photo_hash")
+        schema_editor = SimpleNamespace(connection=connection)
+        group = InventoryGroup.objects.order_by("id").first()
+        values = ["test", "abcd1234", f"data:image/png;base64,{self.encoded}"]
+        items = Inventory.objects.bulk_create([
+            Inventory(group=group, name=f"Inline {number}", total=1, remaining=1, price=1, photo=value)
+            for number, value in enumerate(values)
+        ])
+        inline = Inventory.objects.filter(id__in=[item.id for item in items]).order_by("id")
+
+        migration.externalize_photos(apps, schema_editor)
+        self.assertEqual([(photo, bool(photo_hash)) for photo, photo_hash in inline.values_list("photo", "photo_hash")],
+                         [("test", False), ("abcd1234", False), (None, True)])
+
+        migration.inline_photos(apps, schema_editor)
+        self.assertEqual(list(inline.values_list("photo", "photo_hash")), [(value, None) for value in values])
+
+
+class BulkTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.group = InventoryGroup.objects.order_by("id").first()
+        self.items = list(Inventory.objects.order_by("id")[:2])
+
+    def bulk(self, method, items):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)("/app/inventory/bulk", items, format="json")
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_create_reports_bad_relations_per_item(self):
+        data = self.bulk("post", [
+            {"group_id": self.group.id, "name": "Bulk good", "total": 3, "price": 1},
+            {"group_id": 999999, "name": "Bulk missing group", "total": 3, "price": 1},
+            {"group_id": "abc", "name": "Bulk bad group", "total": 3, "price": 1},
+            {"name": "Bulk no group", "total": 3, "price": 1},
+        ])
+
+        self.assertEqual(data["count"], 1)
+        self.assertEqual([result["status"] for result in data["results"]], ["created", "error", "error", "error"])
+        self.assertEqual(data["results"][1]["errors"], {"group_id": ["Not found"]})
+        self.assertEqual(data["results"][2]["errors"], {"group_id": ["Not found"]})
+        self.assertIn("group_id", data["results"][3]["errors"])
+        self.assertEqual(Inventory.objects.get(id=data["results"][0]["id"]).group_id, self.group.id)
+
+    def test_create_queries_do_not_grow_with_the_batch(self):
+        group_ids = list(InventoryGroup.objects.order_by("id").values_list("id", flat=True))
+
+        def count(size):
+            with CaptureQueriesContext(connection) as captured:
+                self.bulk("post", [
+                    {"group_id": group_ids[number % len(group_ids)], "name": f"Bulk {size}-{number}", "total": 1,
+                     "price": 1}
+                    for number in range(size)
+                ])
+            return len(captured)
+
+        count(1)
+        self.assertEqual(count(2), count(20))
+
+    def test_update_writes_only_the_fields_sent(self):
+        named, restocked = self.items
+        # Another request changes both rows between the read and the write.
+        original = Inventory.objects.bulk_update
+
+        def concurrent_bulk_update(*args, **kwargs):
+            if not Inventory.objects.filter(price=99).exists():
+                Inventory.objects.filter(id=named.id).update(price=99)
+                Inventory.objects.filter(id=restocked.id).update(remaining=F("remaining") - 2)
+            return original(*args, **kwargs)
+
+        with mock.patch.object(Inventory.objects, "bulk_update", side_effect=concurrent_bulk_update):
+            data = self.bulk("patch", [
+                {"id": named.id, "name": "Renamed by bulk"},
+                {"id": restocked.id, "remaining": restocked.remaining + 5},
+            ])
+
+        self.assertEqual([result["status"] for result in data["results"]], ["updated", "updated"])
+        named.refresh_from_db()
+        self.assertEqual((named.name, named.price), ("Renamed by bulk", 99))
+        self.assertEqual(Inventory.objects.get(id=restocked.id).remaining, restocked.remaining + 3)
+
+    def test_rejects_a_body_that_is_not_a_list(self):
+        response = self.client.post("/app/inventory/bulk", {"name": "Not a list"}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"non_field_errors": ["You need to send a list of items"]})
+
+    def test_update_records_the_stock_change(self):
+        item = self.items[0]
+        data = self.bulk("patch", [{"id": item.id, "remaining": item.remaining + 7}, {"id": 999999, "name": "x"}])
+
+        self.assertEqual([result["status"] for result in data["results"]], ["updated", "error"])
+        self.assertEqual(StockMovement.objects.filter(item=item).latest("id").quantity, 7)
+        self.assertEqual(list(reconcile_stock(Inventory.objects.filter(id=item.id))), [])
+
+
+class GroupCounterTests(APITestCase):
+    # Every inventory write keeps the item counters of the groups in step
+    # with their items, so reconciling them finds nothing to fix.
+
+    def setUp(self):
+        super().setUp()
+        self.groups = list(InventoryGroup.objects.order_by("id")[:2])
+        self.shop = Shop.objects.order_by("id").first()
+
+    def assert_counters_match(self):
+        self.assertEqual(list(reconcile_group_counters()), [])
+
+    def get_counters(self, group):
+        return InventoryGroup.objects.values_list("item_count", "in_stock_count", "stock_value").get(id=group.id)
+
+    def test_generated_dataset_matches(self):
+        self.assert_counters_match()
+
+    def test_inventory_save_and_delete(self):
+        group, other = self.groups
+        before = self.get_counters(group)
+        item = Inventory(group=group, name="Counted lamp", total=4, price=2.5, created_by=self.user)
+        item.save()
+        self.assertEqual(self.get_counters(group), (before[0] + 1, before[1] + 1, before[2] + 10))
+        self.assert_counters_match()
+
+        item.group = other
+        item.save()
+        self.assertEqual(self.get_counters(group), before)
+        self.assert_counters_match()
+
+        item.price = 4
+        item.save()
+        self.assert_counters_match()
+
+        item.remaining = 0
+        item.save()
+        self.assert_counters_match()
+
+        item.delete()
+        self.assert_counters_match()
+
+    def test_bulk_writes(self):
+        group, other = self.groups
+        response = self.client.post("/app/inventory/bulk", [
+            {"group_id": group.id if number % 2 else other.id, "name": f"Bulk counted {number}", "total": number,
+             "price": 1.5} for number in range(6)
+        ], format="json")
+        self.assertEqual(response.data["count"], 6)
+        self.assert_counters_match()
+
+        ids = [result["id"] for result in response.data["results"]]
+        response = self.client.patch("/app/inventory/bulk", [
+            {"id": ids[0], "remaining": 3}, {"id": ids[1], "price": 9}, {"id": ids[2], "remaining": 0, "price": 2}
+        ], format="json")
+        self.assertEqual(response.data["count"], 3)
+        self.assert_counters_match()
+
+        response = self.client.delete("/app/inventory/bulk", ids[3:], format="json")
+        self.assertEqual(response.data["count"], 3)
+        self.assert_counters_match()
+
+    def test_csv_load(self):
+        rows = "".join(f"{self.groups[row % 2].id},Loaded {row},{row},{row + 0.5}\n" for row in range(12))
+        response = self.client.post("/app/inventory-csv", {"data": io.BytesIO(rows.encode())}, format="multipart")
+        self.assertEqual(response.data["created"], 12)
+        self.assert_counters_match()
+
+    def test_stock_writes(self):
+        items = list(Inventory.objects.filter(group__isnull=False, remaining__gte=3).order_by("id")[:3])
+        post_invoice_items(Invoice.objects.create(shop=self.shop, created_by=self.user), [
+            {"item_id": items[0].id, "quantity": items[0].remaining}, {"item_id": items[1].id, "quantity": 1}
+        ])
+        self.assert_counters_match()
+
+        record_stock_movement(items[0].id, StockMovement.RECEIPT, 5, self.user)
+        record_stock_movement(items[1].id, StockMovement.ADJUSTMENT, -1, self.user)
+        record_stock_movement(items[2].id, StockMovement.RETURN, 2, self.user)
+        self.assert_counters_match()
+
+    def test_rebuild_remaining(self):
+        # A movement missing from remaining, as if written by hand.
+        item = Inventory.objects.filter(group__isnull=False, remaining__gte=3).order_by("id").first()
+        StockMovement.objects.create(item=item, kind=StockMovement.ADJUSTMENT, quantity=-item.remaining)
+        self.assertEqual(rebuild_remaining(), 1)
+        self.assertEqual(Inventory.objects.get(id=item.id).remaining, 0)
+        self.assert_counters_match()
+
+    def test_reconcile_command_fixes_drift(self):
+        group, other = self.groups
+        InventoryGroup.objects.filter(id=group.id).update(item_count=F("item_count") + 2)
+        InventoryGroup.objects.filter(id=other.id).update(stock_value=F("stock_value") - 10)
+
+        output = io.StringIO()
+        call_command("reconcile_group_counters", stdout=output)
+        self.assertIn("2 groups differ from their items", output.getvalue())
+        self.assertEqual([row[0] for row in reconcile_group_counters()], sorted([group.id, other.id]))
+
+        output = io.StringIO()
+        call_command("reconcile_group_counters", "--fix", stdout=output)
+        self.assertIn("Rebuilt the counters of 2 groups", output.getvalue())
+        self.assert_counters_match()
+
+
+class DashboardTests(APITestCase):
+    # The dashboard answers what the four endpoints it replaces answer, in
+    # three statements whatever the data, without the response cache.
+    latency_ceiling_ms = 100
+
+    def setUp(self):
+        super().setUp()
+        config = mock.patch.dict(caching._config, {"ENABLED": False})
+        config.start()
+        self.addCleanup(config.stop)
+        # Warms up the cached user, so only the dashboard queries are counted.
+        self.client.get("/app/summary")
+
+    def get_selects(self, params):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get("/app/dashboard", params)
+        self.assertEqual(response.status_code, 200)
+        return [query["sql"] for query in captured if query["sql"].startswith("SELECT")]
+
+    def test_matches_the_separate_endpoints(self):
+        start_date = (timezone.localdate() - timedelta(days=30)).isoformat()
+        for params in ({}, {"start_date": start_date}, {"monthly": "true"}):
+            data = self.client.get("/app/dashboard", params).json()
+            self.assertEqual(data["summary"], self.client.get("/app/summary", params).json())
+            self.assertEqual(data["purchase"], self.client.get("/app/purchase-summary", params).json())
+            self.assertEqual([(sale["id"], sale["sum_of_item"]) for sale in data["top_selling"]], [
+                (sale["id"], sale["sum_of_item"]) for sale in self.client.get("/app/top-selling", params).json()
+            ])
+            self.assertEqual(
+                [(sale["id"], sale["amount_total"], sale.get("month")) for sale in data["sale_by_shop"]],
+                [(sale["id"], sale["amount_total"], sale.get("month"))
+                 for sale in self.client.get("/app/sale-by-shop", params).json()]
+            )
+
+    def test_three_statements_whatever_the_data(self):
+        for params in ({}, {"start_date": "2020-01-01", "monthly": "true"}):
+            self.assertEqual(len(self.get_selects(params)), 3, params)
+
+        generate_dataset(seed=2, users=2, groups=5, items=50, shops=5, invoices=100, activities=0)
+        self.assertEqual(len(self.get_selects({})), 3)
+
+    # Wall clock bound, so it is left out of --exclude-tag slow runs; the
+    # statement count above is what guards the dashboard everywhere.
+    @tag("slow")
+    def test_latency(self):
+        latencies = []
+        for _ in range(21):
+            started = time.perf_counter()
+            self.client.get("/app/dashboard")
+            latencies.append((time.perf_counter() - started) * 1000)
+        self.assertLess(statistics.median(latencies), self.latency_ceiling_ms)
+
+    def test_cached_response_runs_no_query(self):
+        with mock.patch.dict(caching._config, {"ENABLED": True}):
+            self.client.get("/app/dashboard")
+            with self.assertNumQueries(0):
+                response = self.client.get("/app/dashboard")
+        self.assertEqual(response["X-Cache"], "HIT")
+
+
+class ProjectionParityTests(APITestCase):
+    # The projection list path must render byte for byte what the
+    # serializers and JSONRenderer render for the same request. Every list
+    # has a second page.
+    dataset = dict(APITestCase.dataset, shops=30, invoices=30)
+    views = {"inventory": InventoryView, "shop": ShopView, "invoice": InvoiceView}
+
+    def get_paths(self):
+        item = Inventory.objects.order_by("id").first()
+        return {
+            "inventory": ("", "?page=2", "?pagination=cursor", f"?keyword={item.name.split()[0]}",
+                          f"?group_id={item.group_id}", "?fields=id,name,remaining", "?fields=id,group",
+                          "?expand=group", "?expand=group.user", "?fields=id,photo,photo_thumbnail&pagination=cursor",
+                          "?fields=id,group&expand=group.belongs_to"),
+            "shop": ("", "?page=2", "?pagination=cursor", "?keyword=store", "?fields=id,name", "?expand=created_by"),
+            "invoice": ("", "?page=2", "?pagination=cursor", "?keyword=store", "?fields=id,created_at",
+                        "?fields=id,invoice_items", "?expand=shop,invoice_items",
+                        "?fields=id,shop&expand=shop.created_by"),
+        }
+
+    def test_projection_matches_serializer(self):
+        for name, queries in self.get_paths().items():
+            for query in queries:
+                path = f"/app/{name}{query}"
+                with self.subTest(path=path):
+                    projected = self.client.get(path)
+                    with mock.patch.object(self.views[name], "projection_class", None), \
+                            mock.patch.object(self.views[name], "renderer_classes", (JSONRenderer,)):
+                        serialized = self.client.get(path)
+                    self.assertEqual(projected.status_code, 200)
+                    self.assertEqual(serialized.status_code, 200)
+                    self.assertEqual(projected.content, serialized.content)
+
+
+class FieldsetTests(APITestCase):
+    # A minimal ?fields= selection reads fewer tables and returns a smaller
+    # page than the full representation. Queries are counted without the
+    # response cache, once the user is cached, as (full, minimal).
+    selections = {
+        "/app/inventory": ("id,name,remaining", 6, 2),
+        "/app/invoice": ("id,created_at", 7, 2),
+        "/app/shop": ("id,name", 5, 2),
+        "/app/stock-movement": ("id,item_id,quantity", 3, 1),
+        "/user/activities-log": ("id,action", 1, 1),
+    }
+
+    def setUp(self):
+        super().setUp()
+        config = mock.patch.dict(caching._config, {"ENABLED": False})
+        config.start()
+        self.addCleanup(config.stop)
+        self.client.get("/app/summary")
+
+    def get(self, path, **params):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return len(captured), len(response.content), response.json()["results"]
+
+    def test_minimal_fields_cut_queries_and_payload(self):
+        for path, (fields, full_count, minimal_count) in self.selections.items():
+            with self.subTest(path=path):
+                full_queries, full_bytes, full_rows = self.get(path)
+                queries, size, rows = self.get(path, fields=fields)
+                self.assertEqual((full_queries, queries), (full_count, minimal_count))
+                self.assertEqual([set(row) for row in rows], [set(fields.split(","))] * len(full_rows))
+                self.assertLess(size, full_bytes / 2)
+
+
+class ConditionalGetTests(APITestCase):
+    # 304 Not Modified to a current ETag or Last-Modified, a full response
+    # after any write to the models a list shows. caching reads a fake
+    # clock, so a write can be a second old without waiting for it.
+    writes = {
+        "/app/inventory": [
+            ("create", "post", "/app/inventory", lambda test: {"group_id": test.group.id, "name": "Conditional item",
+                                                               "total": 5}),
+            ("update", "patch", "/app/inventory/{id}", lambda test: {"price": 12.5}),
+            ("sale", "post", "/app/invoice", lambda test: {"shop_id": test.shop.id, "invoice_item_data": [
+                {"item_id": test.item.id, "quantity": 1}
+            ]}),
+            ("delete", "delete", "/app/inventory/{id}", None),
+        ],
+        "/app/group": [
+            ("create", "post", "/app/group", lambda test: {"name": "Conditional group"}),
+            ("update", "patch", "/app/group/{id}", lambda test: {"name": "Conditional group renamed"}),
+            ("item created in it", "post", "/app/inventory", lambda test: {"group_id": test.group.id,
+                                                                           "name": "Counted item", "total": 3}),
+            ("delete", "delete", "/app/group/{id}", None),
+        ],
+        "/app/shop": [
+            ("create", "post", "/app/shop", lambda test: {"name": "Conditional shop"}),
+            ("update", "patch", "/app/shop/{id}", lambda test: {"name": "Conditional shop renamed"}),
+            ("delete", "delete", "/app/shop/{id}", None),
+        ],
+    }
+
+    def setUp(self):
+        super().setUp()
+        config = mock.patch.dict(caching._conditional_config, {"ENABLED": True})
+        config.start()
+        self.addCleanup(config.stop)
+        self.now = time.time()
+        clock = mock.patch("inventory_api.caching.time.time", side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.group = InventoryGroup.objects.order_by("id").first()
+        self.shop = Shop.objects.order_by("id").first()
+        self.item = Inventory.objects.filter(remaining__gt=0).order_by("id").first()
+
+    def test_current_validators_get_not_modified(self):
+        for path in ["/app/inventory", f"/app/inventory/{self.item.id}", "/app/group", "/app/shop"]:
+            with self.subTest(path=path):
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                etag = response["ETag"]
+                with self.assertNumQueries(0):
+                    response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual((response["ETag"], response.content), (etag, b""))
+
+                # Last-Modified is only sent a second after the last write.
+                self.now += 1
+                last_modified = self.client.get(path)["Last-Modified"]
+                response = self.client.get(path, HTTP_IF_MODIFIED_SINCE=last_modified)
+                self.assertEqual(response.status_code, 304)
+
+    def test_writes_change_the_validators(self):
+        for path, steps in self.writes.items():
+            with self.subTest(path=path):
+                # The first request stamps when the models were modified.
+                self.client.get(path)
+                self.now += 1
+                response = self.client.get(path)
+                etag, last_modified = response["ETag"], response["Last-Modified"]
+                created_id = None
+                for name, method, write_path, data in steps:
+                    self.now += 1
+                    with self.captureOnCommitCallbacks(execute=True):
+                        written = getattr(self.client, method)(write_path.format(id=created_id),
+                                                               data and data(self), format="json")
+                    self.assertEqual(written.status_code, {"post": 201, "patch": 200, "delete": 204}[method], name)
+                    if name == "create":
+                        created_id = written.json()["id"]
+
+                    response = self.client.get(path, HTTP_IF_MODIFIED_SINCE=last_modified)
+                    self.assertEqual(response.status_code, 200, name)
+                    response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+                    self.assertEqual(response.status_code, 200, name)
+                    self.assertNotEqual(response["ETag"], etag, name)
+                    etag = response["ETag"]
+                    self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304, name)
+
+    def test_disabled_sends_no_validators(self):
+        with mock.patch.dict(caching._conditional_config, {"ENABLED": False}):
+            response = self.client.get("/app/inventory")
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("ETag", response)
+            self.assertEqual(self.client.get("/app/inventory", HTTP_IF_NONE_MATCH='"anything"').status_code, 200)
+
+
+class SyncTests(APITestCase):
+    # A POS client keeps a copy of the inventory, groups and shops with
+    # /app/sync, a few rows per page, and after every kind of write the copy
+    # must equal a full download of the list endpoints. LAG_SECONDS is 0, so
+    # rows are only sent again when they changed.
+    limit = 7
+
+    def setUp(self):
+        super().setUp()
+        config = mock.patch.dict(settings.SYNC, {"LAG_SECONDS": 0})
+        config.start()
+        self.addCleanup(config.stop)
+        self.copy = {"inventory": {}, "groups": {}, "shops": {}}
+        self.watermark = None
+
+    def get_writes(self):
+        group = InventoryGroup.objects.filter(group_relations__isnull=False).order_by("id").first()
+        shop = Shop.objects.order_by("id").first()
+        items = list(Inventory.objects.filter(remaining__gt=2).order_by("id").values_list("id", flat=True)[:6])
+        created = {}
+
+        def write(method, path, data=None):
+            response = getattr(self.client, method)(path.format(**created), data, format="json")
+            self.assertLess(response.status_code, 300, response.content)
+            return response.json() if response.content else None
+
+        def create(key, path, data):
+            created[key] = write("post", path, data)["id"]
+
+        def delete_user():
+            CustomUser.objects.filter(inventory_items__isnull=False).exclude(id=self.user.id).first().delete()
+
+        return [
+            ("item created", lambda: create("item", "/app/inventory", {"group_id": group.id, "name": "Synced item",
+                                                                       "total": 5, "price": 2})),
+            ("item updated", lambda: write("patch", "/app/inventory/{item}", {"price": 3.5})),
+            ("sale", lambda: write("post", "/app/invoice", {"shop_id": shop.id, "invoice_item_data": [
+                {"item_id": item_id, "quantity": 1} for item_id in items[:3]
+            ]})),
+            ("stock received", lambda: write("post", "/app/stock-movement", {"item_id": items[3], "kind": "receipt",
+                                                                            "quantity": 4})),
+            ("items bulk created", lambda: created.update(bulk=[result["id"] for result in write(
+                "post", "/app/inventory/bulk", [{"group_id": group.id, "name": f"Bulk {n}", "total": n}
+                                                 for n in range(1, 11)]
+            )["results"]])),
+            ("items bulk updated", lambda: write("patch", "/app/inventory/bulk", [
+                {"id": item_id, "remaining": 0} for item_id in created["bulk"][:5]
+            ])),
+            ("items bulk deleted", lambda: write("delete", "/app/inventory/bulk", created["bulk"][5:])),
+            ("item deleted", lambda: write("delete", "/app/inventory/{item}")),
+            ("group created", lambda: create("group", "/app/group", {"name": "Synced group"})),
+            ("group renamed", lambda: write("patch", "/app/group/{group}", {"name": "Synced group renamed"})),
+            ("parent group with items deleted", lambda: write("delete", f"/app/group/{group.id}")),
+            ("shops bulk created", lambda: created.update(shop=write(
+                "post", "/app/shop/bulk", [{"name": "Synced shop"}]
+            )["results"][0]["id"])),
+            ("shop renamed", lambda: write("patch", "/app/shop/{shop}", {"name": "Synced shop renamed"})),
+            ("shop deleted", lambda: write("delete", "/app/shop/{shop}")),
+            ("user with items deleted", delete_user),
+            ("nothing written", lambda: None),
+        ]
+
+    def sync(self):
+        sent = 0
+        while True:
+            params = {"limit": self.limit, **({"watermark": self.watermark} if self.watermark else {})}
+            response = self.client.get("/app/sync", params)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            for key, rows in self.copy.items():
+                for row in body[key]["updated"]:
+                    rows[row["id"]] = row
+                for row_id in body[key]["deleted"]:
+                    rows.pop(row_id, None)
+                sent += len(body[key]["updated"]) + len(body[key]["deleted"])
+            self.watermark = body["watermark"]
+            if not body["has_more"]:
+                return sent
+
+    def download(self, path):
+        rows = {}
+        url = f"{path}?expand=&pagination=cursor"
+        while url:
+            body = self.client.get(url).json()
+            rows.update((row["id"], row) for row in body["results"])
+            url = body["next"]
+        return rows
+
+    def assert_copy_matches(self):
+        for key, path in (("inventory", "/app/inventory"), ("groups", "/app/group"), ("shops", "/app/shop")):
+            self.assertEqual(self.copy[key], self.download(path), key)
+
+    def test_incremental_sync_matches_a_full_download(self):
+        self.assertGreater(self.sync(), 0)
+        self.assert_copy_matches()
+        for name, write in self.get_writes():
+            with self.subTest(write=name):
+                with self.captureOnCommitCallbacks(execute=True):
+                    write()
+                sent = self.sync()
+                self.assert_copy_matches()
+                if name == "nothing written":
+                    self.assertEqual(sent, 0)
+
+    def test_bad_watermarks_are_rejected(self):
+        self.sync()
+        watermark = json.loads(base64.urlsafe_b64decode(self.watermark))
+        kept = timedelta(days=settings.SYNC["TOMBSTONE_DAYS"])
+        expired = dict(watermark, since=(timezone.now() - kept - timedelta(days=1)).isoformat())
+        naive = dict(watermark, since=timezone.now().replace(tzinfo=None).isoformat())
+        encode = lambda watermark: base64.urlsafe_b64encode(json.dumps(watermark).encode()).decode()
+
+        response = self.client.get("/app/sync", {"watermark": encode(expired)})
+        self.assertEqual(response.status_code, 410)
+        for watermark in ("not-a-watermark", encode({"since": "yesterday"}), encode(naive), encode([1, 2])):
+            with self.subTest(watermark=watermark):
+                response = self.client.get("/app/sync", {"watermark": watermark})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {"watermark": ["Invalid watermark"]})
+        self.assertEqual(self.client.get("/app/sync", {"limit": "many"}).status_code, 400)
+
+
+class QueryCountTests(APITestCase):
+    # Queries per GET without the response cache, once the user is cached.
+    # A page or an object costs the same whatever the size of the dataset,
+    # so the counts are checked again after a second dataset.
+    query_counts = {
+        "/app/inventory?group_id={group}": 7,
+        "/app/inventory?group_id={group}&pagination=cursor": 6,
+        "/app/inventory/{inventory}": 4,
+        "/app/group?id={group}": 5,
+        "/app/group/{group}": 4,
+        "/app/group-tree": 1,
+        "/app/shop": 5,
+        "/app/shop/{shop}": 3,
+        "/app/invoice": 7,
+        "/app/invoice/{invoice}": 6,
+        "/app/stock-movement": 3,
+        "/app/stock-level": 2,
+        "/app/summary": 4,
+        "/app/top-selling": 5,
+        "/app/sale-by-shop": 4,
+        "/app/purchase-summary": 1,
+        "/app/dashboard": 5,
+        "/user/activities-log": 1,
+        "/user/users": 1,
+        "/user/me": 0,
+    }
+
+    def setUp(self):
+        super().setUp()
+        config = mock.patch.dict(caching._config, {"ENABLED": False})
+        config.start()
+        self.addCleanup(config.stop)
+        self.client.get("/app/summary")
+
+    def assert_query_counts(self):
+        # The inventory and group lists are filtered to a new group nested
+        # under the deepest one, so their pages always carry ancestors.
+        deepest = InventoryGroup.objects.order_by("-path").first()
+        group = InventoryGroup.objects.create(name=f"Nested under {deepest.id}", belongs_to=deepest,
+                                              created_by=self.user)
+        item = Inventory.objects.create(group=group, name=f"Nested item {group.id}", total=5, remaining=5, price=1,
+                                        created_by=self.user)
+        ids = {
+            "inventory": item.id,
+            "group": group.id,
+            "shop": Shop.objects.order_by("id").first().id,
+            "invoice": Invoice.objects.order_by("id").first().id,
+        }
+        for path, count in self.query_counts.items():
+            with self.subTest(path=path), CaptureQueriesContext(connection) as captured:
+                response = self.client.get(path.format(**ids))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(captured), count)
+
+    def test_query_counts(self):
+        self.assert_query_counts()
+
+    def test_query_counts_do_not_grow_with_the_data(self):
+        generate_dataset(seed=2, users=5, groups=30, items=200, shops=10, invoices=100, activities=100)
+        self.assert_query_counts()
+
+    def test_hot_queries_use_indexes(self):
+        output = io.StringIO()
+        call_command("check_query_plans", stdout=output)
+        self.assertNotIn("full scan", output.getvalue())
+
+
+class AsyncViewTests(TransactionTestCase):
+    # The async views run their queries on worker threads with connections
+    # of their own, which can't see the transaction of a TestCase.
+    paths = {
+        "/app/summary": "/app/async/summary",
+        "/app/top-selling": "/app/async/top-selling",
+        "/app/sale-by-shop": "/app/async/sale-by-shop",
+        "/app/purchase-summary": "/app/async/purchase-summary",
+    }
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        token_cache.clear()
+        generate_dataset(seed=1, **APITestCase.dataset)
+        self.user = CustomUser.objects.filter(role="admin").order_by("id").first()
+        self.bearer = f"Bearer {get_access_token({'user_id': self.user.id}, 1)}"
+
+    def get_async(self, path, params=None, method="get", bearer=None):
+        headers = {"authorization": bearer} if bearer else {}
+
+        async def request():
+            return await getattr(AsyncClient(), method)(path, params, **headers)
+        return async_to_sync(request)()
+
+    @mock.patch.dict(caching._config, {"ENABLED": False})
+    def test_responses_match_the_sync_views(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.bearer)
+        for sync_path, async_path in self.paths.items():
+            for params in ({}, {"start_date": (timezone.localdate() - timedelta(days=30)).isoformat()},
+                           {"monthly": "true"}):
+                with self.subTest(path=async_path, params=params):
+                    response = self.get_async(async_path, params, bearer=self.bearer)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(json.loads(response.content), json.loads(client.get(sync_path, params).content))
+
+    def test_permissions_match_the_sync_views(self):
+        inactive = CustomUser.objects.create(email="inactive@example.com", fullname="Inactive", role="admin",
+                                             is_active=False)
+        for bearer in (None, "Bearer not-a-token", f"Bearer {get_access_token({'user_id': inactive.id}, 1)}"):
+            client = APIClient()
+            if bearer:
+                client.credentials(HTTP_AUTHORIZATION=bearer)
+            for sync_path, async_path in self.paths.items():
+                with self.subTest(path=async_path, bearer=bearer):
+                    self.assertEqual(client.get(sync_path).status_code, 403)
+                    self.assertEqual(self.get_async(async_path, bearer=bearer).status_code, 403)
+
+        for async_path in self.paths.values():
+            self.assertEqual(self.get_async(async_path, {}, "post", bearer=self.bearer).status_code, 405)
+
+
+class InstrumentationTests(APITestCase):
+    # Each test builds a fresh client, whose handler sets the middleware up
+    # again with the patched config.
+
+    def get_client(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_access_token({'user_id': user.id}, 1)}")
+        return client
+
+    def test_metrics_need_staff_or_the_token(self):
+        staff = CustomUser.objects.create(email="staff@example.com", fullname="Staff", role="admin", is_staff=True)
+        self.assertEqual(APIClient().get("/metrics").status_code, 403)
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.assertEqual(self.get_client(staff).get("/metrics").status_code, 200)
+
+        with mock.patch.dict(instrumentation._config, {"METRICS_TOKEN": "scraper"}):
+            self.assertEqual(APIClient().get("/metrics", HTTP_AUTHORIZATION="Bearer scraper").status_code, 200)
+            self.assertEqual(APIClient().get("/metrics", HTTP_AUTHORIZATION="Bearer other").status_code, 403)
+            self.assertEqual(self.get_client(staff).get("/metrics").status_code, 200)
+
+    def test_sampled_requests_record_queries_and_server_timing(self):
+        staff = CustomUser.objects.create(email="staff@example.com", fullname="Staff", role="admin", is_staff=True)
+        config = {"ENABLED": True, "SAMPLE_RATE": 1, "SERVER_TIMING": True, "PROFILE_SLOW_MS": 0}
+        queries = instrumentation.registry.queries["inventory-list"]
+        with mock.patch.dict(instrumentation._config, config), \
+                mock.patch.object(BaseSerializer, "data", property(inspect.unwrap(BaseSerializer.data.fget))):
+            response = self.get_client(self.user).get("/app/inventory")
+            self.assertTrue(BaseSerializer.data.fget.instrumented)
+            metrics = self.get_client(staff).get("/metrics").content.decode()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response["Server-Timing"], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="[1-9]\d* queries, '
+                                                    r'\d+ duplicates", serializer;dur=[\d.]+$')
+        self.assertGreater(instrumentation.registry.queries["inventory-list"], queries)
+        self.assertIn('http_db_queries_total{route="inventory-list"}', metrics)
+        self.assertIn('http_requests_total{route="inventory-list",method="GET",status="200"}', metrics)
+
+    def test_disabled_instrumentation_installs_nothing(self):
+        data = property(lambda serializer: None)
+        requests = sum(instrumentation.registry.requests.values())
+        with mock.patch.dict(instrumentation._config, {"ENABLED": False, "SAMPLE_RATE": 1, "SERVER_TIMING": True}), \
+                mock.patch.object(BaseSerializer, "data", data), \
+                mock.patch.object(connection, "execute_wrappers", []):
+            with self.assertRaises(MiddlewareNotUsed):
+                instrumentation.InstrumentationMiddleware(lambda request: None)
+            response = self.get_client(self.user).get("/app/inventory")
+            self.assertIs(BaseSerializer.__dict__["data"], data)
+            self.assertEqual(connection.execute_wrappers, [])
+
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(sum(instrumentation.registry.requests.values()), requests)
+
+
+@skipIf(REPLICA_ALIAS in settings.DATABASES, "A replica is already configured")
+class ReadReplicaTests(APITestCase):
+    # A second in-memory SQLite database stands in for the replica. The
+    # router never migrates it, so its tables are created from the models,
+    # and it holds its own small dataset to tell its answers apart. The alias
+    # only exists while the class runs, so the runner never sets it up.
+    analytics_paths = ["/app/summary", "/app/top-selling", "/app/sale-by-shop", "/app/purchase-summary",
+                       "/app/dashboard"]
+
+    @classmethod
+    def setUpClass(cls):
+        databases = mock.patch.dict(settings.DATABASES, {REPLICA_ALIAS: {"ENGINE": "django.db.backends.sqlite3",
+                                                                         "NAME": ":memory:"}})
+        databases.start()
+        cls.addClassCleanup(databases.stop)
+        connections.configure_settings(settings.DATABASES)
+        cls.addClassCleanup(connections.__delitem__, REPLICA_ALIAS)
+        cls.addClassCleanup(connections[REPLICA_ALIAS].close)
+        cls.databases = {"default", REPLICA_ALIAS}
+        with connections[REPLICA_ALIAS].schema_editor() as editor:
+            for model in apps.get_models():
+                editor.create_model(model)
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        CustomUser.objects.using(REPLICA_ALIAS).bulk_create([CustomUser.objects.get(id=cls.user.id)])
+        Shop.objects.using(REPLICA_ALIAS).bulk_create([Shop(name="Replica shop", created_by_id=cls.user.id)])
+
+    def setUp(self):
+        super().setUp()
+        config = mock.patch.dict(caching._config, {"ENABLED": False})
+        config.start()
+        self.addCleanup(config.stop)
+
+    def test_analytics_read_from_the_replica(self):
+        response = self.client.get("/app/summary")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"total_inventory": 0, "total_group": 0, "total_shop": 1,
+                                           "total_user": 1})
+        for path in self.analytics_paths:
+            with self.subTest(path=path), CaptureQueriesContext(connection) as default, \
+                    CaptureQueriesContext(connections[REPLICA_ALIAS]) as replica:
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(default), 0)
+                self.assertGreater(len(replica), 0)
+
+    def test_other_endpoints_read_from_default(self):
+        for path in ["/app/inventory", "/app/shop", "/app/invoice", "/user/users"]:
+            with self.subTest(path=path), CaptureQueriesContext(connections[REPLICA_ALIAS]) as replica:
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(replica), 0)
+
+    def test_writes_go_to_default(self):
+        with read_from_replica():
+            self.assertEqual(router.db_for_read(Shop), REPLICA_ALIAS)
+            self.assertEqual(router.db_for_write(Shop), "default")
+            shop = Shop.objects.using(REPLICA_ALIAS).get(name="Replica shop")
+            shop.name = "Renamed"
+            shop.save()
+        self.assertTrue(Shop.objects.filter(id=shop.id, name="Renamed").exists())
+        self.assertTrue(Shop.objects.using(REPLICA_ALIAS).filter(name="Replica shop").exists())
+
+    def test_replica_is_not_migrated(self):
+        self.assertFalse(router.allow_migrate(REPLICA_ALIAS, "app_control"))
+        self.assertFalse(router.allow_migrate_model(REPLICA_ALIAS, Inventory))
+        self.assertTrue(router.allow_migrate_model("default", Inventory))
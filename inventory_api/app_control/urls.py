@@ -1,7 +1,9 @@
-from django.urls import path, include
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
 from .views import (InventoryView, InventoryGroupView, ShopView, SummaryView, PurchaseView, 
-SaleByShopView, SalePerformanceView, InvoiceView, InventoryCSVLoaderView)
+SaleByShopView, SalePerformanceView, InvoiceView, InventoryCSVLoaderView, InventoryGroupTreeView,
+StockMovementView, StockLevelView, DashboardView, SyncView, photo_view)
+from .async_views import summary_view, top_selling_view, sale_by_shop_view, purchase_summary_view
 
 router = DefaultRouter(trailing_slash=False)
 
@@ -9,12 +11,22 @@ router.register(r'inventory', InventoryView, 'inventory')
 router.register(r'inventory-csv', InventoryCSVLoaderView, 'inventory-csv')
 router.register(r'shop', ShopView, 'shop')
 router.register(r'summary', SummaryView, 'summary')
+router.register(r'dashboard', DashboardView, 'dashboard')
 router.register(r'purchase-summary', PurchaseView, 'purchase-summary')
 router.register(r'sale-by-shop', SaleByShopView, 'sales-by-shop')
 router.register(r'group', InventoryGroupView, 'group')
+router.register(r'group-tree', InventoryGroupTreeView, 'group-tree')
 router.register(r'top-selling', SalePerformanceView, 'top-selling')
 router.register(r'invoice', InvoiceView, 'invoice')
+router.register(r'stock-movement', StockMovementView, 'stock-movement')
+router.register(r'stock-level', StockLevelView, 'stock-level')
+router.register(r'sync', SyncView, 'sync')
 
 urlpatterns = [
     path('', include(router.urls)),
+    re_path(r'^photo/(?P<photo_hash>[0-9a-f]{64})$', photo_view, name='photo'),
+    path('async/summary', summary_view, name='async-summary'),
+    path('async/top-selling', top_selling_view, name='async-top-selling'),
+    path('async/sale-by-shop', sale_by_shop_view, name='async-sale-by-shop'),
+    path('async/purchase-summary', purchase_summary_view, name='async-purchase-summary'),
 ]
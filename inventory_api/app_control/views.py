@@ -1,88 +1,411 @@
 from rest_framework.viewsets import ModelViewSet
 from .serializers import (InventoryGroupSerializer, InventorySerializer, InventoryGroup,
                          Inventory, ShopSerializer, Shop, Invoice, InvoiceSerializer, InvoiceItem,
-                          InventoryWithSumSerializer, ShopWithAmountSerializer,)
-from inventory_api.utils import CustomPagination, get_query
-from django.db.models import Count, Sum, F
-from django.db.models.functions import Coalesce, TruncMonth
+                          InventoryWithSumSerializer, ShopWithAmountSerializer, InventoryCSVRowSerializer,
+                          StockMovementSerializer, StockLevelSerializer)
+from .models import (bulk_create_inventories, bulk_create_groups, bulk_create_shops, detach_deleted_groups,
+                     refresh_search_documents, DailySale, StockMovement, record_stock_movement, get_stock_as_of,
+                     get_counter_changes, update_group_counters, Tombstone)
+from inventory_api.utils import (CustomPagination, ExportMixin, NDJSONParser, get_query, search_queryset,
+                                 reserved_query_params, scalar_query, select_scalars, snapshot_transaction,
+                                 filter_by_query_params, id_lookups, relation_lookups, text_lookups, range_lookups,
+                                 date_lookups)
+from django.db.models import Sum, F, Q, Prefetch
+from django.db.models.functions import TruncMonth
 from user_control.models import CustomUser
 from rest_framework.response import Response
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta
+from django.conf import settings
 from inventory_api.custom_methods import IsAuthenticatedCustom
-import csv, codecs
+from inventory_api.caching import ConditionalGetMixin, cache_response, bump_cache_version
+from inventory_api.db_routers import ReadReplicaMixin
+from inventory_api.fieldsets import Fieldset, FieldsetMixin
+from inventory_api.projections import ProjectionListMixin
+from inventory_api.renderers import ORJSONRenderer
+from rest_framework.renderers import BrowsableAPIRenderer
+from user_control.views import add_user_activity
+from django.db import router, transaction
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, Http404
+from django.views.decorators.http import require_safe
+from .photos import open_photo, guess_content_type
+from .projections import (InventoryProjection, InventoryGroupProjection, ShopProjection, InvoiceProjection,
+                          InvoiceItemProjection)
+import csv, codecs, copy, re, json, base64
+
+
+def get_item_id(item):
+    item_id = item.get("id") if isinstance(item, dict) else item
+    try:
+        return int(item_id)
+    except (TypeError, ValueError):
+        return None
+
+
+class BulkModelMixin:
+    # Adds /<resource>/bulk: POST creates, PATCH partially updates and DELETE
+    # deletes a JSON array or NDJSON stream of items in one transaction, with
+    # a status per item and one activity entry for the whole batch.
+    bulk_update_fields = ()
+    # Update fields holding counts, written as deltas (see write_bulk_update).
+    bulk_delta_fields = ()
+    bulk_label = "items"
+
+    @action(detail=False, methods=["post", "patch", "delete"], url_path="bulk",
+            parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({"non_field_errors": ["You need to send a list of items"]})
+
+        with transaction.atomic():
+            if request.method == "POST":
+                results, count, verb = self.bulk_create_items(items, request)
+            elif request.method == "PATCH":
+                results, count, verb = self.bulk_update_items(items)
+            else:
+                results, count, verb = self.bulk_delete_items(items)
+
+            if count:
+                add_user_activity(request.user, f"{verb} {count} {self.bulk_label}")
+
+        return Response({"count": count, "results": results})
+
+    def bulk_create_items(self, items, request):
+        model = self.serializer_class.Meta.model
+        unique_fields = [field.name for field in model._meta.fields if field.unique and not field.primary_key]
+        seen = {field: set() for field in unique_fields}
+        results = []
+        instances = []
+
+        validated = {}
+        for index, item in enumerate(items):
+            serializer = self.get_serializer(data={**item, "created_by_id": request.user.id})
+            if serializer.is_valid():
+                validated[index] = serializer.validated_data
+            else:
+                results.append({"index": index, "status": "error", "errors": serializer.errors})
+        related = self.get_bulk_related(model, validated.values())
+
+        for index, data in validated.items():
+            # Relations are looked up for the whole batch at once; an id that
+            # is not a number or not found fails its item only.
+            missing = {
+                field.attname: ["Not found"] for field in related
+                if data.get(field.attname) is not None and get_item_id(data[field.attname]) not in related[field]
+            }
+            # Validators only check against stored rows, so duplicates
+            # inside the batch are caught here.
+            duplicates = {
+                field: ["Duplicated in this batch"] for field in unique_fields
+                if data.get(field) is not None and data[field] in seen[field]
+            }
+            if missing or duplicates:
+                results.append({"index": index, "status": "error", "errors": {**missing, **duplicates}})
+                continue
+            for field in unique_fields:
+                seen[field].add(data.get(field))
+
+            instance = model(**data)
+            for field, objects in related.items():
+                if data.get(field.attname) is not None:
+                    setattr(instance, field.name, objects[get_item_id(data[field.attname])])
+            instances.append(instance)
+            results.append({"index": index, "status": "created", "instance": instance})
+
+        if instances:
+            self.bulk_create_objects(instances)
+
+        results.sort(key=lambda result: result["index"])
+        for result in results:
+            if "instance" in result:
+                result["id"] = result.pop("instance").id
+        return results, len(instances), "Bulk Created"
+
+    def get_bulk_related(self, model, validated):
+        # One in_bulk per foreign key set in the batch, {field: {id: object}}.
+        related = {}
+        for field in model._meta.fields:
+            if field.many_to_one and any(data.get(field.attname) is not None for data in validated):
+                ids = {get_item_id(data.get(field.attname)) for data in validated}
+                related[field] = field.related_model.objects.in_bulk(ids - {None})
+        return related
+
+    def bulk_update_items(self, items):
+        model = self.serializer_class.Meta.model
+        ids = [get_item_id(item) for item in items]
+        # Rows are locked in id order, so batches updating the same rows wait
+        # for each other instead of deadlocking.
+        existing = self.queryset.prefetch_related(None).select_for_update(of=("self",)).order_by("id").in_bulk(
+            [item_id for item_id in ids if item_id is not None]
+        )
+        results = []
+        instances = {}
+        changed = {}
+        stored = {}
+
+        for index, item in enumerate(items):
+            instance = existing.get(ids[index])
+            if instance is None:
+                results.append({"index": index, "status": "error", "errors": {"id": ["Not found"]}})
+                continue
+
+            data = {field: value for field, value in item.items() if field in self.bulk_update_fields}
+            serializer = self.get_serializer(instance, data=data, partial=True)
+            if not serializer.is_valid():
+                results.append({"index": index, "status": "error", "errors": serializer.errors})
+                continue
+
+            stored.setdefault(instance.id, {field: getattr(instance, field) for field in self.bulk_delta_fields})
+            for field, value in serializer.validated_data.items():
+                setattr(instance, field, value)
+            instances[instance.id] = instance
+            changed.setdefault(instance.id, set()).update(serializer.validated_data)
+            results.append({"index": index, "id": instance.id, "status": "updated"})
+
+        if instances:
+            # Each row is written with only the fields its items sent, in one
+            # bulk_update per distinct set of fields.
+            batches = {}
+            now = timezone.now()
+            for instance in instances.values():
+                fields = changed[instance.id] | {"updated_at"}
+                instance.updated_at = now
+                if hasattr(instance, "search_document"):
+                    instance.search_document = instance.get_search_document()
+                    fields.add("search_document")
+                batches.setdefault(frozenset(fields), []).append(instance)
+
+            for fields, batch in batches.items():
+                self.write_bulk_update(model, batch, fields, stored)
+            fields = set().union(*batches)
+            self.after_bulk_update(list(instances.values()), fields)
+            bump_cache_version(model)
+
+        return results, len(instances), "Bulk Updated"
+
+    def write_bulk_update(self, model, instances, fields, stored):
+        # Counters in bulk_delta_fields are written as the difference to the
+        # value read, so a change made since (e.g. by an invoice, on
+        # databases ignoring the row locks) is kept rather than overwritten.
+        deltas = [field for field in self.bulk_delta_fields if field in fields]
+        values = [{field: getattr(instance, field) for field in deltas} for instance in instances]
+        for instance, value in zip(instances, values):
+            for field in deltas:
+                setattr(instance, field, F(field) + (value[field] - stored[instance.id][field]))
+        try:
+            model.objects.bulk_update(instances, fields, batch_size=1000)
+        finally:
+            for instance, value in zip(instances, values):
+                for field in deltas:
+                    setattr(instance, field, value[field])
+
+    def bulk_delete_items(self, items):
+        model = self.serializer_class.Meta.model
+        ids = [get_item_id(item) for item in items]
+        existing = set(model.objects.filter(id__in=[item_id for item_id in ids if item_id is not None]).values_list("id", flat=True))
+
+        if existing:
+            self.before_bulk_delete(existing)
+            model.objects.filter(id__in=existing).delete()
+            self.after_bulk_delete(existing)
+            bump_cache_version(model)
+
+        results = [
+            {"index": index, "id": item_id, "status": "deleted"} if item_id in existing
+            else {"index": index, "id": item_id, "status": "error", "errors": {"id": ["Not found"]}}
+            for index, item_id in enumerate(ids)
+        ]
+        return results, len(existing), "Bulk Deleted"
+
+    def bulk_create_objects(self, instances):
+        return self.serializer_class.Meta.model.objects.bulk_create(instances)
+
+    def after_bulk_update(self, instances, fields):
+        pass
 
-class InventoryView(ModelViewSet):
+    def before_bulk_delete(self, ids):
+        pass
+
+    def after_bulk_delete(self, ids):
+        pass
+
+
+class InventoryView(ConditionalGetMixin, ProjectionListMixin, BulkModelMixin, ExportMixin, ModelViewSet):
     queryset = Inventory.objects.select_related('group', 'created_by')
     serializer_class = InventorySerializer
+    projection_class = InventoryProjection
+    conditional_models = (Inventory, InventoryGroup, CustomUser)
     permission_classes = [IsAuthenticatedCustom]
     pagination_class = CustomPagination
+    filter_fields = {
+        "id": id_lookups, "code": text_lookups, "name": text_lookups, "group_id": relation_lookups,
+        "created_by_id": relation_lookups, "total": range_lookups, "remaining": range_lookups,
+        "price": range_lookups, "created_at": date_lookups, "updated_at": date_lookups,
+    }
 
     def get_queryset(self):
-        if self.queryset.method != "GET":
+        if self.request.method != "GET":
             return self.queryset
         
         data = self.request.query_params.dict()
-        data.pop("page")
+        for param in reserved_query_params:
+            data.pop(param, None)
         keyword = data.pop("keyword", None)
 
-        results = get_query(**data)
+        results = filter_by_query_params(self.queryset, data, self.filter_fields)
 
         if keyword:
-            search_fields = ("code", "creatd_by__fullname", "group__name", "name", "created_by__email")
-            query = get_query(keyword, search_fields)
-            results = results.filter(query)
+            results = search_queryset(results, keyword)
+        if self.action == "list":
+            results = results.defer("photo")
         return results
 
     def create(self, request, *args, **kwargs):
         request.data.update({'created_by_id': request.user.id})
         return super().create(request, *args, **kwargs)
 
-class InventoryGroupView(ModelViewSet):
-    queryset = InventoryGroup.objects.select_related('belongs_to', 'created_by').prefetch_related('inventories')
+    bulk_update_fields = ("name", "total", "remaining", "price")
+    bulk_delta_fields = ("total", "remaining")
+    bulk_label = "Inventory items"
+
+    export_fields = ("id", "code", "name", "group_id", "group__name", "total", "remaining", "price",
+                     "created_by__email", "created_at", "updated_at")
+    export_filename = "inventory"
+
+    def bulk_create_objects(self, instances):
+        return bulk_create_inventories(instances)
+
+    def after_bulk_update(self, instances, fields):
+        if "remaining" in fields:
+            StockMovement.objects.bulk_create([
+                StockMovement(item=instance, kind=StockMovement.ADJUSTMENT, created_by=self.request.user,
+                              quantity=(instance.remaining or 0) - (instance.old_remaining or 0))
+                for instance in instances if instance.remaining != instance.old_remaining
+            ])
+        if "remaining" in fields or "price" in fields:
+            update_group_counters(
+                change for instance in instances
+                for change in get_counter_changes(instance.old_counter_state, instance.get_counter_state())
+            )
+
+    def before_bulk_delete(self, ids):
+        update_group_counters(
+            change for state in Inventory.objects.select_for_update().filter(id__in=ids).values_list(
+                "group_id", "remaining", "price"
+            ) for change in get_counter_changes(state, None)
+        )
+
+class InventoryGroupView(ConditionalGetMixin, FieldsetMixin, BulkModelMixin, ModelViewSet):
+    queryset = InventoryGroup.objects.select_related('belongs_to', 'created_by')
     serializer_class = InventoryGroupSerializer
+    # Inventory writes change the item counters of the groups.
+    conditional_models = (InventoryGroup, Inventory, CustomUser)
+    permission_classes = [IsAuthenticatedCustom]
     pagination_class = CustomPagination
+    filter_fields = {
+        "id": id_lookups, "name": text_lookups, "belongs_to_id": relation_lookups,
+        "created_by_id": relation_lookups, "created_at": date_lookups, "updated_at": date_lookups,
+    }
+    # Read by load_group_ancestors when belongs_to is expanded.
+    fieldset_columns = ("path",)
 
     def get_queryset(self):
-        if self.queryset.method.lower() != "GET":
+        if self.request.method != "GET":
             return self.queryset
         
         data = self.request.query_params.dict()
-        data.pop("page")
+        for param in reserved_query_params:
+            data.pop(param, None)
         keyword = data.pop("keyword", None)
 
-        results = get_query(**data)
+        results = filter_by_query_params(self.queryset, data, self.filter_fields)
 
         if keyword:
-            search_fields = ("creatd_by__fullname", "name", "created_by__email")
+            search_fields = ("created_by__fullname", "name", "created_by__email")
             query = get_query(keyword, search_fields)
             results = results.filter(query)
-        return results.annotate(
-            total_items=Count('inventories')
-        )
+        return results.order_by('-created_at', '-id')
     
     def create(self, request, *args, **kwargs):
         request.data.update({'created_by_id': request.user.id})
         return super().create(request, *args, **kwargs)
 
-class ShopView(ModelViewSet):
+    bulk_update_fields = ("name",)
+    bulk_label = "Inventory Groups"
+
+    def bulk_create_objects(self, instances):
+        return bulk_create_groups(instances)
+
+    def after_bulk_update(self, instances, fields):
+        if "name" in fields:
+            refresh_search_documents(Inventory.objects.filter(group__in=instances))
+
+    def after_bulk_delete(self, ids):
+        detach_deleted_groups(ids)
+
+class InventoryGroupTreeView(ModelViewSet):
+    http_method_names = ('get',)
+    permission_classes = (IsAuthenticatedCustom,)
+    queryset = InventoryGroup.objects.all()
+
+    def list(self, request, *args, **kwargs):
+        groups = list(self.queryset.values(
+            'id', 'name', 'belongs_to_id', 'path', 'item_count'
+        ).order_by('path', 'name'))
+
+        nodes = {}
+        roots = []
+        for group in groups:
+            nodes[group['id']] = {
+                "id": group['id'],
+                "name": group['name'],
+                "item_count": group['item_count'],
+                "subtree_item_count": group['item_count'],
+                "children": []
+            }
+
+        # Ordering by path puts every parent before its children, so walking
+        # the list backwards adds each subtree total to its parent exactly once.
+        for group in groups:
+            parent = nodes.get(group['belongs_to_id'])
+            (parent["children"] if parent else roots).append(nodes[group['id']])
+        for group in reversed(groups):
+            parent = nodes.get(group['belongs_to_id'])
+            if parent:
+                parent["subtree_item_count"] += nodes[group['id']]["subtree_item_count"]
+
+        return Response(roots)
+
+class ShopView(ConditionalGetMixin, ProjectionListMixin, BulkModelMixin, ModelViewSet):
     queryset = Shop.objects.select_related('created_by')
     serializer_class = ShopSerializer
+    projection_class = ShopProjection
+    conditional_models = (Shop, CustomUser)
     permission_classes = [IsAuthenticatedCustom]
     pagination_class = CustomPagination
+    filter_fields = {
+        "id": id_lookups, "name": text_lookups, "created_by_id": relation_lookups,
+        "created_at": date_lookups, "updated_at": date_lookups,
+    }
 
     def get_queryset(self):
-        if self.queryset.method.lower() != "GET":
+        if self.request.method != "GET":
             return self.queryset
         
         data = self.request.query_params.dict()
-        data.pop("page")
+        for param in reserved_query_params:
+            data.pop(param, None)
         keyword = data.pop("keyword", None)
 
-        results = get_query(**data)
+        results = filter_by_query_params(self.queryset, data, self.filter_fields)
 
         if keyword:
-            search_fields = ("creatd_by__fullname", "name", "created_by__email")
-            query = get_query(keyword, search_fields)
-            results = results.filter(query)
+            results = search_queryset(results, keyword)
         
         return results
     
@@ -90,26 +413,50 @@ class ShopView(ModelViewSet):
         request.data.update({'created_by_id': request.user.id})
         return super().create(request, *args, **kwargs)
 
-class InvoiceView(ModelViewSet):
-    queryset = Invoice.objects.select_related('created_by', 'shop').prefetch_related("invoice_items")
+    bulk_update_fields = ("name",)
+    bulk_label = "Shops"
+
+    def bulk_create_objects(self, instances):
+        return bulk_create_shops(instances)
+
+    def after_bulk_update(self, instances, fields):
+        if "name" in fields:
+            refresh_search_documents(Invoice.objects.filter(shop__in=instances))
+
+class InvoiceView(ProjectionListMixin, ExportMixin, ModelViewSet):
+    queryset = Invoice.objects.select_related('created_by', 'shop').prefetch_related(
+        Prefetch("invoice_items", queryset=InvoiceItem.objects.order_by(*InvoiceItemProjection.ordering))
+    )
     serializer_class = InvoiceSerializer
+    projection_class = InvoiceProjection
     permission_classes = [IsAuthenticatedCustom]
     pagination_class = CustomPagination
+    filter_fields = {
+        "id": id_lookups, "shop_id": relation_lookups, "created_by_id": relation_lookups,
+        "created_at": date_lookups,
+    }
 
     def get_queryset(self):
-        if self.queryset.method.lower() != "GET":
+        if self.request.method != "GET":
             return self.queryset
         
         data = self.request.query_params.dict()
-        data.pop("page")
+        for param in reserved_query_params:
+            data.pop(param, None)
         keyword = data.pop("keyword", None)
 
-        results = get_query(**data)
+        results = filter_by_query_params(self.queryset, data, self.filter_fields)
 
         if keyword:
-            search_fields = ("creatd_by__fullname", "shop__name", "created_by__email")
-            query = get_query(keyword, search_fields)
-            results = results.filter(query)
+            results = search_queryset(results, keyword)
+        if self.action == "retrieve":
+            # The serializer renders each line's item and both users in full.
+            results = results.select_related('shop__created_by').prefetch_related(None).prefetch_related(
+                Prefetch("invoice_items", queryset=InvoiceItem.objects.select_related("item").defer(
+                    "item__photo").order_by(*InvoiceItemProjection.ordering)),
+                'created_by__groups', 'created_by__user_permissions',
+                'shop__created_by__groups', 'shop__created_by__user_permissions'
+            )
         
         return results
     
@@ -117,108 +464,410 @@ class InvoiceView(ModelViewSet):
         request.data.update({'created_by_id': request.user.id})
         return super().create(request, *args, **kwargs)
 
-class SummaryView(ModelViewSet):
+    # One row per invoice item, carrying the columns of its invoice.
+    export_fields = ("invoice_id", "invoice__created_at", "invoice__shop_id", "invoice__shop__name",
+                     "invoice__created_by__email", "item_id", "item_code", "item_name", "quantity", "amount")
+    export_filename = "invoices"
+
+    def get_export_queryset(self):
+        invoices = self.filter_queryset(self.get_queryset())
+        return InvoiceItem.objects.filter(
+            invoice__in=invoices.values("id")
+        ).order_by("-invoice__created_at", "-invoice_id", "id")
+
+class StockMovementView(FieldsetMixin, ModelViewSet):
+    http_method_names = ('get', 'post')
+    queryset = StockMovement.objects.select_related('created_by', 'item').prefetch_related(
+        'created_by__groups', 'created_by__user_permissions'
+    )
+    serializer_class = StockMovementSerializer
+    permission_classes = (IsAuthenticatedCustom,)
+    pagination_class = CustomPagination
+    pagination_mode = "cursor"
+    filter_fields = {
+        "id": id_lookups, "item_id": relation_lookups, "kind": id_lookups, "invoice_id": relation_lookups,
+        "created_by_id": relation_lookups, "created_at": date_lookups,
+    }
+
+    def get_queryset(self):
+        if self.request.method != "GET":
+            return self.queryset
+
+        data = self.request.query_params.dict()
+        for param in reserved_query_params:
+            data.pop(param, None)
+        return filter_by_query_params(self.queryset, data, self.filter_fields)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        movement = record_stock_movement(created_by=request.user, **serializer.validated_data)
+
+        add_user_activity(request.user, f"Recorded {movement.kind} of {movement.quantity} for {movement.item}")
+        return Response(self.get_serializer(movement).data, status=201)
+
+class StockLevelView(FieldsetMixin, ModelViewSet):
+    # Stock of every item as of ?as_of= (a datetime, or a date meaning the
+    # end of that day), next to its current remaining.
+    http_method_names = ('get',)
+    queryset = Inventory.objects.all()
+    serializer_class = StockLevelSerializer
+    permission_classes = (IsAuthenticatedCustom,)
+    pagination_class = CustomPagination
+    filter_fields = {
+        "id": id_lookups, "code": text_lookups, "name": text_lookups, "group_id": relation_lookups,
+    }
+
+    def get_queryset(self):
+        data = self.request.query_params.dict()
+        for param in reserved_query_params:
+            data.pop(param, None)
+        as_of = get_as_of(data.pop("as_of", None))
+
+        return get_stock_as_of(as_of, filter_by_query_params(self.queryset, data, self.filter_fields)).order_by('-created_at', '-id')
+
+
+def get_as_of(value):
+    if not value:
+        return None
+
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValidationError({"as_of": ["as_of must be a date or a datetime"]})
+        moment = datetime.combine(day, time.max)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+_sync_config = getattr(settings, "SYNC", {})
+
+
+def encode_watermark(watermark):
+    # isoformat keeps the microseconds the positions are compared to.
+    dump = lambda moment: None if moment is None else moment.isoformat()
+    return base64.urlsafe_b64encode(json.dumps({
+        "since": dump(watermark["since"]),
+        "started": dump(watermark["started"]),
+        "positions": {key: [dump(moment), row_id] for key, (moment, row_id) in watermark["positions"].items()},
+    }).encode()).decode()
+
+
+class WatermarkExpired(APIException):
+    status_code = 410
+    default_detail = "Watermark is older than the kept deletions, sync again without it"
+    default_code = "watermark_expired"
+
+
+def decode_watermark(token):
+    # {"since": the sync restarts from here, "started": when the current run
+    # of pages began, "positions": {key: [moment, id]} the last row sent of
+    # every model in the run}. An empty watermark starts a full download.
+    if not token:
+        return {"since": None, "started": None, "positions": {}}
+
+    def parse(value):
+        if value is None:
+            return None
+        moment = parse_datetime(value)
+        if moment is None or timezone.is_naive(moment):
+            raise ValueError(value)
+        return moment
+
+    try:
+        watermark = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return {
+            "since": parse(watermark["since"]),
+            "started": parse(watermark["started"]),
+            "positions": {key: (parse(moment), int(row_id)) for key, (moment, row_id) in watermark["positions"].items()},
+        }
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise ValidationError({"watermark": ["Invalid watermark"]})
+
+
+def get_position_query(field, position, since):
+    # The field__gte bound alone is what lets the (field, id) index seek to
+    # the position; the OR only trims the tie.
+    if position is not None:
+        moment, row_id = position
+        return Q(Q(**{f"{field}__gt": moment}) | Q(**{field: moment, "id__gt": row_id}), **{f"{field}__gte": moment})
+    if since is not None:
+        return Q(**{f"{field}__gte": since})
+    return Q()
+
+
+class SyncView(ModelViewSet):
+    # Delta sync for offline (POS) clients: the inventory items, groups and
+    # shops changed since ?watermark=, in (updated_at, id) order with their
+    # relations as ids, like ?expand= on their list endpoints, and the ids
+    # deleted since, from tombstones. Clients upsert "updated", then drop
+    # "deleted", and call again with the returned watermark, right away while
+    # has_more is true. Without a watermark everything is sent, without
+    # deletions. A watermark older than the kept tombstones gets a 410.
+    # updated_at is set before the writing transaction commits, so a sync
+    # restarts LAG_SECONDS before its first page: rows written in that
+    # window are sent again, which upserting makes harmless.
+    http_method_names = ('get',)
+    permission_classes = (IsAuthenticatedCustom,)
+    queryset = Tombstone.objects.all()
+    renderer_classes = (ORJSONRenderer, BrowsableAPIRenderer)
+    sync_projections = (
+        ("inventory", InventoryProjection), ("groups", InventoryGroupProjection), ("shops", ShopProjection)
+    )
+
+    def list(self, request, *args, **kwargs):
+        watermark = decode_watermark(request.query_params.get("watermark"))
+        page_size = _sync_config.get("PAGE_SIZE", 500)
+        try:
+            limit = max(1, min(int(request.query_params.get("limit", page_size)), page_size))
+        except ValueError:
+            raise ValidationError({"limit": ["limit must be a number"]})
+
+        now = timezone.now()
+        since, positions = watermark["since"], watermark["positions"]
+        if since is not None and since < now - timedelta(days=_sync_config.get("TOMBSTONE_DAYS", 30)):
+            raise WatermarkExpired()
+
+        fieldset = Fieldset(None, ())
+        data = {}
+        new_positions = {}
+        has_more = False
+        labels = {}
+
+        with snapshot_transaction():
+            for key, projection_class in self.sync_projections:
+                projection = projection_class.get(fieldset)
+                labels[projection.model._meta.label_lower] = key
+                rows = list(projection.model.objects.filter(
+                    get_position_query("updated_at", positions.get(key), since)
+                ).order_by("updated_at", "id").values(*dict.fromkeys([*projection.columns, "updated_at"]))[:limit])
+
+                has_more |= len(rows) == limit
+                if rows:
+                    new_positions[key] = (rows[-1]["updated_at"], rows[-1]["id"])
+                elif key in positions:
+                    new_positions[key] = positions[key]
+                data[key] = {"updated": projection.render(rows), "deleted": []}
+
+            # A full download has nothing to delete.
+            if since is not None:
+                tombstones = list(Tombstone.objects.filter(
+                    get_position_query("deleted_at", positions.get("deleted"), since), model__in=labels
+                ).order_by("deleted_at", "id").values("id", "model", "object_id", "deleted_at")[:limit])
+
+                has_more |= len(tombstones) == limit
+                if tombstones:
+                    new_positions["deleted"] = (tombstones[-1]["deleted_at"], tombstones[-1]["id"])
+                elif "deleted" in positions:
+                    new_positions["deleted"] = positions["deleted"]
+                for tombstone in tombstones:
+                    data[labels[tombstone["model"]]]["deleted"].append(tombstone["object_id"])
+
+        started = watermark["started"] or now
+        if has_more:
+            watermark = {"since": since, "started": started, "positions": new_positions}
+        else:
+            restart = started - timedelta(seconds=_sync_config.get("LAG_SECONDS", 60))
+            watermark = {"since": restart if since is None else max(since, restart), "started": None,
+                         "positions": {}}
+
+        return Response({"watermark": encode_watermark(watermark), "has_more": has_more, **data})
+
+class SummaryView(ReadReplicaMixin, ModelViewSet):
     http_method_names = ('get',)
     permission_classes = [IsAuthenticatedCustom]
     queryset = InventoryView.queryset
 
+    @cache_response(Inventory, InventoryGroup, Shop, CustomUser)
     def list(self, request, *args, **kwargs):
-        total_inventories = InventoryView.queryset.filter(
-            remaining_gt=0
-        ).count()
-        total_group = InventoryGroupView.queryset.count()
-        total_shop = ShopView.queryset.count()
-        total_user = CustomUser.objects.filter(is_superuser=False).count()
+        return Response(get_summary_counts())
 
-        return Response({
-            "total_inventory": total_inventories,
-            "total_group": total_group,
-            "total_shop": total_shop,
-            "total_user": total_user
-        })
 
+def get_summary_counts():
+    return {
+        "total_inventory": get_in_stock_count(),
+        "total_group": get_group_count(),
+        "total_shop": get_shop_count(),
+        "total_user": get_user_count()
+    }
+
+
+def get_in_stock_count():
+    return InventoryView.queryset.filter(remaining__gt=0).count()
+
+
+def get_group_count():
+    return InventoryGroup.objects.count()
+
+
+def get_shop_count():
+    return ShopView.queryset.count()
+
+
+def get_user_count():
+    return CustomUser.objects.filter(is_superuser=False).count()
+
+
+def get_daily_sales(query_data):
+    query = DailySale.objects.all()
+
+    if not query_data.get("total", None):
+        start_date = query_data.get("start_date", None)
+        end_date = query_data.get("end_date", None)
+        if start_date:
+            query = query.filter(day__gte=start_date)
+        if end_date:
+            query = query.filter(day__lte=end_date)
+
+    return query
+
+
+def get_top_selling(query_data):
+    sales = list(get_daily_sales(query_data).filter(
+        item__isnull=False
+    ).values("item_id").annotate(
+        sum_of_item = Sum("quantity")
+    ).order_by('-sum_of_item')[:10])
+
+    items = InventoryView.queryset.defer("photo").in_bulk([sale["item_id"] for sale in sales])
+    top_items = []
+    for sale in sales:
+        item = items[sale["item_id"]]
+        item.sum_of_item = sale["sum_of_item"]
+        top_items.append(item)
+
+    return InventoryWithSumSerializer(top_items, many=True).data
+
+
+def get_sales_by_shop(query_data):
+    monthly = query_data.get("monthly", None)
+    sales = get_daily_sales(query_data).filter(shop__isnull=False)
+
+    if monthly:
+        sales = sales.annotate(month = TruncMonth('day')).values('shop_id', 'month').annotate(
+            amount_total = Sum("amount")).order_by('month', '-amount_total')
+    else:
+        sales = sales.values('shop_id').annotate(
+            amount_total = Sum("amount")).order_by('-amount_total')
+    sales = list(sales)
 
-class SalePerformanceView(ModelViewSet):
+    shops = ShopView.queryset.prefetch_related(
+        'created_by__groups', 'created_by__user_permissions'
+    ).in_bulk([sale["shop_id"] for sale in sales])
+    shop_sales = []
+    for sale in sales:
+        shop = copy.copy(shops[sale["shop_id"]])
+        shop.amount_total = sale["amount_total"]
+        shop.month = sale.get("month")
+        shop_sales.append(shop)
+
+    return ShopWithAmountSerializer(shop_sales, many=True).data
+
+
+def get_purchase_summary(query_data):
+    query = get_daily_sales(query_data).aggregate(
+        amount_total = Sum("amount"), total = Sum("quantity")
+    )
+
+    return {
+        "price": "0.00" if not query.get("amount_total") else query.get("amount_total"),
+        "count": 0 if not query.get("total") else query.get("total")
+    }
+
+
+class SalePerformanceView(ReadReplicaMixin, ModelViewSet):
     http_method_names = ('get',)
     permission_classes = [IsAuthenticatedCustom]
     queryset = InventoryView.queryset
 
+    @cache_response(Invoice, Inventory)
     def list(self, request, *args, **kwargs):
-        query_data = request.query_params.dict()
-        total = query_data.get("total", None)
-        query = self.queryset
-
-        if not total:
-            start_date = query_data.get("start_date", None)
-            end_date = query_data.get("end_date", None)
-            if start_date:
-                query = query.filter(
-                inventory_invoice__created_at__range = [start_date, end_date]
-            )
-        
-        items = query.annotate(
-            sum_of_item = Coalesce(Sum('inventory_invoices__quantity'), 0)
-        ).order_by('-sum_of_item')[:10]
-
-        response_data = InventoryWithSumSerializer(items, many=True).data
-        return Response(response_data)
+        return Response(get_top_selling(request.query_params.dict()))
 
-class SaleByShopView(ModelViewSet):
+class SaleByShopView(ReadReplicaMixin, ModelViewSet):
     http_method_names = ('get',)
     permission_classes = [IsAuthenticatedCustom]
     queryset = InventoryView.queryset
 
+    @cache_response(Invoice, Shop)
     def list(self, request, *args, **kwargs):
-        query_data = request.query_params.dict()
-        total = query_data.get("total", None)
-        monthly = query_data.get("monthly", None)
-        query = ShopView.queryset
-
-        if not total:
-            start_date = query_data.get("start_date", None)
-            end_date = query_data.get("end_date", None)
-            if start_date:
-                query = query.filter(
-                sale_shop__created_at__range = [start_date, end_date]
-            )
+        return Response(get_sales_by_shop(request.query_params.dict()))
 
-        if monthly:
-            shops = query.annotate(month = TruncMonth('created_at')).values('month', 'name').annotate(
-                amount_total = sum(F("sale_shop__invoice_items__quantity") * 
-                                   F("sale_shop__invoice_items__amount")
-                                   )) 
-        else:
-            shops = query.annotate(
-                amount_total = sum(F("sale_shop__invoice_items__quantity") * 
-                                   F("sale_shop__invoice_items__amount")
-                                   )).order_by('-amount_total')
+class PurchaseView(ReadReplicaMixin, ModelViewSet):
+    http_method_names = ('get',)
+    permission_classes = (IsAuthenticatedCustom,)
+    queryset = InventoryView.queryset
 
-        response_data = ShopWithAmountSerializer(shops, many=True).data
-        return Response(response_data)
+    @cache_response(Invoice)
+    def list(self, request, *args, **kwargs):
+        return Response(get_purchase_summary(request.query_params.dict()))
 
-class PurchaseView(ModelViewSet):
+class DashboardView(ReadReplicaMixin, ModelViewSet):
+    # Everything the dashboard shows in one response: the summary counts and
+    # purchase totals in one statement, then the top sellers and the sales
+    # by shop, all read from the same snapshot. Takes the same query params
+    # as the endpoints it replaces.
     http_method_names = ('get',)
     permission_classes = (IsAuthenticatedCustom,)
     queryset = InventoryView.queryset
 
+    @cache_response(Inventory, InventoryGroup, Shop, CustomUser, Invoice)
     def list(self, request, *args, **kwargs):
         query_data = request.query_params.dict()
-        total = query_data.get("total", None)
-        query = InvoiceItem.objects.select_related("invoice", "item")
-
-        if not total:
-            start_date = query_data.get("start_date", None)
-            end_date = query_data.get("end_date", None)
-            if start_date:
-                query = query.filter(
-                created_at__range = [start_date, end_date]
+        sales = get_daily_sales(query_data)
+        using = router.db_for_read(DailySale)
+
+        with snapshot_transaction(using):
+            totals = select_scalars(using,
+                total_inventory=scalar_query(Inventory.objects.filter(remaining__gt=0), "COUNT"),
+                total_group=scalar_query(InventoryGroup.objects.all(), "COUNT"),
+                total_shop=scalar_query(Shop.objects.all(), "COUNT"),
+                total_user=scalar_query(CustomUser.objects.filter(is_superuser=False), "COUNT"),
+                amount_total=scalar_query(sales, "SUM", "amount"),
+                quantity_total=scalar_query(sales, "SUM", "quantity")
             )
 
-            query = query.aggregate(amount_total = sum(F("amount") *F("quantity")), total = Sum("quantity"))
+            top_selling = list(sales.filter(item__isnull=False).values(
+                "item_id", "item__code", "item__name", "item__price"
+            ).annotate(sum_of_item=Sum("quantity")).order_by("-sum_of_item")[:10])
+
+            sales_by_shop = sales.filter(shop__isnull=False)
+            if query_data.get("monthly", None):
+                sales_by_shop = sales_by_shop.annotate(month=TruncMonth("day")).values(
+                    "shop_id", "shop__name", "month"
+                ).annotate(amount_total=Sum("amount")).order_by("month", "-amount_total")
+            else:
+                sales_by_shop = sales_by_shop.values("shop_id", "shop__name").annotate(
+                    amount_total=Sum("amount")
+                ).order_by("-amount_total")
+            sales_by_shop = list(sales_by_shop)
 
         return Response({
-            "price": "0.00" if not query.get("amount_total") else query.get("amount_total"),
-            "count": 0 if not query.get("total") else query.get("total")
+            "summary": {
+                "total_inventory": totals["total_inventory"],
+                "total_group": totals["total_group"],
+                "total_shop": totals["total_shop"],
+                "total_user": totals["total_user"]
+            },
+            "purchase": {
+                "price": totals["amount_total"] or "0.00",
+                "count": totals["quantity_total"] or 0
+            },
+            "top_selling": [{
+                "id": sale["item_id"],
+                "code": sale["item__code"],
+                "name": sale["item__name"],
+                "price": sale["item__price"],
+                "sum_of_item": sale["sum_of_item"]
+            } for sale in top_selling],
+            "sale_by_shop": [{
+                "id": sale["shop_id"],
+                "name": sale["shop__name"],
+                "amount_total": sale["amount_total"],
+                **({"month": sale["month"]} if "month" in sale else {})
+            } for sale in sales_by_shop]
         })
 
 class InventoryCSVLoaderView(ModelViewSet):
@@ -228,35 +877,122 @@ class InventoryCSVLoaderView(ModelViewSet):
     serializer_class = InventorySerializer
     
 
+    chunk_size = 1000
+    csv_fields = ("group_id", "name", "total", "price", "photo")
+
     def create(self, request, *args, **kwargs):
         try:
             data = request.FILES['data']
         except Exception as e:
             raise Exception("You need to upload a csv file")
 
-        inventory_items = []
-
-        try: 
-            csv_reader = csv.reader(codecs.iterdecode(data, 'utf-8'))
-            for row in csv_reader:
-                if not row[0]:
-                    continue
-                inventory_items.append({
-                    "group_id":row[0],
-                    "name":row[1],
-                    "total":row[2],
-                    "price":row[3],
-                    "photo":row[4],
-                    "added_by_id":request.user.id
-                })
+        total_created = 0
+        errors = []
+
+        try:
+            for chunk in self.get_chunks(data):
+                created, chunk_errors = self.import_chunk(chunk, request.user)
+                total_created += created
+                errors.extend(chunk_errors)
         except csv.Error as e:
             raise Exception(e)
 
-        if not inventory_items:
+        if not total_created and not errors:
             raise Exception("No data found in the csv file")
-        
-        data_validation = self.serializer_class(data=inventory_items, many=True)
-        data_validation.is_valid(raise_exception=True)
-        data_validation.save()
 
-        return Response({"success": "Inventory items added successfully"})
+        if total_created:
+            add_user_activity(request.user, f"Imported {total_created} Inventory items from csv")
+
+        return Response({
+            "success": f"{total_created} Inventory items added successfully",
+            "created": total_created,
+            "errors": errors
+        })
+
+    def get_chunks(self, data):
+        chunk = []
+        csv_reader = csv.reader(codecs.iterdecode(data, 'utf-8'))
+        for row_number, row in enumerate(csv_reader, start=1):
+            if not row or not row[0]:
+                continue
+            chunk.append((row_number, dict(zip(self.csv_fields, row))))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def import_chunk(self, chunk, user):
+        valid_rows = []
+        errors = []
+
+        for row_number, row in chunk:
+            row_validation = InventoryCSVRowSerializer(data=row)
+            if row_validation.is_valid():
+                valid_rows.append((row_number, row_validation.validated_data))
+            else:
+                errors.append({"row": row_number, "errors": row_validation.errors})
+
+        groups = InventoryGroup.objects.in_bulk({row["group_id"] for _, row in valid_rows})
+
+        inventories = []
+        for row_number, row in valid_rows:
+            group_id = row.pop("group_id")
+            if group_id not in groups:
+                errors.append({"row": row_number, "errors": {"group_id": [f"Inventory group {group_id} does not exist"]}})
+                continue
+            inventories.append(Inventory(created_by=user, group=groups[group_id], **row))
+
+        if inventories:
+            with transaction.atomic():
+                bulk_create_inventories(inventories)
+
+        return len(inventories), sorted(errors, key=lambda error: error["row"])
+
+
+range_re = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+@require_safe
+def photo_view(request, photo_hash):
+    # Photos are immutable and named by content hash, so the hash doubles as
+    # a strong ETag and responses can be cached forever.
+    # Deliberately public: <img> tags cannot send the Bearer token, and the
+    # URL is a capability, a SHA-256 only handed out in authenticated API
+    # responses.
+    thumbnail = request.GET.get("thumbnail") == "true"
+    etag = f'"{photo_hash}-thumbnail"' if thumbnail else f'"{photo_hash}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable", "Accept-Ranges": "bytes"}
+
+    if etag in request.headers.get("If-None-Match", ""):
+        return HttpResponseNotModified(headers=headers)
+
+    photo = open_photo(photo_hash, thumbnail)
+    if photo is None:
+        raise Http404("Photo not found")
+
+    size = photo.size
+    content_type = guess_content_type(photo.read(16))
+    photo.seek(0)
+
+    match = range_re.match(request.headers.get("Range", ""))
+    if not match or not any(match.groups()):
+        return FileResponse(photo, content_type=content_type, headers=headers)
+
+    start, end = match.groups()
+    if not start:
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+
+    if start > end or start >= size:
+        photo.close()
+        return HttpResponse(status=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    photo.seek(start)
+    content = photo.read(end - start + 1)
+    photo.close()
+    return HttpResponse(content, status=206, content_type=content_type, headers={
+        **headers, "Content-Range": f"bytes {start}-{end}/{size}"
+    })
+
@@ -0,0 +1,209 @@
+import functools
+import hashlib
+import threading
+import time
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+
+_config = getattr(settings, "RESPONSE_CACHE", {})
+_conditional_config = getattr(settings, "CONDITIONAL_GET", {})
+_key_locks = [threading.Lock() for _ in range(64)]
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def get_version_key(model):
+    return f"model-version:{model._meta.label_lower}"
+
+
+def get_modified_key(model):
+    return f"model-modified:{model._meta.label_lower}"
+
+
+def get_cache_versions(models):
+    keys = [get_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # A missing counter starts from the clock so it can never
+            # repeat a version an evicted counter handed out before.
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def get_last_modified(models):
+    # When any of the models was last written. Like a missing version, a
+    # missing time starts from now, which is never earlier than the truth.
+    keys = [get_modified_key(model) for model in models]
+    modified = cache.get_many(keys)
+    for key in keys:
+        if key not in modified:
+            cache.add(key, time.time(), timeout=None)
+            modified[key] = cache.get(key)
+    return max(modified.values())
+
+
+def bump_cache_version(*models):
+    def bump():
+        for model in models:
+            key = get_version_key(model)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, time.time_ns(), timeout=None)
+            cache.set(get_modified_key(model), time.time(), timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def invalidate_model_cache(sender, **kwargs):
+    bump_cache_version(sender)
+
+
+def get_cache_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def count(stat):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def get_key_lock(key):
+    return _key_locks[hash(key) % len(_key_locks)]
+
+
+def get_or_compute(key, compute, timeout):
+    # Single-flight: within a process a lock per key lets one request compute
+    # while the others wait for its result; across processes a short-lived
+    # cache lock does the same, with waiters falling back to computing if the
+    # value does not show up in time.
+    value = cache.get(key)
+    if value is not None:
+        count("hits")
+        return value, True
+
+    with get_key_lock(key):
+        value = cache.get(key)
+        if value is not None:
+            count("hits")
+            return value, True
+
+        lock_key = f"{key}:lock"
+        lock_timeout = _config.get("LOCK_TIMEOUT", 10)
+        if not cache.add(lock_key, 1, timeout=lock_timeout):
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                value = cache.get(key)
+                if value is not None:
+                    count("hits")
+                    return value, True
+
+        count("misses")
+        try:
+            value = compute()
+            cache.set(key, value, timeout=timeout)
+        finally:
+            cache.delete(lock_key)
+        return value, False
+
+
+def get_response_cache_key(request, models):
+    params = "&".join(f"{key}={value}" for key, value in sorted(request.GET.items()))
+    versions = ".".join(str(version) for version in get_cache_versions(models))
+    return f"response:{request.path}?{params}:{versions}"
+
+
+def cache_response(*models, timeout=None):
+    # Caches the data of a read-only view method. The key is built from the
+    # path, the query params and the current version of every model the
+    # response depends on, so any write to those models retires the entry.
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if not _config.get("ENABLED", True):
+                return method(self, request, *args, **kwargs)
+
+            key = get_response_cache_key(request, models)
+
+            def compute():
+                response = method(self, request, *args, **kwargs)
+                return response.status_code, response.data
+
+            (status_code, data), hit = get_or_compute(key, compute, timeout or _config.get("TIMEOUT", 60))
+            response = Response(data, status=status_code)
+            response["X-Cache"] = "HIT" if hit else "MISS"
+            return response
+        return wrapper
+    return decorator
+
+
+def async_cache_response(*models, timeout=None):
+    # cache_response for async views returning plain data. The single-flight
+    # wait blocks, so it runs in a worker thread and hands the computation
+    # back to the event loop.
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if not _config.get("ENABLED", True):
+                return await view(request, *args, **kwargs)
+
+            key = await sync_to_async(get_response_cache_key)(request, models)
+            compute = async_to_sync(functools.partial(view, request, *args, **kwargs))
+            data, hit = await sync_to_async(get_or_compute, thread_sensitive=False)(
+                key, compute, timeout or _config.get("TIMEOUT", 60)
+            )
+            request.cache_hit = hit
+            return data
+        return wrapper
+    return decorator
+
+
+class ConditionalGetMixin:
+    # Answers list and detail requests with 304 Not Modified while none of
+    # conditional_models was written since the client's copy. The ETag and
+    # Last-Modified come from the model versions in the cache and are checked
+    # before any query runs, so a poll that finds nothing new never reaches
+    # the database. Versions are read before the data, so a response is
+    # never tagged with a version newer than what it shows.
+    conditional_models = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_conditional_response(self, method, request, *args, **kwargs):
+        if not _conditional_config.get("ENABLED", False) or request.method not in ("GET", "HEAD"):
+            return method(request, *args, **kwargs)
+
+        params = "&".join(f"{key}={value}" for key, values in sorted(request.GET.lists()) for value in values)
+        versions = ".".join(str(version) for version in get_cache_versions(self.conditional_models))
+        etag = quote_etag(hashlib.sha1(
+            f"{request.path}?{params}:{request.accepted_renderer.format}:{versions}".encode()
+        ).hexdigest())
+        # HTTP dates have whole seconds: within the second of the last write
+        # another write could still share its date, so only the ETag is sent.
+        modified = get_last_modified(self.conditional_models)
+        last_modified = int(modified) if time.time() - modified >= 1 else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = method(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response["ETag"] = etag
+            if last_modified is not None:
+                response["Last-Modified"] = http_date(last_modified)
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ("Accept", "Authorization"))
+        return response
@@ -1,10 +1,10 @@
 from rest_framework.permissions import BasePermission
-from .utils import decodeJWT
+from .utils import decodeJWT, adecodeJWT
 class IsAuthenticatedCustom(BasePermission):
 
     def has_permission(self, request, _):
         try:
-            auth_token = request.Meta.get("HTTP_AUTHORIZATION", None)
+            auth_token = request.META.get("HTTP_AUTHORIZATION", None)
         except Exception:
             return False
             
@@ -19,4 +19,16 @@ class IsAuthenticatedCustom(BasePermission):
         request.user = user
         return True
 
-    
\ No newline at end of file
+    async def has_permission_async(self, request):
+        # For the async views, which DRF does not dispatch.
+        auth_token = request.META.get("HTTP_AUTHORIZATION", None)
+        if not auth_token:
+            return False
+
+        user = await adecodeJWT(auth_token)
+
+        if not user:
+            return False
+
+        request.user = user
+        return True
@@ -0,0 +1,48 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+
+
+REPLICA_ALIAS = "replica"
+
+_read_from_replica = ContextVar("read_from_replica", default=False)
+
+
+@contextmanager
+def read_from_replica():
+    # Reads made inside go to the replica when one is configured. Only for
+    # read-only endpoints that can live with replication lag.
+    token = _read_from_replica.set(True)
+    try:
+        yield
+    finally:
+        _read_from_replica.reset(token)
+
+
+class ReadReplicaMixin:
+    # For viewsets whose every request can be served from the replica.
+    def dispatch(self, request, *args, **kwargs):
+        with read_from_replica():
+            return super().dispatch(request, *args, **kwargs)
+
+
+class ReadReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if _read_from_replica.get() and REPLICA_ALIAS in settings.DATABASES:
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Instances read from the replica would otherwise be written back to it.
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica copies default through replication, so nothing is
+        # migrated on it directly.
+        if db == REPLICA_ALIAS:
+            return False
+        return None
@@ -0,0 +1,186 @@
+from collections import namedtuple
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.relations import PrimaryKeyRelatedField
+
+
+class Fieldset(namedtuple("Fieldset", ("fields", "expand"))):
+    # fields: the names to keep, or None for all of them. expand: (name,
+    # Fieldset) pairs of the relations rendered in full; every other relation
+    # is rendered as its id, or list of ids.
+
+    def get_expanded(self, name):
+        return dict(self.expand).get(name)
+
+
+def parse_fieldset(query_params):
+    # ?fields=id,name,shop&expand=shop,shop.created_by. Expanded relations are
+    # kept even when fields does not list them. None when the request has
+    # neither parameter, which keeps the full default representation.
+    if "fields" not in query_params and "expand" not in query_params:
+        return None
+
+    tree = {}
+    for path in query_params.get("expand", "").split(","):
+        node = tree
+        for name in path.strip().split("."):
+            if name:
+                node = node.setdefault(name, {})
+
+    fields = {name.strip() for name in query_params.get("fields", "").split(",") if name.strip()}
+    return Fieldset(frozenset(fields | tree.keys()) if fields else None, freeze_expand(tree))
+
+
+def freeze_expand(tree):
+    return tuple(sorted((name, Fieldset(None, freeze_expand(children))) for name, children in tree.items()))
+
+
+def get_relation(model, name, field):
+    # The model relation a serializer field renders, if any.
+    source = name if field.source == "*" else field.source
+    if model is None or "." in source:
+        return None
+    try:
+        model_field = model._meta.get_field(source)
+    except FieldDoesNotExist:
+        return None
+    # A source naming the id column, e.g. item_id, reads no related row.
+    return model_field if model_field.is_relation and model_field.name == source else None
+
+
+def is_nested(field):
+    return isinstance(field, (serializers.BaseSerializer, serializers.SerializerMethodField))
+
+
+def apply_fieldset(serializer, fieldset):
+    # Trims the fields of a (child) serializer in place: fields not selected
+    # are dropped, nested relations not expanded become primary key fields
+    # and expanded ones are trimmed in turn with their part of the fieldset.
+    model = getattr(getattr(serializer, "Meta", None), "model", None)
+    fields = serializer.fields
+
+    for name, field in list(fields.items()):
+        if fieldset.fields is not None and name not in fieldset.fields:
+            fields.pop(name)
+            continue
+
+        relation = get_relation(model, name, field)
+        if relation is None or not is_nested(field):
+            continue
+
+        expanded = fieldset.get_expanded(name)
+        if expanded is None:
+            source = name if field.source == "*" else field.source
+            fields[name] = PrimaryKeyRelatedField(
+                read_only=True, many=relation.many_to_many or relation.one_to_many,
+                **({"source": source} if source != name else {})
+            )
+        elif isinstance(field, serializers.BaseSerializer):
+            apply_fieldset(getattr(field, "child", field), expanded)
+    return serializer
+
+
+def plan_relations(serializer, model, prefix, select_related, prefetch_related, many=False):
+    for name, field in serializer.fields.items():
+        relation = get_relation(model, name, field)
+        if field.write_only or relation is None:
+            continue
+
+        path = f"{prefix}{relation.name if field.source == '*' else field.source}"
+        if relation.many_to_many or relation.one_to_many:
+            prefetch_related.append(path)
+            if isinstance(field, serializers.ListSerializer):
+                plan_relations(field.child, relation.related_model, f"{path}__", select_related,
+                               prefetch_related, many=True)
+        elif not isinstance(field, PrimaryKeyRelatedField):
+            # Nested, or rendered from the related instance, e.g. with str().
+            (prefetch_related if many else select_related).append(path)
+            if isinstance(field, serializers.BaseSerializer):
+                plan_relations(field, relation.related_model, f"{path}__", select_related, prefetch_related, many)
+
+
+def get_columns(serializer, queryset):
+    # The columns the top level fields read, or None when a field may read
+    # any of them (a method field or a property).
+    model = queryset.model
+    columns = {model._meta.pk.name}
+    if any(field.name == "created_at" for field in model._meta.concrete_fields):
+        # Read by keyset pagination for its cursor.
+        columns.add("created_at")
+
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if field.source == "*":
+            # Reads the whole instance, unless it renders a relation.
+            relation = get_relation(model, name, field)
+            if relation is None:
+                return None
+            if relation.concrete:
+                columns.add(relation.name)
+            continue
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            if "." in field.source or hasattr(model, field.source):
+                return None
+            # An annotation, or a field the serializer skips when missing.
+            continue
+        if model_field.concrete:
+            columns.add(model_field.name)
+    return columns
+
+
+def get_fieldset_queryset(queryset, serializer, extra_columns=()):
+    # Loads what a trimmed serializer renders and nothing else: only() its
+    # columns, select_related for the relations it renders in full, and
+    # prefetch_related for its many relations. Prefetch objects the view
+    # set up for a kept relation are kept, with their ordering.
+    select_related, prefetch_related = [], []
+    plan_relations(serializer, queryset.model, "", select_related, prefetch_related)
+
+    kept = [
+        lookup for lookup in queryset._prefetch_related_lookups
+        if isinstance(lookup, Prefetch) and lookup.prefetch_to in prefetch_related
+    ]
+    lookups = kept + [path for path in prefetch_related if path not in {lookup.prefetch_to for lookup in kept}]
+
+    queryset = queryset.select_related(None).prefetch_related(None)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if lookups:
+        queryset = queryset.prefetch_related(*lookups)
+
+    columns = get_columns(serializer, queryset)
+    if columns is not None:
+        queryset = queryset.only(*columns, *extra_columns)
+    return queryset
+
+
+class FieldsetMixin:
+    # Lets read requests pick their fields with ?fields= and the relations
+    # rendered in full with ?expand= (see parse_fieldset), and reads only the
+    # columns and relations the response needs.
+    # Columns read by the view or the list serializer besides the fields.
+    fieldset_columns = ()
+
+    def get_fieldset(self):
+        if self.request is None or self.request.method not in ("GET", "HEAD"):
+            return None
+        if not hasattr(self, "_fieldset"):
+            self._fieldset = parse_fieldset(self.request.query_params)
+        return self._fieldset
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        fieldset = self.get_fieldset()
+        if fieldset is not None:
+            apply_fieldset(getattr(serializer, "child", serializer), fieldset)
+        return serializer
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.get_fieldset() is None:
+            return queryset
+        return get_fieldset_queryset(queryset, self.get_serializer(), self.fieldset_columns)
@@ -0,0 +1,293 @@
+import cProfile
+import functools
+import os
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils import timezone
+from rest_framework.serializers import BaseSerializer
+from .caching import get_cache_stats
+from .utils import decodeJWT
+
+
+_config = getattr(settings, "INSTRUMENTATION", {})
+_current = ContextVar("request_metrics", default=None)
+
+duration_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class RequestMetrics:
+    # What one sampled request spent its time on. Queries are keyed on their
+    # SQL without parameters, so the same statement run again and again for
+    # different rows (an N+1) shows up as a duplicate.
+
+    def __init__(self):
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.queries = Counter()
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    @property
+    def duplicate_count(self):
+        return sum(count - 1 for count in self.queries.values() if count > 1)
+
+    @property
+    def most_repeated(self):
+        return max(self.queries.values(), default=0)
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - started
+        metrics.queries[sql] += 1
+
+
+def install_query_recorder(connection, **kwargs):
+    # Installed on every connection once; it only records while a sampled
+    # request is running in the same context, including the worker threads
+    # the async views hand their queries to.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install_serializer_timer():
+    # Times the outermost .data of each serializer, which is where DRF turns
+    # instances into primitives (and where lazy relations get loaded).
+    data = BaseSerializer.data
+    if getattr(data.fget, "instrumented", False):
+        return
+
+    @functools.wraps(data.fget)
+    def timed_data(self):
+        metrics = _current.get()
+        if metrics is None:
+            return data.fget(self)
+
+        metrics.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return data.fget(self)
+        finally:
+            metrics.serializer_depth -= 1
+            if not metrics.serializer_depth:
+                metrics.serializer_time += time.perf_counter() - started
+
+    timed_data.instrumented = True
+    BaseSerializer.data = property(timed_data)
+
+
+class MetricsRegistry:
+    # Per process totals, exposed in the Prometheus text format. Every request
+    # is counted; the query and serializer figures come from sampled ones.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.durations = defaultdict(lambda: [0] * (len(duration_buckets) + 1))
+        self.duration_sums = Counter()
+        self.response_bytes = Counter()
+        self.sampled = Counter()
+        self.db_time = Counter()
+        self.queries = Counter()
+        self.duplicate_queries = Counter()
+        self.n_plus_one = Counter()
+        self.serializer_time = Counter()
+
+    def observe(self, route, method, status, duration, size, metrics=None):
+        with self.lock:
+            self.requests[(route, method, str(status))] += 1
+            buckets = self.durations[route]
+            for index, bound in enumerate(duration_buckets):
+                if duration <= bound:
+                    buckets[index] += 1
+            buckets[-1] += 1
+            self.duration_sums[route] += duration
+            if size is not None:
+                self.response_bytes[route] += size
+
+            if metrics is not None:
+                self.sampled[route] += 1
+                self.db_time[route] += metrics.db_time
+                self.queries[route] += metrics.query_count
+                self.duplicate_queries[route] += metrics.duplicate_count
+                self.serializer_time[route] += metrics.serializer_time
+                if metrics.most_repeated >= _config.get("N_PLUS_ONE_THRESHOLD", 5):
+                    self.n_plus_one[route] += 1
+
+    def render(self):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{escape(value)}"' for key, value in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        with self.lock:
+            metric("http_requests_total", "counter", "Requests handled, by route, method and status.", [
+                ({"route": route, "method": method, "status": status}, count)
+                for (route, method, status), count in sorted(self.requests.items())
+            ])
+
+            duration_samples = []
+            for route, buckets in sorted(self.durations.items()):
+                for bound, count in zip(duration_buckets, buckets):
+                    duration_samples.append(({"route": route, "le": str(bound)}, count))
+                duration_samples.append(({"route": route, "le": "+Inf"}, buckets[-1]))
+            lines.append("# HELP http_request_duration_seconds Wall time of requests, by route.")
+            lines.append("# TYPE http_request_duration_seconds histogram")
+            for labels, value in duration_samples:
+                lines.append(f'http_request_duration_seconds_bucket{{route="{escape(labels["route"])}",le="{labels["le"]}"}} {value}')
+            for route, total in sorted(self.duration_sums.items()):
+                lines.append(f'http_request_duration_seconds_sum{{route="{escape(route)}"}} {total}')
+                lines.append(f'http_request_duration_seconds_count{{route="{escape(route)}"}} {self.durations[route][-1]}')
+
+            for name, kind, help_text, values in (
+                ("http_response_size_bytes_total", "counter", "Bytes of non streaming response bodies.", self.response_bytes),
+                ("http_sampled_requests_total", "counter", "Requests whose queries and serializers were measured.", self.sampled),
+                ("http_db_seconds_total", "counter", "Time spent in database queries by sampled requests.", self.db_time),
+                ("http_db_queries_total", "counter", "Queries run by sampled requests.", self.queries),
+                ("http_db_duplicate_queries_total", "counter", "Queries repeating an earlier statement of the same sampled request.", self.duplicate_queries),
+                ("http_n_plus_one_requests_total", "counter", "Sampled requests that repeated one statement at least N_PLUS_ONE_THRESHOLD times.", self.n_plus_one),
+                ("http_serializer_seconds_total", "counter", "Time spent in serializers by sampled requests.", self.serializer_time),
+            ):
+                metric(name, kind, help_text, [({"route": route}, value) for route, value in sorted(values.items())])
+
+        cache_stats = get_cache_stats()
+        metric("response_cache_hits_total", "counter", "Cached dashboard responses served.", [({}, cache_stats["hits"])])
+        metric("response_cache_misses_total", "counter", "Dashboard responses computed.", [({}, cache_stats["misses"])])
+
+        from user_control.activity import get_activity_writer
+        activity_stats = get_activity_writer().stats()
+        metric("activity_log_queued", "gauge", "Activities waiting to be written.", [({}, activity_stats["queued"])])
+        metric("activity_log_flushed_total", "counter", "Activities written.", [({}, activity_stats["flushed"])])
+        metric("activity_log_dropped_total", "counter", "Activities dropped.", [({}, activity_stats["dropped"])])
+
+        return "\n".join(lines) + "\n"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
+
+
+class InstrumentationMiddleware:
+    # Records wall time, status and response size of every request per
+    # route, and for a SAMPLE_RATE share of them the database time, query
+    # count, duplicate queries and serializer time as well. Sampled requests
+    # can carry a Server-Timing header, and a PROFILE_SAMPLE_RATE share of
+    # them run under cProfile, with the stats of those slower than
+    # PROFILE_SLOW_MS dumped to PROFILE_DIR.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.asynchronous = iscoroutinefunction(get_response)
+        if self.asynchronous:
+            markcoroutinefunction(self)
+
+        # The query recorder and serializer timer patch every connection and
+        # serializer of the process, so they are only installed when enabled.
+        if not _config.get("ENABLED", True):
+            raise MiddlewareNotUsed()
+        connection_created.connect(install_query_recorder)
+        for connection in connections.all():
+            install_query_recorder(connection)
+        install_serializer_timer()
+
+    def __call__(self, request):
+        if self.asynchronous:
+            return self.__acall__(request)
+
+        profiler = self.start(request)
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        finally:
+            metrics = _current.get()
+            _current.set(None)
+        return self.finish(request, response, started, metrics, profiler)
+
+    async def __acall__(self, request):
+        # cProfile follows one thread, so async requests are not profiled.
+        self.start(request, profile=False)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics = _current.get()
+            _current.set(None)
+        return self.finish(request, response, started, metrics, None)
+
+    def start(self, request, profile=True):
+        if random.random() >= _config.get("SAMPLE_RATE", 0.1):
+            _current.set(None)
+            return None
+
+        _current.set(RequestMetrics())
+        if profile and _config.get("PROFILE_SLOW_MS") and random.random() < _config.get("PROFILE_SAMPLE_RATE", 0.01):
+            return cProfile.Profile()
+        return None
+
+    def finish(self, request, response, started, metrics, profiler):
+        duration = time.perf_counter() - started
+        match = getattr(request, "resolver_match", None)
+        route = match.url_name if match and match.url_name else "unmatched"
+        size = None if response.streaming else len(response.content)
+
+        registry.observe(route, request.method, response.status_code, duration, size, metrics)
+
+        if metrics is not None and _config.get("SERVER_TIMING", False):
+            response["Server-Timing"] = ", ".join((
+                f"total;dur={duration * 1000:.1f}",
+                f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.query_count} queries, {metrics.duplicate_count} duplicates"',
+                f"serializer;dur={metrics.serializer_time * 1000:.1f}",
+            ))
+
+        if profiler is not None and duration * 1000 >= _config["PROFILE_SLOW_MS"]:
+            self.dump_profile(profiler, route)
+        return response
+
+    def dump_profile(self, profiler, route):
+        directory = _config.get("PROFILE_DIR") or os.path.join(settings.BASE_DIR, "profiles")
+        os.makedirs(directory, exist_ok=True)
+        name = f"{route}-{timezone.now().strftime('%Y%m%dT%H%M%S%f')}.prof"
+        profiler.dump_stats(os.path.join(directory, name))
+
+
+def metrics_view(request):
+    # Open to scrapers sending METRICS_TOKEN as a bearer token, and to staff
+    # users with their own access token.
+    bearer = request.headers.get("Authorization")
+    token = _config.get("METRICS_TOKEN")
+    if not (token and bearer == f"Bearer {token}"):
+        user = decodeJWT(bearer)
+        if user is None or not user.is_staff:
+            return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,233 @@
+from collections import defaultdict
+from django.db import models
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from .fieldsets import FieldsetMixin, apply_fieldset, is_nested
+from .renderers import ORJSONRenderer
+
+
+# Serializer to_representation methods that return the value unchanged when
+# it comes from one of these model fields, so projections skip the call.
+identity_conversions = {
+    serializers.CharField.to_representation: (models.CharField, models.TextField),
+    serializers.IntegerField.to_representation: (models.IntegerField,),
+    serializers.BooleanField.to_representation: (models.BooleanField,),
+    serializers.FloatField.to_representation: (models.FloatField,),
+}
+
+
+class ProjectionLoader:
+    # Loads and renders the nested rows of one response, each at most once
+    # and in one query per projection and level, however often they repeat.
+
+    def __init__(self):
+        self.rows = defaultdict(dict)
+        self.rendered = defaultdict(dict)
+
+    def by_id(self, projection, ids):
+        rendered = self.rendered[projection]
+        missing = {row_id for row_id in ids if row_id is not None and row_id not in rendered}
+        if missing:
+            rows = self.rows[projection]
+            fetch_ids = missing - rows.keys()
+            if fetch_ids:
+                fetched = list(projection.fetch(fetch_ids))
+                for row in fetched:
+                    rows[row["id"]] = row
+                projection.prefetch(fetched, self)
+            to_render = [rows[row_id] for row_id in missing if row_id in rows]
+            for row, data in zip(to_render, projection.render(to_render, self)):
+                rendered[row["id"]] = data
+        return rendered
+
+    def children(self, projection, column, ids):
+        rows = list(projection.model.objects.filter(**{f"{column}__in": ids}).order_by(
+            *projection.ordering
+        ).values(*dict.fromkeys([*projection.columns, column])))
+        children = defaultdict(list)
+        for row, data in zip(rows, projection.render(rows, self)):
+            children[row[column]].append(data)
+        return children
+
+    def related_ids(self, field, ordering, ids):
+        column = field.field.attname
+        related = defaultdict(list)
+        for source_id, target_id in field.related_model.objects.filter(**{f"{column}__in": ids}).order_by(
+            *ordering
+        ).values_list(column, "id"):
+            related[source_id].append(target_id)
+        return related
+
+    def many_to_many(self, field, ids):
+        through = field.remote_field.through
+        source, target = f"{field.m2m_field_name()}_id", f"{field.m2m_reverse_field_name()}_id"
+        related = defaultdict(list)
+        for source_id, target_id in through.objects.filter(**{f"{source}__in": ids}).order_by(
+            "id"
+        ).values_list(source, target):
+            related[source_id].append(target_id)
+        return related
+
+
+class Projection:
+    # Builds the same dicts as serializer_class from .values() rows, without
+    # model instances or per field serializer calls. Fields are compiled once
+    # from the serializer, in its order:
+    #   - model fields and relation ids become columns, converted with the
+    #     serializer field's to_representation when it changes the value
+    #   - nested serializers listed in nested are rendered by their own
+    #     projection ("self" for this one), in one query per page
+    #   - many to many fields and reverse relations rendered as ids become
+    #     lists of ids, in one query per page
+    #   - get_<field> methods compute a field from the row, reading the
+    #     columns listed for it in method_columns
+    #   - other optional read only fields are left out, like the serializer
+    #     does when the queryset has not annotated them
+    # A ?fields= / ?expand= fieldset compiles its own projection from the
+    # serializer trimmed by it.
+    serializer_class = None
+    nested = {}
+    method_columns = {}
+    extra_columns = ()
+    # Order of the rows when rendered as the many side of a nested field.
+    ordering = ()
+
+    _compiled = None
+    max_compiled = 256
+
+    @classmethod
+    def get(cls, fieldset=None):
+        if cls.__dict__.get("_compiled") is None:
+            cls._compiled = {}
+        compiled = cls._compiled.get(fieldset)
+        if compiled is None:
+            if len(cls._compiled) >= cls.max_compiled:
+                cls._compiled.clear()
+            compiled = cls._compiled[fieldset] = cls(fieldset)
+        return compiled
+
+    def __init__(self, fieldset=None):
+        serializer = self.serializer_class()
+        if fieldset is not None:
+            apply_fieldset(serializer, fieldset)
+        self.model = serializer.Meta.model
+        self.fields = []
+        columns = ["id", *self.extra_columns]
+        if any(field.name == "created_at" for field in self.model._meta.concrete_fields):
+            # Read by keyset pagination for its cursor.
+            columns.append("created_at")
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            source = name if field.source == "*" else field.source
+
+            if name in self.nested and is_nested(field):
+                projection = self.nested[name]
+                # The method field of a "self" projection renders in full.
+                projection = (type(self), None) if projection == "self" else (
+                    projection, None if fieldset is None else fieldset.get_expanded(name)
+                )
+                if isinstance(field, serializers.ListSerializer):
+                    column = self.model._meta.get_field(source).field.attname
+                    self.fields.append((name, "many", (projection, column)))
+                else:
+                    column = self.model._meta.get_field(source).attname
+                    self.fields.append((name, "nested", (projection, column)))
+                    columns.append(column)
+            elif hasattr(self, f"get_{name}"):
+                self.fields.append((name, "method", getattr(self, f"get_{name}")))
+                columns.extend(self.method_columns.get(name, ()))
+            elif isinstance(field, ManyRelatedField):
+                model_field = self.model._meta.get_field(source)
+                if model_field.many_to_many:
+                    self.fields.append((name, "many_to_many", model_field))
+                else:
+                    nested = self.nested.get(name)
+                    ordering = nested.ordering if nested else (*model_field.related_model._meta.ordering, "id")
+                    self.fields.append((name, "related_ids", (model_field, ordering)))
+            elif isinstance(field, PrimaryKeyRelatedField):
+                column = self.model._meta.get_field(source).attname
+                self.fields.append((name, "column", (column, None)))
+                columns.append(column)
+            elif source in {model_field.name for model_field in self.model._meta.concrete_fields}:
+                model_field = self.model._meta.get_field(source)
+                identity = isinstance(model_field, identity_conversions.get(type(field).to_representation, ()))
+                self.fields.append((name, "column", (source, None if identity else field.to_representation)))
+                columns.append(source)
+            elif not field.required:
+                continue
+            else:
+                raise Exception(f"{type(self).__name__} cannot project the {name} field")
+
+        self.columns = list(dict.fromkeys(columns))
+
+    def fetch(self, ids):
+        return self.model.objects.filter(id__in=ids).order_by().values(*self.columns)
+
+    def prefetch(self, rows, loader):
+        # Loads what rows fetched ahead of being rendered, such as ancestors
+        # read along with groups, nest from other projections, together with
+        # the rows rendered now.
+        for name, kind, payload in self.fields:
+            (projection, fieldset), column = payload if kind == "nested" else ((None, None), None)
+            if projection is not None and projection is not type(self):
+                loader.by_id(projection.get(fieldset), {row[column] for row in rows})
+
+    def values(self, queryset):
+        return queryset.values(*self.columns)
+
+    def render(self, rows, loader=None):
+        loader = loader or ProjectionLoader()
+        related = {}
+        for name, kind, payload in self.fields:
+            if kind == "nested":
+                (projection, fieldset), column = payload
+                related[name] = loader.by_id(projection.get(fieldset), {row[column] for row in rows})
+            elif kind == "many":
+                (projection, fieldset), column = payload
+                related[name] = loader.children(projection.get(fieldset), column, [row["id"] for row in rows])
+            elif kind == "related_ids":
+                related[name] = loader.related_ids(*payload, [row["id"] for row in rows])
+            elif kind == "many_to_many":
+                related[name] = loader.many_to_many(payload, [row["id"] for row in rows])
+
+        mappers = []
+        for name, kind, payload in self.fields:
+            mappers.append((name, self.get_mapper(kind, payload, related.get(name))))
+
+        return [{name: mapper(row) for name, mapper in mappers} for row in rows]
+
+    def get_mapper(self, kind, payload, related):
+        if kind == "column":
+            column, convert = payload
+            if convert is None:
+                return lambda row: row[column]
+            return lambda row: None if row[column] is None else convert(row[column])
+        if kind == "nested":
+            column = payload[1]
+            return lambda row: related.get(row[column])
+        if kind in ("many", "related_ids", "many_to_many"):
+            return lambda row: related.get(row["id"], [])
+        return payload
+
+
+class ProjectionListMixin(FieldsetMixin):
+    # Lists through projection_class instead of the serializer: the page is
+    # read with .values() and rendered by orjson, with the same output.
+    projection_class = None
+    renderer_classes = (ORJSONRenderer, BrowsableAPIRenderer)
+
+    def list(self, request, *args, **kwargs):
+        if self.projection_class is None:
+            return super().list(request, *args, **kwargs)
+
+        projection = self.projection_class.get(self.get_fieldset())
+        rows = projection.values(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(projection.render(page))
+        return Response(projection.render(list(rows)))
@@ -0,0 +1,39 @@
+import re
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# orjson writes floats below 1e-4 or from 1e16 up as e.g. 0.00001 and 1e16
+# where json writes 1e-05 and 1e+16. Output with a number that may be one of
+# them is rendered again by JSONRenderer.
+float_exponent_re = re.compile(rb"[:,\[]-?(?:[0-9]+(?:\.[0-9]+)?e|0\.0000)")
+
+
+class ORJSONRenderer(JSONRenderer):
+    # Renders the same bytes as JSONRenderer, encoded by orjson when it is
+    # installed. Dates and types orjson does not know go through DRF's
+    # encoder; indented output and anything orjson cannot encode, e.g.
+    # integers wider than 64 bits, fall back to JSONRenderer.
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data, default=self.encoder_class().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+            )
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if float_exponent_re.search(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Same escaping of the two JavaScript line terminators as JSONRenderer.
+        return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'inventory_api.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,6 +79,16 @@ WSGI_APPLICATION = 'inventory_api.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
+# DB_POOL_MODE decides how connections are reused:
+# - persistent: every worker keeps its connection for DB_CONN_MAX_AGE
+#   seconds and checks it is still alive before reusing it.
+# - pgbouncer: as persistent, but behind a pgbouncer in transaction pooling
+#   mode, which cannot keep server-side cursors open across transactions.
+# - none: a new connection for every request.
+# Setting DB_REPLICA_HOST adds a "replica" alias that the read-only
+# analytics endpoints read from.
+
+DB_POOL_MODE = config('DB_POOL_MODE', default='persistent')
 
 DATABASES = {
     'default': {
@@ -87,9 +98,108 @@ DATABASES = {
         'PASSWORD':config('DB_PASSWORD'),
         'HOST':config('DB_HOST'),
         'PORT':config('DB_PORT'),
+        'CONN_MAX_AGE': 0 if DB_POOL_MODE == 'none' else config('DB_CONN_MAX_AGE', default=60, cast=int),
+        'CONN_HEALTH_CHECKS': DB_POOL_MODE != 'none',
+        'DISABLE_SERVER_SIDE_CURSORS': DB_POOL_MODE == 'pgbouncer',
+    }
+}
+
+if config('DB_REPLICA_HOST', default=''):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': config('DB_REPLICA_HOST'),
+        'PORT': config('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['inventory_api.db_routers.ReadReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='inventory-api'),
     }
 }
 
+# Dashboard responses are cached for TIMEOUT seconds and retired early when
+# any model they depend on is written.
+
+RESPONSE_CACHE = {
+    'ENABLED': config('RESPONSE_CACHE_ENABLED', default=True, cast=bool),
+    'TIMEOUT': 60,
+    'LOCK_TIMEOUT': 10,
+}
+
+
+# Conditional GET
+# List and detail GETs of inventory, groups and shops answer 304 Not Modified
+# from the model versions above. Every worker has to see every version bump,
+# so it is off by default with the per process LocMemCache.
+
+CONDITIONAL_GET = {
+    'ENABLED': config('CONDITIONAL_GET_ENABLED', default='LocMemCache' not in CACHES['default']['BACKEND'], cast=bool),
+}
+
+
+# Sync
+# /app/sync sends at most PAGE_SIZE rows per model and page, and restarts
+# LAG_SECONDS before the previous sync began to catch rows committed late.
+# Tombstones of deleted rows are kept TOMBSTONE_DAYS (prune_tombstones);
+# clients with an older watermark have to download everything again.
+
+SYNC = {
+    'PAGE_SIZE': config('SYNC_PAGE_SIZE', default=500, cast=int),
+    'LAG_SECONDS': config('SYNC_LAG_SECONDS', default=60, cast=int),
+    'TOMBSTONE_DAYS': config('SYNC_TOMBSTONE_DAYS', default=30, cast=int),
+}
+
+
+# User activity log
+# Activities are queued and written in batches by a background thread when
+# ASYNC is on; with ASYNC off every activity is saved as it happens.
+
+USER_ACTIVITY_LOG = {
+    'ASYNC': config('ACTIVITY_LOG_ASYNC', default=True, cast=bool),
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_QUEUE_SIZE': 10000,
+}
+
+
+# JWT authentication cache
+# Users are cached per process for USER_TTL seconds after their token is
+# verified; saving or deleting a user evicts it right away.
+
+JWT_AUTH_CACHE = {
+    'USER_TTL': 60,
+    'USER_CACHE_SIZE': 1024,
+    'TOKEN_CACHE_SIZE': 4096,
+}
+
+
+# Instrumentation
+# Every request is counted per route on /metrics; a SAMPLE_RATE share also
+# has its queries and serializers timed, with a Server-Timing header when
+# SERVER_TIMING is on. Set PROFILE_SLOW_MS above 0 to run a PROFILE_SAMPLE_RATE share
+# of the sampled requests under cProfile and keep the slow ones' stats.
+# /metrics answers staff users, and scrapers sending METRICS_TOKEN as a
+# bearer token.
+
+INSTRUMENTATION = {
+    'ENABLED': config('INSTRUMENTATION_ENABLED', default=True, cast=bool),
+    'SAMPLE_RATE': config('INSTRUMENTATION_SAMPLE_RATE', default=0.1, cast=float),
+    'SERVER_TIMING': config('INSTRUMENTATION_SERVER_TIMING', default=False, cast=bool),
+    'N_PLUS_ONE_THRESHOLD': 5,
+    'PROFILE_SLOW_MS': config('INSTRUMENTATION_PROFILE_SLOW_MS', default=0, cast=float),
+    'PROFILE_SAMPLE_RATE': config('INSTRUMENTATION_PROFILE_SAMPLE_RATE', default=0.01, cast=float),
+    'PROFILE_DIR': config('INSTRUMENTATION_PROFILE_DIR', default=str(BASE_DIR / 'profiles')),
+    'METRICS_TOKEN': config('METRICS_TOKEN', default=None),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -127,6 +237,21 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+
+# Media files
+# Inventory photos are stored under their content hash in PHOTO_STORAGE,
+# any Django storage backend, with a thumbnail generated at upload time.
+
+MEDIA_ROOT = config('MEDIA_ROOT', default=str(BASE_DIR / 'media'))
+
+PHOTO_STORAGE = {
+    'BACKEND': config('PHOTO_STORAGE_BACKEND', default='django.core.files.storage.FileSystemStorage'),
+    'OPTIONS': {
+        'location': str(Path(MEDIA_ROOT) / 'photos'),
+    },
+    'THUMBNAIL_SIZE': (256, 256),
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
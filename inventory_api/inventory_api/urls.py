@@ -1,9 +1,11 @@
 from django.contrib import admin
 from django.urls import path, include
+from .instrumentation import metrics_view
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('user/', include('user_control.urls')),
     path('app/', include('app_control.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
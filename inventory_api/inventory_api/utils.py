@@ -1,11 +1,78 @@
 import jwt
+import copy
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta          
 from django.conf import settings
 from user_control.models import CustomUser
-from rest_framework.pagination import PageNumberPagination
-from django.db.models import Q
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.parsers import BaseParser
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+from rest_framework.decorators import action
+import base64
+import codecs
+import csv
+import json
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import F, Func, Q
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
 import re
 
+
+class TTLCache:
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self.lock:
+            self.items[key] = (value, expires_at)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+_auth_cache_config = getattr(settings, "JWT_AUTH_CACHE", {})
+user_cache = TTLCache(_auth_cache_config.get("USER_CACHE_SIZE", 1024), _auth_cache_config.get("USER_TTL", 60))
+token_cache = TTLCache(_auth_cache_config.get("TOKEN_CACHE_SIZE", 4096))
+
+
+def invalidate_cached_user(sender, instance, **kwargs):
+    user_cache.delete(instance.id)
+
 def get_access_token(payload, days):
     token = jwt.encode(
         {"exp": datetime.now() + timedelta(days=days), **payload}, 
@@ -15,27 +82,274 @@ def get_access_token(payload, days):
 
     return token
 
-def decodeJWT(bearer):
+def get_token_user_id(bearer):
     if not bearer:
         return None
 
     token = bearer[7:]
 
-    try:
-        decoded= jwt.decode(
-            token, key=settings.SECERET_KEY, algorithms="HS256"
-        )
-    except Exception:
+    # A token that was verified before skips the signature check until its
+    # own expiry; the user it points to is cached for USER_TTL seconds and
+    # evicted as soon as the user row is saved or deleted.
+    user_id = token_cache.get(token)
+    if user_id is None:
+        try:
+            decoded= jwt.decode(
+                token, key=settings.SECRET_KEY, algorithms="HS256"
+            )
+        except Exception:
+            return None
+
+        if not decoded:
+            return None
+
+        user_id = decoded["user_id"]
+        token_cache.set(token, user_id, ttl=decoded["exp"] - time.time() if "exp" in decoded else None)
+    return user_id
+
+def decodeJWT(bearer):
+    user_id = get_token_user_id(bearer)
+    if user_id is None:
         return None
 
-    if decoded:
+    user = user_cache.get(user_id)
+    if user is None:
         try:
-            return CustomUser.objects.get(id=decoded["user_id"])
+            user = CustomUser.objects.get(id=user_id)
         except Exception:
             return None
+        user_cache.set(user_id, user)
+
+    if not user.is_active:
+        return None
+
+    return copy.copy(user)
+
+async def adecodeJWT(bearer):
+    # Same as decodeJWT, but a user missing from the cache is loaded with the
+    # async ORM so the event loop is not blocked on the query.
+    user_id = get_token_user_id(bearer)
+    if user_id is None:
+        return None
+
+    user = user_cache.get(user_id)
+    if user is None:
+        try:
+            user = await CustomUser.objects.aget(id=user_id)
+        except Exception:
+            return None
+        user_cache.set(user_id, user)
+
+    if not user.is_active:
+        return None
+
+    return copy.copy(user)
+
+class NDJSONParser(BaseParser):
+    media_type = "application/x-ndjson"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        items = []
+        if stream is None:
+            return items
+        try:
+            for line in codecs.iterdecode(stream, "utf-8"):
+                if line.strip():
+                    items.append(json.loads(line))
+        except ValueError as e:
+            raise ParseError(f"NDJSON parse error - {e}")
+        return items
+
+
+class KeysetPagination(BasePagination):
+    # Pages are keyed on (created_at, id) so deep pages cost the same as the
+    # first one: no OFFSET, and no COUNT(*) unless ?count=true is passed.
+    page_size = 20
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.count = None
+        if request.query_params.get(self.count_query_param, "").lower() == "true":
+            self.count = queryset.count()
+
+        queryset = queryset.order_by("-created_at", "-id")
+        cursor = self.decode_cursor(request.query_params.get(self.cursor_query_param))
+        if cursor:
+            # The created_at__lte bound alone is what lets the (created_at,
+            # id) index seek to the cursor; the OR only trims the tie.
+            created_at, last_id = cursor
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=last_id),
+                created_at__lte=created_at
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+        self.last = results[-1] if results else None
+        return results
+
+    def get_paginated_response(self, data):
+        response = {"next": self.get_next_link()}
+        if self.count is not None:
+            response["count"] = self.count
+        response["results"] = data
+        return Response(response)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, "page")
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last))
+
+    def encode_cursor(self, obj):
+        # Pages read with .values() hold dicts rather than instances.
+        created_at, obj_id = (obj["created_at"], obj["id"]) if isinstance(obj, dict) else (obj.created_at, obj.id)
+        position = f"{created_at.isoformat()}|{obj_id}"
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            created_at, last_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            return datetime.fromisoformat(created_at), int(last_id)
+        except ValueError:
+            raise ValidationError({"cursor": ["Invalid cursor"]})
+
 
 class CustomPagination(PageNumberPagination):
     page_size = 20
+    pagination_query_param = "pagination"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.use_keyset(request, view):
+            self.keyset = KeysetPagination()
+            self.keyset.page_size = self.page_size
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def use_keyset(self, request, view):
+        mode = request.query_params.get(self.pagination_query_param)
+        if mode is None:
+            mode = getattr(view, "pagination_mode", "page")
+        return mode == "cursor" or KeysetPagination.cursor_query_param in request.query_params
+
+
+# Query params read by pagination, exports and fieldsets rather than used as
+# filters.
+reserved_query_params = ("page", "cursor", "count", "pagination", "output", "fields", "expand")
+
+# Lookups a view can allow on a field in its filter_fields.
+id_lookups = ("exact", "in")
+relation_lookups = ("exact", "in", "isnull")
+text_lookups = ("exact", "in", "icontains", "istartswith")
+range_lookups = ("exact", "lt", "lte", "gt", "gte")
+date_lookups = ("exact", "date", "lt", "lte", "gt", "gte")
+
+
+def filter_by_query_params(queryset, params, filter_fields):
+    # Applies ?field=value and ?field__lookup=value params, but only the
+    # fields and lookups listed in filter_fields ({field: lookups}), so a
+    # param can't reach into related models (created_by__password__...).
+    # Unknown params and values of the wrong type are a 400.
+    filters = {}
+    for param, value in params.items():
+        if param in filter_fields:
+            field, lookup = param, "exact"
+        else:
+            field, _, lookup = param.rpartition("__")
+        if lookup not in filter_fields.get(field, ()):
+            raise ValidationError({param: ["Filtering on this field is not supported"]})
+        if lookup == "in":
+            value = value.split(",")
+        elif lookup == "isnull":
+            value = value.lower() in ("true", "1")
+        filters[f"{field}__{lookup}"] = value
+
+    try:
+        return queryset.filter(**filters)
+    except (ValueError, TypeError, DjangoValidationError) as e:
+        raise ValidationError({"filters": [str(e)]})
+
+
+class EchoBuffer:
+    def write(self, value):
+        return value
+
+
+class ExportMixin:
+    # Adds /<resource>/export, streaming every row that matches the list
+    # filters as CSV, or NDJSON with ?output=ndjson. Rows are read as tuples
+    # through a server-side cursor and written out in blocks, gzipped on the
+    # fly when the client accepts it, so memory stays flat however many rows
+    # there are.
+    export_fields = ()
+    export_filename = "export"
+    export_chunk_size = 2000
+    export_block_size = 64 * 1024
+
+    @action(detail=False, methods=["get"], url_path="export")
+    def export(self, request, *args, **kwargs):
+        output = request.query_params.get("output", "csv")
+        if output not in ("csv", "ndjson"):
+            raise ValidationError({"output": ["output must be either csv or ndjson"]})
+
+        columns = [field.replace("__", "_") for field in self.export_fields]
+        rows = self.get_export_queryset().values_list(*self.export_fields).iterator(
+            chunk_size=self.export_chunk_size
+        )
+        content = self.get_export_blocks(self.export_csv(columns, rows) if output == "csv"
+                                         else self.export_ndjson(columns, rows))
+
+        gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+        response = StreamingHttpResponse(
+            compress_sequence(content) if gzip else content,
+            content_type="text/csv" if output == "csv" else "application/x-ndjson"
+        )
+        response["Content-Disposition"] = f'attachment; filename="{self.export_filename}.{output}"'
+        if gzip:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+    def get_export_queryset(self):
+        return self.filter_queryset(self.get_queryset())
+
+    def export_csv(self, columns, rows):
+        writer = csv.writer(EchoBuffer())
+        yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow(row)
+
+    def export_ndjson(self, columns, rows):
+        for row in rows:
+            yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + "\n"
+
+    def get_export_blocks(self, lines):
+        # Joining lines into larger blocks keeps the number of writes (and
+        # gzip flushes) low without holding more than one block at a time.
+        block = []
+        size = 0
+        for line in lines:
+            block.append(line)
+            size += len(line)
+            if size >= self.export_block_size:
+                yield "".join(block).encode()
+                block = []
+                size = 0
+        if block:
+            yield "".join(block).encode()
+
 
 def normalize_query(query_string, findterms=re.compile(r'"([^"]+)"|(\S+)').findall, normspace=re.compile(r'\s{2,}').sub):
     return [normspace(' ', (t[0] or t[1]).strip()) for t in findterms(query_string)]
@@ -56,6 +370,55 @@ def get_query(query_string, search_fields):
             query = or_query
         else:
             query = query & or_query
-        return query
+    return query
+
+
+def search_queryset(queryset, query_string):
+    # Matches every term against the model's stored search_document. On
+    # PostgreSQL the icontains lookups are served by the pg_trgm GIN index and
+    # results are ranked by trigram word similarity to the whole query.
+    for term in normalize_query(query_string):
+        queryset = queryset.filter(search_document__icontains=term.lower())
+
+    if connection.vendor == "postgresql":
+        from django.contrib.postgres.search import TrigramWordSimilarity
+        queryset = queryset.annotate(
+            search_rank=TrigramWordSimilarity(query_string.lower(), "search_document")
+        ).order_by("-search_rank", "-created_at", "-id")
+    return queryset
+
+
+def scalar_query(queryset, function, field="id"):
+    # Reduces a queryset to one aggregate column with no GROUP BY, e.g.
+    # SELECT COUNT(id) FROM ..., to be used as a scalar subquery.
+    return queryset.order_by().annotate(value=Func(F(field), function=function)).values("value")
+
+
+def select_scalars(using=DEFAULT_DB_ALIAS, **queries):
+    # Runs independent scalar queries as the columns of a single SELECT, so
+    # they cost one round trip and all read the same snapshot.
+    connection = connections[using]
+    columns = []
+    params = []
+    for alias, queryset in queries.items():
+        sql, query_params = queryset.query.get_compiler(using).as_sql()
+        columns.append(f"({sql}) AS {connection.ops.quote_name(alias)}")
+        params.extend(query_params)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {', '.join(columns)}", params)
+        return dict(zip(queries, cursor.fetchone()))
+
 
-        
\ No newline at end of file
+@contextmanager
+def snapshot_transaction(using=DEFAULT_DB_ALIAS):
+    # Every query inside reads the same snapshot of the database. PostgreSQL
+    # needs REPEATABLE READ for that; a SQLite transaction already reads from
+    # one snapshot. Inside an outer transaction its isolation level is kept.
+    connection = connections[using]
+    outermost = not connection.in_atomic_block
+    with transaction.atomic(using=using):
+        if outermost and connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        yield
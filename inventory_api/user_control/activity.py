@@ -0,0 +1,135 @@
+import atexit
+import queue
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+from .models import UserActivities
+
+
+class ActivityWriter:
+
+    def __init__(self, asynchronous=True, batch_size=100, flush_interval=1.0, max_queue_size=10000):
+        self.asynchronous = asynchronous
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.flushed = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def add(self, activity):
+        if not self.asynchronous:
+            activity.save()
+            self.count(flushed=1)
+            return
+
+        self.start()
+        try:
+            self.queue.put_nowait(activity)
+        except queue.Full:
+            self.count(dropped=1)
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="activity-writer", daemon=True)
+                self.thread.start()
+                atexit.register(self.shutdown)
+
+    def run(self):
+        while not (self.stopping.is_set() and self.queue.empty()):
+            batch = self.collect()
+            if batch:
+                close_old_connections()
+                self.write(batch)
+
+    def collect(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, batch):
+        try:
+            UserActivities.objects.bulk_create(batch)
+        except Exception:
+            self.write_each(batch)
+        else:
+            self.count(flushed=len(batch))
+
+    def write_each(self, batch):
+        # One bad row, e.g. a user deleted before the flush, fails the whole
+        # INSERT; retrying the rows one by one only drops the bad ones.
+        for activity in batch:
+            activity.pk = None
+            activity._state.adding = True
+            try:
+                activity.save(force_insert=True)
+            except Exception:
+                self.count(dropped=1)
+            else:
+                self.count(flushed=1)
+
+    def flush(self):
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self.write(batch)
+
+    def shutdown(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.flush_interval * 2)
+        self.flush()
+
+    def count(self, flushed=0, dropped=0):
+        with self.lock:
+            self.flushed += flushed
+            self.dropped += dropped
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queued": self.queue.qsize(),
+                "flushed": self.flushed,
+                "dropped": self.dropped
+            }
+
+
+_activity_writer = None
+_activity_writer_lock = threading.Lock()
+
+
+def get_activity_writer():
+    global _activity_writer
+
+    if _activity_writer is None:
+        with _activity_writer_lock:
+            if _activity_writer is None:
+                config = getattr(settings, "USER_ACTIVITY_LOG", {})
+                _activity_writer = ActivityWriter(
+                    asynchronous=config.get("ASYNC", False),
+                    batch_size=config.get("BATCH_SIZE", 100),
+                    flush_interval=config.get("FLUSH_INTERVAL", 1.0),
+                    max_queue_size=config.get("MAX_QUEUE_SIZE", 10000)
+                )
+    return _activity_writer
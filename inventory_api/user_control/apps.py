@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class UserControlConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'user_control'
+
+    def ready(self):
+        from django.db.models.signals import post_save, post_delete
+        from inventory_api.utils import invalidate_cached_user
+        from .models import CustomUser
+
+        post_save.connect(invalidate_cached_user, sender=CustomUser)
+        post_delete.connect(invalidate_cached_user, sender=CustomUser)
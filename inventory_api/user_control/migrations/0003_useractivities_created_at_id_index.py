@@ -0,0 +1,17 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_control', '0002_useractivities'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='useractivities',
+            index=models.Index(fields=['-created_at', '-id'], name='user_activity_created_idx'),
+        ),
+    ]
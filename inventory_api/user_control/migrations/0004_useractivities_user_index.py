@@ -0,0 +1,17 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_control', '0003_useractivities_created_at_id_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='useractivities',
+            index=models.Index(fields=['user', '-created_at'], name='user_activity_user_idx'),
+        ),
+    ]
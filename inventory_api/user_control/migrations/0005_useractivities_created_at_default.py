@@ -0,0 +1,19 @@
+# Generated by Django 4.1.4 on 2026-10-18 19:58
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_control', '0004_useractivities_user_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='useractivities',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
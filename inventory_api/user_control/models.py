@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 
 
@@ -53,10 +54,15 @@ class UserActivities(models.Model):
     email = models.EmailField()
     fullname = models.CharField(max_length=256)
     action = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the activity happens rather than when the writer flushes it.
+    created_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
         ordering = ("-created_at", )
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="user_activity_created_idx"),
+            models.Index(fields=["user", "-created_at"], name="user_activity_user_idx"),
+        ]
 
     def __str__(self):
         return f"{self.fullname} {self.action} on {self.created_at.strftime('%d-%m-%Y %H:%M')}"
\ No newline at end of file
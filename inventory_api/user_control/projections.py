@@ -0,0 +1,6 @@
+from inventory_api.projections import Projection
+from .serializers import CustomUserSerializer
+
+
+class UserProjection(Projection):
+    serializer_class = CustomUserSerializer
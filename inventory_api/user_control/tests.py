@@ -1,3 +1,195 @@
-from django.test import TestCase
+import zlib
+from unittest import mock
+from django.test import TestCase, TransactionTestCase, tag
+from rest_framework.test import APIClient
+from app_control.management.commands.benchmark_api import PeakMemory
+from inventory_api.utils import get_access_token, user_cache, token_cache
+from .activity import ActivityWriter
+from .models import CustomUser, UserActivities
 
-# Create your tests here.
+
+class ActivityWriterTests(TransactionTestCase):
+    # The writer commits from its own thread, outside any test transaction.
+
+    def setUp(self):
+        self.user = CustomUser.objects.create(email="writer@example.com", fullname="Writer", role="admin")
+
+    def make_activity(self, action, user=None):
+        user = user or self.user
+        return UserActivities(user_id=user.id, email=user.email, fullname=user.fullname, action=action)
+
+    def test_synchronous_writer_saves_immediately(self):
+        writer = ActivityWriter(asynchronous=False)
+        writer.add(self.make_activity("Logged in"))
+
+        self.assertEqual(UserActivities.objects.filter(action="Logged in").count(), 1)
+        self.assertEqual(writer.stats(), {"queued": 0, "flushed": 1, "dropped": 0})
+
+    def test_shutdown_flushes_the_queue_with_enqueue_times(self):
+        writer = ActivityWriter(asynchronous=True, batch_size=100, flush_interval=0.05)
+        activities = [self.make_activity(f"Action {number}") for number in range(5)]
+        for activity in activities:
+            writer.add(activity)
+        writer.shutdown()
+
+        self.assertEqual(writer.stats(), {"queued": 0, "flushed": 5, "dropped": 0})
+        saved = dict(UserActivities.objects.values_list("action", "created_at"))
+        self.assertEqual(saved, {activity.action: activity.created_at for activity in activities})
+
+    def test_bad_row_only_drops_itself(self):
+        deleted = CustomUser.objects.create(email="deleted@example.com", fullname="Deleted", role="sales")
+        batch = [self.make_activity("First"), self.make_activity("Orphan", deleted), self.make_activity("Last")]
+        deleted.delete()
+
+        writer = ActivityWriter(asynchronous=False)
+        writer.write(batch)
+
+        self.assertEqual(writer.stats(), {"queued": 0, "flushed": 2, "dropped": 1})
+        self.assertEqual(sorted(UserActivities.objects.values_list("action", flat=True)), ["First", "Last"])
+
+
+class CachedAuthenticationTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        user_cache.clear()
+        token_cache.clear()
+        self.user = CustomUser.objects.create(email="auth@example.com", fullname="Auth", role="admin")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_access_token({'user_id': self.user.id}, 1)}")
+
+    def get_activities(self):
+        return self.client.get("/user/activities-log")
+
+    def test_repeat_requests_skip_the_user_query(self):
+        self.assertEqual(self.get_activities().status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_activities().status_code, 200)
+
+    def test_deactivated_user_is_rejected_at_once(self):
+        self.assertEqual(self.get_activities().status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_activities().status_code, 403)
+
+    def test_password_change_evicts_the_cached_user(self):
+        self.assertEqual(self.get_activities().status_code, 200)
+        self.user.set_password("changed")
+        self.user.save()
+        self.assertIsNone(user_cache.get(self.user.id))
+
+    def test_deactivation_without_signals_is_rejected_after_the_ttl(self):
+        # A queryset update() skips post_save, so the cached user lives on
+        # until its TTL runs out, and not a request longer.
+        with mock.patch.object(user_cache, "ttl", 0.2), mock.patch("inventory_api.utils.time.monotonic") as now:
+            now.return_value = 1000.0
+            self.assertEqual(self.get_activities().status_code, 200)
+            CustomUser.objects.filter(id=self.user.id).update(is_active=False)
+
+            now.return_value = 1000.1
+            self.assertEqual(self.get_activities().status_code, 200)
+            now.return_value = 1000.2
+            self.assertEqual(self.get_activities().status_code, 403)
+
+    def test_invalid_tokens_are_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer not-a-token")
+        self.assertEqual(self.get_activities().status_code, 403)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_access_token({'user_id': self.user.id}, -1)}")
+        self.assertEqual(self.get_activities().status_code, 403)
+
+
+class MeTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        user_cache.clear()
+        token_cache.clear()
+        self.user = CustomUser.objects.create(email="me@example.com", fullname="Me", role="admin")
+
+    def test_returns_the_signed_in_user(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_access_token({'user_id': self.user.id}, 1)}")
+        response = self.client.get("/user/me")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"email": "me@example.com", "fullname": "Me", "role": "admin"})
+
+        response = self.client.get("/user/me", {"fields": "email,role"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"email": "me@example.com", "role": "admin"})
+
+    def test_requires_authentication(self):
+        self.assertEqual(self.client.get("/user/me").status_code, 403)
+
+
+class ExportTests(TestCase):
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email="export@example.com", fullname="Export", role="admin")
+        UserActivities.objects.bulk_create([
+            UserActivities(user_id=cls.user.id, email=cls.user.email, fullname=cls.user.fullname,
+                           action=f"Exported action {number}")
+            for number in range(3)
+        ])
+
+    def setUp(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_access_token({'user_id': self.user.id}, 1)}")
+
+    def test_csv_and_ndjson_outputs(self):
+        response = self.client.get("/user/activities-log/export")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(b"".join(response.streaming_content).count(b"\n"), 4)
+
+        response = self.client.get("/user/activities-log/export", {"output": "ndjson"})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 3)
+
+    def test_rejects_unsupported_outputs(self):
+        response = self.client.get("/user/activities-log/export", {"output": "xlsx"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"output": ["output must be either csv or ndjson"]})
+
+
+@tag("slow")
+class ExportMemoryTests(TestCase):
+    # Streams a million activities and checks that the process grew by less
+    # than a fixed ceiling while doing so. Run the rest of the suite without
+    # it with --exclude-tag slow.
+    client_class = APIClient
+    rows = 1000000
+    ceiling_mb = 32
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email="export@example.com", fullname="Export", role="admin")
+        for offset in range(0, cls.rows, 10000):
+            UserActivities.objects.bulk_create([
+                UserActivities(user_id=cls.user.id, email=cls.user.email, fullname=cls.user.fullname,
+                               action=f"Exported action {number}")
+                for number in range(offset, offset + 10000)
+            ])
+
+    def setUp(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_access_token({'user_id': self.user.id}, 1)}")
+
+    def test_csv_export_stays_under_the_ceiling(self):
+        response = self.client.get("/user/activities-log/export")
+        lines = 0
+        with PeakMemory() as memory:
+            for block in response.streaming_content:
+                lines += block.count(b"\n")
+
+        self.assertEqual(lines, self.rows + 1)
+        self.assertLess(memory.growth_mb, self.ceiling_mb)
+
+    def test_gzipped_ndjson_export_stays_under_the_ceiling(self):
+        response = self.client.get("/user/activities-log/export", {"output": "ndjson"}, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        lines = 0
+        with PeakMemory() as memory:
+            for block in response.streaming_content:
+                lines += decompressor.decompress(block).count(b"\n")
+
+        self.assertEqual(lines, self.rows)
+        self.assertLess(memory.growth_mb, self.ceiling_mb)
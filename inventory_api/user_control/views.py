@@ -1,22 +1,26 @@
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.response import Response
 from rest_framework import status
-from .serializers import CreateUserSerializer, LoginSerializer, UpadtePasswordSerializer, CustomUserSerializer,CustomUser, UserActivities, UserActivitiesSerializer
+from .serializers import CreateUserSerializer, LoginSerializer, UpadtePasswordSerializer, CustomUser, UserActivities, UserActivitiesSerializer
 from django.contrib.auth import authenticate
+from django.db import transaction
 from datetime import datetime
-from inventory_api.utils import get_access_token
+from inventory_api.utils import get_access_token, CustomPagination, ExportMixin
 from inventory_api.custom_methods import IsAuthenticatedCustom
+from inventory_api.fieldsets import FieldsetMixin
+from .activity import get_activity_writer
 
 
 
 
 def add_user_activity(user, action):
-    UserActivities.objects.create(
+    activity = UserActivities(
         user_id = user.id,
         email = user.email,
         fullname = user.fullname,
         action = action
     )
+    transaction.on_commit(lambda: get_activity_writer().add(activity))
 
 
 class CreateUserView(ModelViewSet):
@@ -106,30 +110,38 @@ class UpdatePassword(ModelViewSet):
         return Response({"success": "Password Updated Successfully!"})
 
 
-class MeView(ModelViewSet):
+class MeView(FieldsetMixin, ModelViewSet):
     serializer_class = CreateUserSerializer
     http_method_names = ["get"]
     queryset = CustomUser.objects.all()
-    permission_classes = (IsAuthenticatedCustom)
+    permission_classes = (IsAuthenticatedCustom,)
 
     def list(self, request):
-        data = self.serializer_class(request.user).data
+        data = self.get_serializer(request.user).data
         return Response(data)
 
-class UserActivitiesView(ModelViewSet):
+class UserActivitiesView(FieldsetMixin, ExportMixin, ModelViewSet):
     serializer_class = UserActivitiesSerializer
     http_method_names = ["get"]
     queryset = UserActivities.objects.all()
     permission_classes = (IsAuthenticatedCustom,)
+    pagination_class = CustomPagination
+    pagination_mode = "cursor"
+
+    export_fields = ("id", "user_id", "email", "fullname", "action", "created_at")
+    export_filename = "activities"
+
+    def get_export_queryset(self):
+        return self.queryset.order_by("-created_at", "-id")
 
 
-class UsersView(ModelViewSet):
+class UsersView(FieldsetMixin, ModelViewSet):
     serializer_class = CreateUserSerializer
     http_method_names = ["get"]
     queryset = CustomUser.objects.all()
     permission_classes = (IsAuthenticatedCustom, )
 
     def list(self, request):
-        users = self.queryset.filter(is_superuser=False)
-        data = self.serializer_class(users, many=True).data
+        users = self.filter_queryset(self.queryset.filter(is_superuser=False))
+        data = self.get_serializer(users, many=True).data
         return Response(data)
\ No newline at end of file